@@ -10,16 +10,20 @@ def get_all():
         cmd = "GET *\n"
         s.sendall(cmd.encode())
 
+        # The reply can be split anywhere, also inside the terminating line
+        done = f'*{cmd}'.encode()
+        tail = b''
         while True:
             reply = s.recv(64*1024)
 
             if reply:
-                reply = reply.decode()
-                print(reply)
+                print(reply.decode(errors='replace'), end='')
 
-            if not reply or f'*{cmd}' in reply:
+            if not reply or done in tail + reply:
                 break
 
+            tail = (tail + reply)[-len(done):]
+
         
 def subscribe_all():
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -1,39 +1,44 @@
-# SPDX-License-Identifier: MIT
-
-from zeroconf import ServiceBrowser, ServiceListener, Zeroconf
-
-class MyListener(ServiceListener):
-    def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        print(f"Service {name} updated")
-
-    def remove_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        print(f"Service {name} removed")
-
-    def add_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        info = zc.get_service_info(type_, name)
-        
-        print(f"Device added: {info.name}")
-
-        p = info.properties
-        api_version = p.get(b'api_version', b'').decode()
-        serial = p.get(b'serial', b'').decode()
-        vendor = p.get(b'vendor', b'').decode()
-        model = p.get(b'model', b'').decode()
-        device_class = p.get(b'device_class', b'').decode()
-        firmware_version = p.get(b'firmware_version', b'').decode()
-        
-        print(f"    Vendor:  {vendor}")
-        print(f"    Model:   {model}")
-        print(f"    Serial:  {serial}")
-        print(f"    Class:   {device_class}")
-        print(f"    API Ver: {api_version}")
-        print(f"    FW Ver:  {firmware_version}")
-
-
-zeroconf = Zeroconf()
-listener = MyListener()
-browser = ServiceBrowser(zeroconf, "_pasconnect._tcp.local.", listener)
-try:
-    input("Press enter to exit...\n\n")
-finally:
-    zeroconf.close()
\ No newline at end of file
+# SPDX-License-Identifier: MIT
+
+from registry import CACHE_FILE, Discovery
+
+import asyncio
+
+
+def print_device(event: str, device) -> None:
+    if event == 'removed':
+        print(f"Device removed: {device.name}")
+        return
+
+    print(f"Device {event}: {device.name}")
+    print(f"    Host:    {device.address}")
+    print(f"    Vendor:  {device.vendor}")
+    print(f"    Model:   {device.model}")
+    print(f"    Serial:  {device.serial}")
+    print(f"    Class:   {device.device_class}")
+    print(f"    API Ver: {device.api_version}")
+    print(f"    FW Ver:  {device.firmware_version}")
+
+
+async def async_main():
+    discovery = Discovery()
+    discovery.registry.add_listener(print_device)
+    cached = discovery.registry.load(CACHE_FILE)
+    if cached:
+        print(f"{cached} device(s) from {CACHE_FILE}, confirming...\n")
+
+    await discovery.start()
+    try:
+        print("Press Ctrl+C to exit...\n\n")
+        while True:
+            await asyncio.sleep(10)
+            discovery.registry.save(CACHE_FILE)
+    finally:
+        await discovery.stop()
+        discovery.registry.save(CACHE_FILE)
+
+
+try:
+    asyncio.run(async_main())
+except KeyboardInterrupt:
+    pass
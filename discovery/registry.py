@@ -0,0 +1,306 @@
+# SPDX-License-Identifier: MIT
+
+# Registry of the devices announcing _pasconnect._tcp, kept up to date by an
+# asyncio mDNS browser. Devices not confirmed within `ttl` seconds expire.
+# The registry can be saved to disk so the next run starts with the devices
+# seen last time instead of an empty list.
+
+import asyncio
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+SERVICE_TYPE = '_pasconnect._tcp.local.'
+CACHE_FILE = 'devices.json'
+TTL = 120.0
+# Cached devices older than this are not loaded at all
+CACHE_MAX_AGE = 24 * 3600.0
+
+_PROPERTIES = ('serial', 'model', 'vendor', 'device_class', 'firmware_version', 'api_version')
+
+
+class Device:
+    def __init__(self, name: str, host: str, port: int = 0, **properties) -> None:
+        self.name = name
+        self.host = host
+        self.port = port
+        self.serial: str = properties.get('serial', '')
+        self.model: str = properties.get('model', '')
+        self.vendor: str = properties.get('vendor', '')
+        self.device_class: str = properties.get('device_class', '')
+        self.firmware_version: str = properties.get('firmware_version', '')
+        self.api_version: str = properties.get('api_version', '')
+        # Wall clock time of the last announcement or successful resolve
+        self.last_seen = time.time()
+        # False until confirmed on the network in this run
+        self.live = True
+
+    @property
+    def address(self) -> str:
+        # 'host:port' to connect to, just the host for the default HTTP port
+        host = f'[{self.host}]' if ':' in self.host else self.host
+        return host if self.port in (0, 80) else f'{host}:{self.port}'
+
+    @classmethod
+    def from_info(cls, info) -> 'Device':
+        # zeroconf ServiceInfo -> Device
+        p = info.properties or {}
+        properties = {key: (p.get(key.encode()) or b'').decode() for key in _PROPERTIES}
+        addresses = info.parsed_addresses()
+        return cls(info.name, addresses[0] if addresses else '', info.port or 0, **properties)
+
+    def to_dict(self) -> dict:
+        d = {'name': self.name, 'host': self.host, 'port': self.port}
+        for key in _PROPERTIES:
+            d[key] = getattr(self, key)
+        d['last_seen'] = self.last_seen
+        return d
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'Device':
+        device = cls(d['name'], d['host'], d.get('port', 0), **{key: d.get(key, '') for key in _PROPERTIES})
+        device.last_seen = d.get('last_seen', 0.0)
+        device.live = False
+        return device
+
+    def same_as(self, other: 'Device') -> bool:
+        keys = ('name', 'host', 'port') + _PROPERTIES
+        return all(getattr(self, key) == getattr(other, key) for key in keys)
+
+    def __str__(self) -> str:
+        return f'{self.name} {self.address} {self.vendor} {self.model} {self.serial} FW {self.firmware_version}'
+
+
+class DeviceRegistry:
+    def __init__(self, ttl: float = TTL) -> None:
+        self.ttl = ttl
+        self._devices: Dict[str, Device] = {}
+        self._expires: Dict[str, float] = {}
+        self._by_serial: Dict[str, str] = {}
+        # By address, devices may share a host on different ports
+        self._by_address: Dict[str, str] = {}
+        self._by_model: Dict[str, set] = {}
+        self._changed = asyncio.Event()
+        self._listeners: List[Callable] = []
+
+    # --- updates ---
+
+    def add(self, device: Device) -> None:
+        old = self._devices.get(device.name)
+        if old is not None:
+            self._unindex(old)
+        self._devices[device.name] = device
+        self._expires[device.name] = time.monotonic() + self.ttl
+        self._index(device)
+        self._notify('added' if old is None else 'updated', device)
+
+    def touch(self, name: str) -> None:
+        device = self._devices.get(name)
+        if device is not None:
+            confirmed = not device.live
+            device.last_seen = time.time()
+            device.live = True
+            self._expires[name] = time.monotonic() + self.ttl
+            if confirmed:
+                # Cached device seen on the network again
+                self._notify('updated', device)
+
+    def remove(self, name: str) -> Optional[Device]:
+        device = self._devices.pop(name, None)
+        if device is not None:
+            del self._expires[name]
+            self._unindex(device)
+            self._notify('removed', device)
+        return device
+
+    def expire(self) -> List[Device]:
+        now = time.monotonic()
+        return [self.remove(name) for name, t in list(self._expires.items()) if t <= now]
+
+    def add_listener(self, callback: Callable) -> None:
+        # callback(event, device) with event 'added', 'updated' or 'removed'.
+        # A cached device confirmed on the network is reported as 'updated'.
+        self._listeners.append(callback)
+
+    def _notify(self, event: str, device: Device) -> None:
+        self._changed.set()
+        for callback in self._listeners:
+            try:
+                callback(event, device)
+            except Exception:
+                pass
+
+    def _index(self, device: Device) -> None:
+        if device.serial:
+            self._by_serial[device.serial] = device.name
+        if device.host:
+            self._by_address[device.address] = device.name
+        if device.model:
+            self._by_model.setdefault(device.model, set()).add(device.name)
+
+    def _unindex(self, device: Device) -> None:
+        if self._by_serial.get(device.serial) == device.name:
+            del self._by_serial[device.serial]
+        if self._by_address.get(device.address) == device.name:
+            del self._by_address[device.address]
+        names = self._by_model.get(device.model)
+        if names is not None:
+            names.discard(device.name)
+            if not names:
+                del self._by_model[device.model]
+
+    # --- lookup ---
+
+    def _get(self, name: Optional[str]) -> Optional[Device]:
+        if name is None:
+            return None
+        if self._expires.get(name, 0) <= time.monotonic():
+            self.remove(name)
+            return None
+        return self._devices[name]
+
+    def __len__(self) -> int:
+        return len(self.devices)
+
+    @property
+    def devices(self) -> List[Device]:
+        self.expire()
+        return list(self._devices.values())
+
+    def by_name(self, name: str) -> Optional[Device]:
+        return self._get(name if name in self._devices else None)
+
+    def by_serial(self, serial: str) -> Optional[Device]:
+        return self._get(self._by_serial.get(serial))
+
+    def by_host(self, host: str) -> Optional[Device]:
+        # host: Device.address, 'ip' or 'ip:port' unless on port 80
+        return self._get(self._by_address.get(host))
+
+    def by_model(self, model: str) -> List[Device]:
+        devices = [self._get(name) for name in list(self._by_model.get(model, ()))]
+        return [device for device in devices if device is not None]
+
+    def find(self, model: Optional[str] = None, live: bool = False) -> List[Device]:
+        devices = self.by_model(model) if model else self.devices
+        return [device for device in devices if device.live or not live]
+
+    async def wait_for(self, count: int, timeout: float, model: Optional[str] = None,
+                       live: bool = True) -> List[Device]:
+        # Waits until at least `count` matching devices are known. Raises
+        # asyncio.TimeoutError if they do not show up within `timeout`.
+        async def wait():
+            while True:
+                devices = self.find(model, live)
+                if len(devices) >= count:
+                    return devices
+                self._changed.clear()
+                await self._changed.wait()
+
+        return await asyncio.wait_for(wait(), timeout)
+
+    # --- warm start cache ---
+
+    def load(self, path: str = CACHE_FILE, max_age: float = CACHE_MAX_AGE) -> int:
+        # Cached devices stay for `ttl` unless the browser confirms them
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return 0
+
+        now = time.time()
+        count = 0
+        for d in entries:
+            try:
+                device = Device.from_dict(d)
+            except (KeyError, TypeError):
+                continue
+            if now - device.last_seen > max_age or device.name in self._devices:
+                continue
+            self.add(device)
+            count += 1
+        return count
+
+    def save(self, path: str = CACHE_FILE) -> None:
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump([device.to_dict() for device in self.devices], f, indent=2)
+        os.replace(tmp, path)
+
+
+class Discovery:
+    # Browses for devices and feeds them into a DeviceRegistry. Known devices
+    # are resolved again every ttl / 2 seconds, a device that does not answer
+    # expires from the registry.
+
+    def __init__(self, registry: Optional[DeviceRegistry] = None, service_type: str = SERVICE_TYPE) -> None:
+        self.registry = registry or DeviceRegistry()
+        self._service_type = service_type
+        self._zeroconf = None
+        self._browser = None
+        self._refresh = None
+        self._tasks = set()
+
+    async def start(self) -> None:
+        from zeroconf import ServiceStateChange
+        from zeroconf.asyncio import AsyncServiceBrowser, AsyncZeroconf
+
+        def on_change(zeroconf, service_type, name, state_change):
+            if state_change is ServiceStateChange.Removed:
+                self.registry.remove(name)
+            else:
+                self._spawn(self._resolve(service_type, name))
+
+        self._zeroconf = AsyncZeroconf()
+        self._browser = AsyncServiceBrowser(self._zeroconf.zeroconf, [self._service_type],
+                                            handlers=[on_change])
+        self._refresh = asyncio.ensure_future(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh:
+            self._refresh.cancel()
+            self._refresh = None
+        for task in list(self._tasks):
+            task.cancel()
+        if self._browser:
+            await self._browser.async_cancel()
+            self._browser = None
+        if self._zeroconf:
+            await self._zeroconf.async_close()
+            self._zeroconf = None
+
+    async def __aenter__(self) -> DeviceRegistry:
+        await self.start()
+        return self.registry
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, service_type: str, name: str) -> bool:
+        from zeroconf.asyncio import AsyncServiceInfo
+
+        info = AsyncServiceInfo(service_type, name)
+        if not await info.async_request(self._zeroconf.zeroconf, 3000) or not info.parsed_addresses():
+            return False
+
+        device = Device.from_info(info)
+        known = self.registry.by_name(name)
+        if known is not None and known.same_as(device):
+            self.registry.touch(name)
+        else:
+            self.registry.add(device)
+        return True
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.registry.ttl / 2)
+            for device in self.registry.devices:
+                self._spawn(self._resolve(self._service_type, device.name))
+            self.registry.expire()
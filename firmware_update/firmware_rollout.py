@@ -0,0 +1,203 @@
+# SPDX-License-Identifier: MIT
+
+# Firmware update of many devices at once. The image is mapped read-only a
+# single time and every upload streams from that mapping.
+
+from tqdm import tqdm
+
+import aiohttp
+import asyncio
+import mmap
+import os
+import sys
+import time
+from typing import Callable, List, Optional
+
+FIRMWARE_FILE = 'firmware.bin'
+TARGETS = ['192.168.64.100']
+# Also update the devices found on the network (needs zeroconf)
+DISCOVER = False
+DISCOVER_TIME = 5.0
+# Only update discovered devices of this model, None for all
+MODEL = None
+PARALLEL = 16
+RETRIES = 3
+TIMEOUT = 600.0
+
+CHUNK_SIZE = 64 * 1024
+DISCOVERY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'discovery')
+
+
+class TransientError(Exception):
+    pass
+
+
+class FirmwarePayload(aiohttp.Payload):
+    # Request body sent in chunks from a shared buffer, with Content-Length
+    # and a callback per chunk for the progress display.
+
+    def __init__(self, image: memoryview, progress: Callable[[int], None]) -> None:
+        super().__init__(image, content_type='application/octet-stream')
+        self._size = len(image)
+        self._progress = progress
+
+    def decode(self, encoding: str = 'utf-8', errors: str = 'strict') -> str:
+        return str(self._value, encoding, errors)
+
+    async def write(self, writer) -> None:
+        await self.write_with_length(writer, None)
+
+    async def write_with_length(self, writer, content_length: Optional[int]) -> None:
+        end = self._size if content_length is None else min(content_length, self._size)
+        for pos in range(0, end, CHUNK_SIZE):
+            chunk = self._value[pos:min(pos + CHUNK_SIZE, end)]
+            await writer.write(chunk)
+            self._progress(len(chunk))
+
+
+class UpdateResult:
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.ok = False
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.elapsed = 0.0
+
+    def __str__(self) -> str:
+        if self.ok:
+            return f'{self.host}: OK ({self.elapsed:.1f}s, {self.attempts} attempt(s))'
+        return f'{self.host}: FAILED after {self.attempts} attempt(s): {self.error}'
+
+
+async def upload(session: aiohttp.ClientSession, host: str, image: memoryview,
+                 progress: Callable[[int], None]) -> None:
+    payload = FirmwarePayload(image, progress)
+    async with session.post(f'http://{host}/api/firmware', data=payload) as response:
+        if response.status >= 500 or response.status == 429:
+            raise TransientError(f'HTTP {response.status}')
+        if response.status >= 400:
+            raise Exception(f'HTTP {response.status}: {await response.text()}')
+
+
+async def update_device(session: aiohttp.ClientSession, host: str, image: memoryview,
+                        retries: int = RETRIES, progress: Optional[Callable] = None) -> UpdateResult:
+    # progress(host, nbytes) is called for every chunk sent, with a negative
+    # count when a failed attempt is rolled back before a retry.
+    progress = progress or (lambda host, n: None)
+    result = UpdateResult(host)
+    start = time.monotonic()
+
+    while True:
+        result.attempts += 1
+        sent = 0
+
+        def sent_chunk(n):
+            nonlocal sent
+            sent += n
+            progress(host, n)
+
+        try:
+            await upload(session, host, image, sent_chunk)
+            result.ok = True
+            break
+        except (TransientError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            result.error = str(e) or type(e).__name__
+        except Exception as e:
+            result.error = str(e) or type(e).__name__
+            break
+        finally:
+            if not result.ok and sent:
+                progress(host, -sent)
+
+        if result.attempts > retries:
+            break
+        await asyncio.sleep(min(2 ** result.attempts, 30))
+
+    result.elapsed = time.monotonic() - start
+    return result
+
+
+async def rollout(hosts: List[str], image: memoryview, parallel: int = PARALLEL, retries: int = RETRIES,
+                  timeout: float = TIMEOUT, progress: Optional[Callable] = None):
+    # Yields an UpdateResult per device as soon as it is done
+    sem = asyncio.Semaphore(parallel)
+    connector = aiohttp.TCPConnector(limit=parallel)
+    session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+    async def run(host):
+        async with sem:
+            return await update_device(session, host, image, retries, progress)
+
+    tasks = [asyncio.ensure_future(run(host)) for host in hosts]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Stopped early: wait for the cancelled uploads, they hold slices of
+        # the image and use the session
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await session.close()
+
+
+async def discover(duration: float = DISCOVER_TIME, model: Optional[str] = MODEL) -> List[str]:
+    # Addresses of the devices found by discovery/registry.py within `duration`
+    sys.path.insert(0, DISCOVERY_DIR)
+    from registry import Discovery
+
+    async with Discovery() as registry:
+        await asyncio.sleep(duration)
+        return [device.address for device in registry.find(model, live=True)]
+
+
+async def async_main():
+    hosts = list(TARGETS)
+    if DISCOVER:
+        print(f'Discovering devices for {DISCOVER_TIME}s...')
+        found = await discover()
+        hosts += [host for host in found if host not in hosts]
+
+    file_path = os.path.abspath(FIRMWARE_FILE)
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        image = memoryview(m)
+        size = len(image)
+        print(f'Updating {len(hosts)} device(s) with {FIRMWARE_FILE} ({size} bytes), {PARALLEL} in parallel')
+
+        total = tqdm(total=size * len(hosts), unit='B', unit_scale=True, unit_divisor=1024,
+                     desc='total', position=0)
+        bars = {}
+
+        def progress(host, n):
+            if host not in bars:
+                bars[host] = tqdm(total=size, unit='B', unit_scale=True, unit_divisor=1024,
+                                  desc=host, leave=False)
+            bars[host].update(n)
+            total.update(n)
+
+        start = time.monotonic()
+        failed = []
+        try:
+            async for result in rollout(hosts, image, progress=progress):
+                bar = bars.pop(result.host, None)
+                if bar:
+                    bar.close()
+                tqdm.write(str(result))
+                if not result.ok:
+                    failed.append(result.host)
+        finally:
+            for bar in bars.values():
+                bar.close()
+            total.close()
+            image.release()
+
+    elapsed = time.monotonic() - start
+    sent = size * (len(hosts) - len(failed))
+    print(f'{len(hosts) - len(failed)}/{len(hosts)} device(s) updated in {elapsed:.1f}s '
+          f'({sent / max(elapsed, 1e-6) / 1024 / 1024:.1f} MiB/s)')
+    if failed:
+        print(f'Failed: {", ".join(failed)}')
+
+
+if __name__ == '__main__':
+    asyncio.run(async_main())
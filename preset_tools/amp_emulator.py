@@ -0,0 +1,468 @@
+# SPDX-License-Identifier: MIT
+
+# Local stand-in for an amplifier, for benchmarks and tests without hardware.
+# Serves the text protocol on /ws and plain TCP, the JSON-RPC methods the
+# tools use on /jrpc and firmware uploads on /api/firmware:
+#
+#   async with EmulatedAmp(EmulatorConfig(latency=0.002, jitter=0.001)) as amp:
+#       c = Connection()                             # websocket
+#       c = Connection(transport=amp.tcp_transport())  # or TCP
+#       await c.async_connect(amp.host)
+#
+# The commands of a connection are executed one after the other, each takes
+# `process_time`. Responses are delayed by `latency` plus up to `jitter` but
+# never overtake each other. With `error_rate` a command is answered with '#'
+# instead of being executed, with `drop_rate` it is executed but not answered.
+# Firmware uploads fail with HTTP 503 at `error_rate`.
+
+import asyncio
+import base64
+import codecs
+import random
+from array import array
+from collections import deque
+from fnmatch import fnmatchcase
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import WSMsgType, web
+
+from connection import Connection
+from preset import *
+from protocol import LineBuffer, decode_value
+from transport import READ_SIZE, TcpTransport
+from zcp import ZcpError, ZcpPreset
+from zcp_writer import encode_preset
+
+LOCALHOST = '127.0.0.1'
+CHANNELS = 4
+
+
+class EmulatorConfig:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, process_time: float = 0.0,
+                 error_rate: float = 0.0, drop_rate: float = 0.0, jrpc_time: float = 0.0,
+                 jrpc_error_rate: float = 0.0, firmware_time: float = 0.0,
+                 seed: Optional[int] = None) -> None:
+        # Times in seconds, rates from 0 to 1. JSON-RPC calls take latency,
+        # jitter and jrpc_time, firmware updates firmware_time after the upload.
+        self.latency = latency
+        self.jitter = jitter
+        self.process_time = process_time
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.jrpc_time = jrpc_time
+        self.jrpc_error_rate = jrpc_error_rate
+        self.firmware_time = firmware_time
+        self.seed = seed
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class _JrpcError(Exception):
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+class _AmpPreset(ZcpPreset):
+    # The amplifier reads the protected blocks of its own presets
+    def is_protected(self, param: str) -> bool:
+        return False
+
+
+class _Session:
+    # One client connection. Responses are queued with the time they are due
+    # and written in order by a separate task.
+
+    def __init__(self, amp: 'EmulatedAmp', send: Callable) -> None:
+        self.amp = amp
+        self.patterns: List[str] = []
+        self._send = send
+        self._lines = LineBuffer()
+        self._out = deque()
+        self._due = 0.0
+        self._ready = asyncio.Event()
+        self._writer = asyncio.ensure_future(self._write_loop())
+
+    def subscribed(self, reg: str) -> bool:
+        return any(fnmatchcase(reg, pattern) for pattern in self.patterns)
+
+    def push(self, lines: List[str], delay: float) -> None:
+        loop = asyncio.get_event_loop()
+        self._due = max(self._due, loop.time() + delay)
+        self._out.append((self._due, ''.join(line + '\n' for line in lines)))
+        self._ready.set()
+
+    async def _write_loop(self) -> None:
+        loop = asyncio.get_event_loop()
+        try:
+            while 1:
+                while not self._out:
+                    self._ready.clear()
+                    await self._ready.wait()
+
+                delay = self._out[0][0] - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                # Everything due by now goes out in one message
+                now = loop.time()
+                parts = []
+                while self._out and self._out[0][0] <= now:
+                    parts.append(self._out.popleft()[1])
+                await self._send(''.join(parts))
+        except (ConnectionError, RuntimeError):
+            pass
+
+    async def feed(self, data: str) -> None:
+        process_time = self.amp.config.process_time
+        for line in self._lines.feed(data):
+            if process_time:
+                await asyncio.sleep(process_time)
+            self.amp.execute(self, line)
+
+    def close(self) -> None:
+        self._writer.cancel()
+
+
+class EmulatedAmp:
+    def __init__(self, config: Optional[EmulatorConfig] = None, channels: int = CHANNELS,
+                 ip: str = LOCALHOST) -> None:
+        self.config = config or EmulatorConfig()
+        self.channels = channels
+        self.ip = ip
+        self.http_port = 0
+        self.tcp_port = 0
+
+        self.registers: Dict[str, str] = {}
+        self.fir: Dict[int, list] = {}
+        self.stats = {
+            'connections': 0,
+            'commands': 0,
+            'errors': 0,
+            'dropped': 0,
+            'jrpc': 0,
+            'jrpc_errors': 0,
+            'firmware_updates': 0,
+            'firmware_bytes': 0,
+        }
+
+        self._rnd = random.Random(self.config.seed)
+        self._sessions = set()
+        self._runner = None
+        self._tcp_server = None
+        self._jrpc_methods = {
+            'apply_fir': self._apply_fir,
+            'clear_fir': self._clear_fir,
+            'clear_preset': self._clear_preset,
+            'decode_preset': self._decode_preset,
+            'apply_preset': self._apply_preset,
+            'create_preset': self._create_preset,
+        }
+
+        for ch in range(1, channels + 1):
+            self.reset_channel(ch, notify=False)
+
+    @property
+    def host(self) -> str:
+        # Host for Connection.async_connect and JSON-RPC
+        return f'{self.ip}:{self.http_port}'
+
+    def tcp_transport(self) -> TcpTransport:
+        return TcpTransport(self.tcp_port)
+
+    async def start(self, http_port: int = 0, tcp_port: int = 0) -> None:
+        # Port 0 picks a free port
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get('/ws', self._ws_handler)
+        app.router.add_post('/jrpc', self._jrpc_handler)
+        app.router.add_post('/api/firmware', self._firmware_handler)
+        self._runner = web.AppRunner(app, handle_signals=False, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.ip, http_port)
+        await site.start()
+        self.http_port = self._runner.addresses[0][1]
+
+        self._tcp_server = await asyncio.start_server(self._tcp_handler, self.ip, tcp_port)
+        self.tcp_port = self._tcp_server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        for session in list(self._sessions):
+            session.close()
+        if self._tcp_server:
+            self._tcp_server.close()
+            await self._tcp_server.wait_closed()
+            self._tcp_server = None
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> 'EmulatedAmp':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    def _delay(self) -> float:
+        return self.config.latency + self._rnd.uniform(0, self.config.jitter)
+
+    # --- registers ---
+
+    def set_register(self, reg: str, value: str) -> None:
+        # Stores the value and sends it to the subscribed connections
+        if self.registers.get(reg) == value:
+            return
+        self.registers[reg] = value
+        line = [f'+{reg} {value}']
+        for session in self._sessions:
+            if session.subscribed(reg):
+                session.push(line, self._delay())
+
+    def _set_registers(self, regs: list, notify: bool = True) -> None:
+        for reg, value in regs:
+            if notify:
+                self.set_register(reg, value)
+            else:
+                self.registers[reg] = value
+
+    def reset_channel(self, ch: int, notify: bool = True) -> None:
+        self.fir.pop(ch, None)
+        self._set_registers(self._channel_regs(ch, SpeakerPreset()), notify)
+
+    def _channel_regs(self, ch: int, sp: SpeakerPreset) -> list:
+        regs = Connection.preset_regs(ch, sp)
+        regs += Connection.speaker_delay_regs(ch, sp.delay)
+        regs += Connection.fir_regs(ch, sp.fir)
+        return regs
+
+    def channel_preset(self, ch: int) -> SpeakerPreset:
+        # The channel registers as SpeakerPreset. Filled in directly like
+        # PresetArray.preset(), register values are not range checked.
+        def get(name):
+            return decode_value(self.registers[f'OUT-{ch}.{name}'])
+
+        sp = SpeakerPreset()
+        sp._output_mode = OutputMode(get('OUTPUT_MODE'))
+        sp._output_highpass = get('OUTPUT_HIGHPASS') or None
+        sp._polarity = get('POLARITY')
+
+        for i, eq in enumerate(sp._eq):
+            base = f'SPEAKER_EQ-{i + 1}'
+            eq._bypass = bool(get(f'{base}.BYPASS'))
+            eq._type = EqualizerType[get(f'{base}.TYPE')]
+            eq._gain = get(f'{base}.GAIN')
+            eq._freq = get(f'{base}.FREQ')
+            eq._q = get(f'{base}.Q')
+
+        xr = sp._xr
+        xr._bypass = bool(get('XR.BYPASS'))
+        xr._gain = get('XR.GAIN')
+        xr._lowpass_type = CrossoverType[get('XR.LOWPASS_TYPE')]
+        xr._lowpass_freq = get('XR.LOWPASS_FREQUENCY')
+        xr._highpass_type = CrossoverType[get('XR.HIGHPASS_TYPE')]
+        xr._highpass_freq = get('XR.HIGHPASS_FREQUENCY')
+
+        sp._delay._bypass = bool(get('SPEAKER_DELAY.BYPASS'))
+        sp._delay._time = get('SPEAKER_DELAY.TIME') * 48000
+
+        clip = sp._clip_limiter
+        clip._bypass = bool(get('CLIP_LIMITER.BYPASS'))
+        clip._mode = ClipLimiterMode[get('CLIP_LIMITER.MODE')]
+
+        peak = sp._peak_limiter
+        peak._bypass = bool(get('PEAK_LIMITER.BYPASS'))
+        peak._auto = bool(get('PEAK_LIMITER.AUTO'))
+        peak._threshold = get('PEAK_LIMITER.THRESHOLD')
+        peak._attack = get('PEAK_LIMITER.ATTACK')
+        peak._release = get('PEAK_LIMITER.RELEASE')
+        peak._hold = get('PEAK_LIMITER.HOLD')
+        peak._knee = get('PEAK_LIMITER.KNEE')
+
+        rms = sp._rms_limiter
+        rms._bypass = bool(get('RMS_LIMITER.BYPASS'))
+        rms._threshold = get('RMS_LIMITER.THRESHOLD')
+        rms._attack = get('RMS_LIMITER.ATTACK')
+        rms._release = get('RMS_LIMITER.RELEASE')
+        rms._hold = get('RMS_LIMITER.HOLD')
+        rms._knee = get('RMS_LIMITER.KNEE')
+
+        sp._fir._bypass = bool(get('FIR.BYPASS'))
+        sp._fir._taps = self.fir.get(ch, [])
+        return sp
+
+    # --- text protocol ---
+
+    def execute(self, session: _Session, line: str) -> None:
+        self.stats['commands'] += 1
+        cmd = line.strip('\r\n\t ')
+        config = self.config
+
+        drop = config.drop_rate and self._rnd.random() < config.drop_rate
+        if config.error_rate and self._rnd.random() < config.error_rate:
+            lines = [f'#ERROR {cmd}']
+        else:
+            lines = self._command(session, cmd)
+        if drop:
+            self.stats['dropped'] += 1
+            return
+
+        if lines[-1][0] == '#':
+            self.stats['errors'] += 1
+        session.push(lines, self._delay())
+
+    def _command(self, session: _Session, cmd: str) -> List[str]:
+        verb, _, args = cmd.partition(' ')
+
+        if verb == 'GET':
+            lines = [f'+{reg} {value}' for reg, value in self.registers.items() if fnmatchcase(reg, args)]
+            if not lines:
+                return [f'#Unknown register {args}']
+            return lines + [f'*{cmd}']
+
+        if verb == 'SET':
+            reg, _, value = args.partition(' ')
+            if reg not in self.registers or not value:
+                return [f'#Unknown register {reg}']
+            self.set_register(reg, value)
+            return [f'*{cmd}']
+
+        if verb == 'SUBSCRIBE':
+            session.patterns.append(args)
+            lines = [f'+{reg} {value}' for reg, value in self.registers.items() if fnmatchcase(reg, args)]
+            return lines + [f'*{cmd}']
+
+        if verb == 'UNSUBSCRIBE':
+            if args in session.patterns:
+                session.patterns.remove(args)
+            return [f'*{cmd}']
+
+        return [f'#Unknown command {verb}']
+
+    async def _ws_handler(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        session = self._open(ws.send_str)
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    await session.feed(msg.data)
+        finally:
+            self._close(session)
+        return ws
+
+    async def _tcp_handler(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        async def send(data):
+            writer.write(data.encode())
+            await writer.drain()
+
+        session = self._open(send)
+        decoder = codecs.getincrementaldecoder('utf8')()
+        try:
+            while 1:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                await session.feed(decoder.decode(data))
+        except ConnectionError:
+            pass
+        finally:
+            self._close(session)
+            writer.close()
+
+    def _open(self, send: Callable) -> _Session:
+        session = _Session(self, send)
+        self._sessions.add(session)
+        self.stats['connections'] += 1
+        return session
+
+    def _close(self, session: _Session) -> None:
+        self._sessions.discard(session)
+        session.close()
+
+    # --- JSON-RPC ---
+
+    async def _jrpc_handler(self, request: web.Request) -> web.Response:
+        j = await request.json()
+        self.stats['jrpc'] += 1
+        config = self.config
+
+        await asyncio.sleep(self._delay() + config.jrpc_time)
+
+        method = self._jrpc_methods.get(j.get('method'))
+        try:
+            if method is None:
+                raise _JrpcError(-32601, 'Method not found')
+            if config.jrpc_error_rate and self._rnd.random() < config.jrpc_error_rate:
+                raise _JrpcError(-32000, 'Emulated error')
+            result = method(j.get('params') or {})
+        except (_JrpcError, ZcpError, KeyError, ValueError) as e:
+            self.stats['jrpc_errors'] += 1
+            code = e.code if isinstance(e, _JrpcError) else -32602
+            return web.json_response({'jsonrpc': '2.0', 'error': {'code': code, 'message': str(e)}, 'id': j.get('id')})
+
+        return web.json_response({'jsonrpc': '2.0', 'result': result, 'id': j.get('id')})
+
+    def _channel(self, params: dict) -> int:
+        ch = int(params['channel'])
+        if not 1 <= ch <= self.channels:
+            raise _JrpcError(-32602, f'Invalid channel {ch}')
+        return ch
+
+    def _apply_fir(self, params: dict):
+        ch = self._channel(params)
+        if 'taps_f32' in params:
+            taps = array('f', base64.b64decode(params['taps_f32'])).tolist()
+        else:
+            taps = [float(tap) for tap in params['taps']]
+        self.fir[ch] = taps
+        return None
+
+    def _clear_fir(self, params: dict):
+        self.fir.pop(self._channel(params), None)
+        return None
+
+    def _clear_preset(self, params: dict):
+        self.reset_channel(self._channel(params))
+        return None
+
+    def _decode_preset(self, params: dict) -> dict:
+        return ZcpPreset(base64.b64decode(params['preset'])).to_dict()
+
+    def _apply_preset(self, params: dict):
+        ch = self._channel(params)
+        sp = _AmpPreset(base64.b64decode(params['preset'])).to_speaker_preset()
+        self._set_registers(self._channel_regs(ch, sp))
+        self.fir[ch] = list(sp.fir.taps)
+        return None
+
+    def _create_preset(self, params: dict) -> dict:
+        # Every parameter block is stored, `store` is not emulated
+        ch = self._channel(params)
+        name = params['name']
+        vendor_id = 1 if params.get('vendor_lock') else 0
+        data = encode_preset(self.channel_preset(ch), name, vendor_id=vendor_id,
+                             protect=params.get('protect') or ())
+        return {
+            'filename': f'{name}.zcp',
+            'data': base64.b64encode(data).decode('ascii'),
+        }
+
+    # --- firmware ---
+
+    async def _firmware_handler(self, request: web.Request) -> web.Response:
+        size = 0
+        async for chunk in request.content.iter_any():
+            size += len(chunk)
+        self.stats['firmware_bytes'] += size
+
+        config = self.config
+        if config.error_rate and self._rnd.random() < config.error_rate:
+            return web.Response(status=503, text='Emulated error')
+        if not size:
+            return web.Response(status=400, text='Empty image')
+
+        await asyncio.sleep(self._delay() + config.firmware_time)
+        self.stats['firmware_updates'] += 1
+        return web.Response(text='OK')
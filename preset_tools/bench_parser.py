@@ -0,0 +1,77 @@
+# SPDX-License-Identifier: MIT
+
+# Microbenchmark of the response parser with a synthetic "GET *" dump split
+# into websocket sized frames.
+
+import random
+import re
+import time
+
+from protocol import LineBuffer, parse_update
+
+LINES = 200000
+FRAME_SIZE = 16 * 1024
+ROUNDS = 5
+
+
+def make_frames():
+    rnd = random.Random(0)
+    lines = []
+    for i in range(LINES):
+        ch = i % 16 + 1
+        kind = i % 3
+        if kind == 0:
+            lines.append(f'+OUT-{ch}.SPEAKER_EQ-{i % 15 + 1}.GAIN {rnd.uniform(-12, 12):.6f}')
+        elif kind == 1:
+            lines.append(f'+OUT-{ch}.XR.LP_TYPE "BES48"')
+        else:
+            lines.append(f'+OUT-{ch}.PEAK_LIMITER.BYPASS {i % 2}')
+    lines.append('*GET *')
+    data = '\n'.join(lines) + '\n'
+    return [data[i:i + FRAME_SIZE] for i in range(0, len(data), FRAME_SIZE)]
+
+
+def regex_parser(frames):
+    # Previous parser: one regex per line, frames assumed to end on a line
+    updates = []
+    for frame in frames:
+        for line in frame.splitlines():
+            if line.startswith(('#', '*')):
+                continue
+            elif line.startswith(('+')):
+                m = re.match(r'[+]([^ ]+) (.+)', line)
+                if m:
+                    updates.append((m[1], m[2]))
+    return updates
+
+
+def stream_parser(frames):
+    updates = []
+    buffer = LineBuffer()
+    for frame in frames:
+        for line in buffer.feed(frame):
+            if line[0] == '+':
+                updates.append(parse_update(line))
+    return updates
+
+
+def bench(parser, frames):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        updates = parser(frames)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, updates
+
+
+frames = make_frames()
+print(f'{LINES} lines in {len(frames)} frames of {FRAME_SIZE} bytes')
+
+results = {}
+for name, parser in (('regex', regex_parser), ('stream', stream_parser)):
+    elapsed, updates = bench(parser, frames)
+    results[name] = elapsed
+    print(f'{name:8} {elapsed * 1000:8.1f} ms {LINES / elapsed / 1e6:6.2f} M lines/s ({len(updates)} updates)')
+
+print(f'speedup {results["regex"] / results["stream"]:.1f}x')
@@ -0,0 +1,157 @@
+# SPDX-License-Identifier: MIT
+
+# Times set_preset, protect_preset and library builds against the local
+# amplifier stand-in (amp_emulator.py), no amplifier needed. The library
+# build decodes every preset on the stand-in. The results are printed and
+# appended to RESULTS_FILE to compare releases.
+
+from amp_emulator import EmulatedAmp, EmulatorConfig
+from connection import Connection, ExportPresetParams
+from metrics import Metrics
+from preset_array import PresetArray
+from speaker_library import SpeakerLibrary
+from zcp import ZcpPreset
+from zcp_writer import write_presets
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+ROUNDS = 20
+LIBRARY_ROUNDS = 3
+LIBRARY_PRESETS = 200
+# 'websocket' or 'tcp'
+TRANSPORT = 'websocket'
+# Network and amplifier behaviour, see EmulatorConfig
+CONFIG = EmulatorConfig(latency=0.002, jitter=0.001, process_time=0.0001, jrpc_time=0.005, seed=0)
+PRESET_FILE = 'in/preset.zcp'
+# Label of this run in RESULTS_FILE, e.g. the release under test
+RELEASE = 'dev'
+RESULTS_FILE = 'benchmark.json'  # None to only print the results
+
+
+class BenchResult:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.durations = []
+        self.commands = 0
+        self.wall = 0.0
+
+    def percentile(self, p: float) -> float:
+        return float(np.percentile(self.durations, p)) if self.durations else 0.0
+
+    @property
+    def commands_per_sec(self) -> float:
+        return self.commands / self.wall if self.wall else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'ops': len(self.durations),
+            'wall': self.wall,
+            'commands': self.commands,
+            'commands_per_sec': self.commands_per_sec,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+        }
+
+    def __str__(self) -> str:
+        return (f'{self.name:16} {len(self.durations):4} ops {self.wall:8.3f}s wall '
+                f'{self.commands_per_sec:9.1f} cmd/s  p50 {1000 * self.percentile(50):8.2f}ms  '
+                f'p99 {1000 * self.percentile(99):8.2f}ms')
+
+
+def _amp_commands(amp: EmulatedAmp) -> int:
+    return amp.stats['commands'] + amp.stats['jrpc']
+
+
+async def measure(name: str, amp: EmulatedAmp, rounds: int, op) -> BenchResult:
+    # Commands are counted by the stand-in: text protocol and JSON-RPC
+    result = BenchResult(name)
+    commands = _amp_commands(amp)
+    start = time.perf_counter()
+    for i in range(rounds):
+        t = time.perf_counter()
+        await op(i)
+        result.durations.append(time.perf_counter() - t)
+    result.wall = time.perf_counter() - start
+    result.commands = _amp_commands(amp) - commands
+    return result
+
+
+def make_library(folder: str, count: int) -> list:
+    # (folder, name, path) of `count` generated presets in two folders
+    sp = ZcpPreset.from_file(PRESET_FILE).to_speaker_preset()
+    pa = PresetArray.from_presets([sp] * count)
+    pa['eq']['gain'][:, 0] = np.linspace(-6, 6, count)
+
+    presets = []
+    for i in range(count):
+        sub = f'Folder_{"AB"[i % 2]}'
+        os.makedirs(os.path.join(folder, sub), exist_ok=True)
+        presets.append((sub, f'preset{i}.zcp', os.path.join(folder, sub, f'preset{i}.zcp')))
+    write_presets(pa, [path for _, _, path in presets], workers=1)
+    return presets
+
+
+async def async_main():
+    sp = ZcpPreset.from_file(PRESET_FILE).to_speaker_preset()
+    flags = list(ExportPresetParams)
+
+    async with EmulatedAmp(CONFIG) as amp:
+        metrics = Metrics()
+        c = Connection(transport=amp.tcp_transport() if TRANSPORT == 'tcp' else TRANSPORT, metrics=metrics)
+        await c.async_connect(amp.host)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            print(f'Benchmark against the amp stand-in at {amp.host} ({TRANSPORT})...')
+            results = []
+
+            async def set_preset(i):
+                await c.set_preset(1, sp)
+            results.append(await measure('set_preset', amp, ROUNDS, set_preset))
+
+            async def protect_preset(i):
+                await c.protect_preset(1, PRESET_FILE, os.path.join(tmp, 'protected.zcp'), flags, flags)
+            results.append(await measure('protect_preset', amp, ROUNDS, protect_preset))
+
+            presets = make_library(os.path.join(tmp, 'lib'), LIBRARY_PRESETS)
+
+            async def library(i):
+                spl = SpeakerLibrary(None, 'Benchmark Library', '1')
+                await spl.add_presets(presets, connections=[c], offline=False)
+                spl.write_preset_file(os.path.join(tmp, 'library.zcl'))
+            results.append(await measure('library_build', amp, LIBRARY_ROUNDS, library))
+
+        await c.async_disconnect()
+
+    for result in results:
+        print(result)
+    # Round trip of the single commands, as seen by the Connection
+    commands = metrics.group_by('command')
+    for command, stats in sorted(commands.items()):
+        print(f'  {command:14} {stats.count:6} commands  mean {1000 * stats.mean:8.2f}ms  '
+              f'p99 <= {1000 * stats.quantile(0.99):8.2f}ms  {stats.errors} errors  {stats.timeouts} timeouts')
+
+    if RESULTS_FILE:
+        runs = []
+        if os.path.exists(RESULTS_FILE):
+            with open(RESULTS_FILE) as f:
+                runs = json.load(f)
+        runs.append({
+            'release': RELEASE,
+            'time': time.time(),
+            'transport': TRANSPORT,
+            'config': CONFIG.to_dict(),
+            'library_presets': LIBRARY_PRESETS,
+            'results': {result.name: result.to_dict() for result in results},
+            'commands': {command: stats.to_dict() for command, stats in commands.items()},
+        })
+        with open(RESULTS_FILE, 'w') as f:
+            json.dump(runs, f, indent=2)
+        print(f'Results appended to "{RESULTS_FILE}"')
+
+
+asyncio.run(async_main())
@@ -0,0 +1,46 @@
+# SPDX-License-Identifier: MIT
+
+from preset_array import PresetArray
+from validation import validate
+from zcp import ZcpError, ZcpPreset
+import glob
+import os
+import sys
+import time
+from natsort import natsorted
+
+# Every .zcp below this folder is checked, protected blocks are skipped
+PRESET_DIR = 'lib'
+
+
+def main():
+    files = natsorted(glob.glob(os.path.join(PRESET_DIR, '**/*.zcp'), recursive=True))
+
+    print(f'Reading {len(files)} presets...')
+    presets = []
+    unreadable = []
+    for file in files:
+        try:
+            presets.append(ZcpPreset.from_file(file).to_speaker_preset())
+        except (ZcpError, ValueError) as e:
+            unreadable.append((file, e))
+            presets.append(None)
+
+    readable = [i for i, sp in enumerate(presets) if sp is not None]
+    pa = PresetArray.from_presets(presets[i] for i in readable)
+
+    start = time.perf_counter()
+    report = validate(pa)
+    elapsed = time.perf_counter() - start
+
+    for violation in report.violations:
+        print(f'{files[readable[violation.preset]]}: {str(violation).split(": ", 1)[1]}')
+    for file, e in unreadable:
+        print(f'{file}: unreadable: {e}')
+
+    print(f'{len(report.invalid_presets) + len(unreadable)}/{len(files)} preset(s) invalid '
+          f'(checked in {elapsed * 1000:.1f} ms)')
+    return 1 if unreadable or not report else 0
+
+
+sys.exit(main())
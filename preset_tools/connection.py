@@ -1,15 +1,27 @@
 # SPDX-License-Identifier: MIT
 
 import asyncio
-import re
-import requests
-import websockets
-from jsonrpcclient import Ok, parse, request
+import logging
+from collections import deque
+from fnmatch import fnmatchcase
+from typing import Callable, Optional
+from deadline import Deadline, command_timeout, current as current_deadline, timeout_error
+from jrpc import JrpcClient
+from metrics import ERROR, METRICS, OK, TIMEOUT, Metrics
 from preset import *
+from protocol import LineBuffer, RegisterValues, decode_value, parse_update
+from transport import Transport, make_transport
+from validation import validate_preset
 from enum import Enum
 import base64
+import hashlib
+import time
 from pathlib import Path
 
+# Retries of SETs that failed or were not answered, with doubling backoff
+SET_RETRIES = 2
+RETRY_BACKOFF = 0.1
+
 
 class ExportPresetParams(str, Enum):
     Equalizer = 'equalizer'
@@ -25,226 +37,660 @@ class ExportPresetParams(str, Enum):
 
 
 class Response:
-    def __init__(self) -> None:
-        self.valid: bool = False
-        self.register: str
-        self.result_str: str
+    # One text protocol command in flight. The reader fills in the result
+    # line ('*...' or '#...', None if the amp skipped it) and, for a GET,
+    # the values of the matching registers received before it.
+    __slots__ = ('cmd', 'register', 'result_str', 'updates', 'future', 'sent')
+
+    def __init__(self, cmd: str, register: Optional[str] = None) -> None:
+        self.cmd = cmd.strip("\r\n\t ")
+        self.register = register
+        self.result_str: Optional[str] = None
         self.updates: list = []
-        self.unexpected: None
+        self.future = asyncio.get_event_loop().create_future()
+        self.sent = time.perf_counter()
+
+    @property
+    def ok(self) -> bool:
+        return self.result_str == f'*{self.cmd}'
+
+
+class WriteError(Exception):
+    def __init__(self, failures: list) -> None:
+        # failures: list of (register, value, response line or None on timeout)
+        self.failures = failures
+        regs = ', '.join(reg for reg, _, _ in failures[:5])
+        more = f' (+{len(failures) - 5} more)' if len(failures) > 5 else ''
+        super().__init__(f'{len(failures)} register(s) failed: {regs}{more}')
+
+
+def _str_value(value: str) -> str:
+    return f'"{value}"'
+
+
+def _int_value(value: int) -> str:
+    return f'{value}'
+
+
+def _bool_value(value: bool) -> str:
+    return f'{1 if value else 0}'
+
+
+def _float_value(value: float) -> str:
+    return f'{value}'
+
+
+def _same_value(current: str, target: str) -> bool:
+    current = current.strip().strip('"')
+    target = target.strip().strip('"')
+    if current == target:
+        return True
+
+    try:
+        a = float(current)
+        b = float(target)
+    except ValueError:
+        return False
+
+    # The amp stores parameters as float32
+    return abs(a - b) <= 1e-6 + 1e-5 * abs(b)
+
+
+def _taps_list(taps) -> list:
+    return taps.tolist() if hasattr(taps, 'tolist') else list(taps)
 
 
 class Connection:
-    def __init__(self) -> None:
+    # Pass a shared JrpcClient to pool JSON-RPC connections across amps.
+    # fir_binary uploads FIR taps as base64 float32 instead of a JSON array,
+    # this needs an amplifier firmware that accepts `taps_f32` in apply_fir.
+    # transport is 'websocket', 'tcp' (port 7621) or a Transport instance.
+    # Traffic is recorded in `metrics`, the process wide METRICS by default.
+    # Any number of tasks may send commands at the same time, each gets its
+    # own result; subscription updates only go to the register mirror.
+    def __init__(self, jrpc: Optional[JrpcClient] = None, fir_binary: bool = False,
+                 transport='websocket', metrics: Optional[Metrics] = None) -> None:
         self._host = None
-        self._websocket = None
-        self._response = None
+        self.metrics = metrics if metrics is not None else METRICS
+        self._transport_factory = transport
+        self._fir_binary = fir_binary
+        self._jrpc = jrpc or JrpcClient()
+        self._own_jrpc = jrpc is None
+        self._transport: Optional[Transport] = None
+        # Commands sent and not answered yet, in the order sent
+        self._pending = deque()
+        self._send_lock = asyncio.Lock()
+        self._line_buffer = LineBuffer()
+        self._reader = None
+        self._error = None
+        self._fir_digest = {}
+
+        # Register mirror, kept up to date from every +REG value line
+        self.registers = {}
+        self._listeners = {}
+        self._prefix_listeners = []
+        self._change_queues = set()
 
     async def async_connect(self, host: str):
         self._host = host
-        if not self._websocket:
-            self._websocket = await websockets.connect(f'ws://{host}/ws')
+        if not self._transport:
+            transport = make_transport(self._transport_factory)
+            await transport.connect(host)
+            self._transport = transport
+            self._pending.clear()
+            # The amp may have changed while not connected
+            self._fir_digest.clear()
+            self._line_buffer = LineBuffer()
+            self._error = None
+            self._reader = asyncio.ensure_future(self._read_loop())
 
     async def async_disconnect(self):
-        if self._websocket:
-            await self._websocket.close()
-            self._websocket = None
-
-    async def async_read_response(self):
-        while 1:
-            response = await self._websocket.recv()
-
-            for line in response.splitlines():
-                if line.startswith(('#', '*')):
-                    self._response.result_str = line
-                    return line
-                elif line.startswith(('+')):
-                    m = re.match(r'[+]([^ ]+) (.+)', line)
-                    if not m:
-                        raise Exception(f'Invalid Response')
-                    reg = m[1]
-                    val = m[2]
-
-                    self._response.updates.append((reg, val))
-                else:
-                    self._response.unexpected = line
-                    raise Exception()
-
-    async def async_execute_command_internal(self, cmd, timeout=2.0):
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reader = None
+        if self._transport:
+            await self._transport.close()
+            self._transport = None
+        self._fir_digest.clear()
+        if self._own_jrpc:
+            await self._jrpc.close()
+
+    async def _read_loop(self):
+        # Only task that receives from the transport. Register values go to
+        # the mirror, results to the command they answer.
         try:
-            await self._websocket.send(cmd + '\n')
-
-            line = await asyncio.wait_for(self.async_read_response(), timeout)
-            cmd = cmd.strip("\r\n\t ")
-            if line == f'*{cmd}':
+            while 1:
+                response = await self._transport.recv()
+                self.metrics.received(self._host, len(response.encode()))
+                for line in self._line_buffer.feed(response):
+                    self._dispatch(line)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._error = e
+        finally:
+            error = self._error or ConnectionError('Connection closed')
+            while self._pending:
+                future = self._pending.popleft().future
+                if not future.done():
+                    future.set_exception(error)
+            for queue in self._change_queues:
+                # The end marker replaces the oldest change of a full queue
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def _dispatch(self, line: str):
+        kind = line[0]
+        pending = self._pending
+        if kind == '+':
+            reg, value = parse_update(line)
+            self._update(reg, value)
+            # Values of a GET arrive right before its result
+            for response in pending:
+                if response.register is not None and not response.future.done() \
+                        and fnmatchcase(reg, response.register):
+                    response.updates.append((reg, value))
+                    break
+        elif kind == '*' or kind == '#':
+            i = self._match(line)
+            if i is None:
+                # A result that does not name its command is for the oldest
+                # one still waiting
+                while pending and pending[0].future.done():
+                    pending.popleft()
+                i = 0
+            if not pending:
+                logging.getLogger(__name__).debug(f'Result without command: {line}')
                 return
-            else:
-                raise Exception(line)
+            # The amp answers in the order received, the commands before the
+            # one answered got no answer
+            for _ in range(i):
+                self._resolve(pending.popleft(), None)
+            self._resolve(pending.popleft(), line)
+        else:
+            logging.getLogger(__name__).warning(f'Unexpected response: {line}')
+
+    def _match(self, line: str) -> Optional[int]:
+        # Index of the pending command named by a result line: '*' repeats
+        # the command, '#' errors usually name its register
+        pending = self._pending
+        if line[0] == '*':
+            if pending and pending[0].cmd == line[1:]:
+                return 0
+            for i, response in enumerate(pending):
+                if response.cmd == line[1:]:
+                    return i
+            return None
+
+        words = line[1:].split()
+        for i, response in enumerate(pending):
+            parts = response.cmd.split(' ', 2)
+            if (parts[1] if len(parts) > 1 else parts[0]) in words:
+                return i
+        return None
+
+    def _resolve(self, response: Response, line: Optional[str]):
+        # Results of commands that timed out are dropped
+        response.result_str = line
+        if not response.future.done():
+            response.future.set_result(line)
+
+    def _update(self, reg: str, value: str):
+        if self.registers.get(reg) == value:
+            return
+        self.registers[reg] = value
+
+        callbacks = list(self._listeners.get(reg, ()))
+        callbacks += [cb for prefix, cb in self._prefix_listeners if reg.startswith(prefix)]
+        for cb in callbacks:
+            try:
+                cb(reg, value)
+            except Exception:
+                logging.getLogger(__name__).exception(f'Listener for {reg} failed')
+
+    def get_cached(self, reg: str, default=None, typed: bool = False):
+        if reg not in self.registers:
+            return default
+        value = self.registers[reg]
+        return decode_value(value) if typed else value
+
+    def add_listener(self, pattern: str, callback: Callable):
+        # callback(reg, value) is called when a register changes. `pattern`
+        # is a register name or a prefix ending with '*', e.g. 'OUT-1.*'.
+        if pattern.endswith('*'):
+            self._prefix_listeners.append((pattern[:-1], callback))
+        else:
+            self._listeners.setdefault(pattern, []).append(callback)
 
-        except asyncio.exceptions.CancelledError:
-            raise TimeoutError()
+    def remove_listener(self, pattern: str, callback: Callable):
+        if pattern.endswith('*'):
+            self._prefix_listeners.remove((pattern[:-1], callback))
+        else:
+            self._listeners[pattern].remove(callback)
+            if not self._listeners[pattern]:
+                del self._listeners[pattern]
+
+    async def changes(self, pattern: str = '*', maxsize: int = 1024):
+        # Async iterator of (reg, value) changes, ends when the connection
+        # closes. The oldest changes are dropped if the consumer falls behind.
+        queue = asyncio.Queue(maxsize)
+
+        def put(reg, value):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((reg, value))
+
+        self.add_listener(pattern, put)
+        self._change_queues.add(queue)
+        try:
+            while 1:
+                change = await queue.get()
+                if change is None:
+                    return
+                yield change
+        finally:
+            self._change_queues.discard(queue)
+            self.remove_listener(pattern, put)
+
+    async def async_subscribe(self, pattern: str, timeout: float = 2.0):
+        await self.async_execute_command(f'SUBSCRIBE {pattern}', timeout)
+
+    async def async_unsubscribe(self, pattern: str, timeout: float = 2.0):
+        await self.async_execute_command(f'UNSUBSCRIBE {pattern}', timeout)
+
+    async def _send(self, data: str):
+        self.metrics.sent(self._host, len(data.encode()))
+        await self._transport.send(data)
+
+    async def _submit(self, response: Response):
+        # Queues the command for its result and sends it. Many tasks may
+        # submit at once; the lock keeps the queue in the order sent.
+        if self._error:
+            raise self._error
+        if not self._transport:
+            raise ConnectionError('Not connected')
+
+        async with self._send_lock:
+            response.sent = time.perf_counter()
+            self._pending.append(response)
+            try:
+                await self._send(response.cmd + '\n')
+            except BaseException:
+                if response in self._pending:
+                    self._pending.remove(response)
+                raise
+
+    async def _execute(self, response: Response, timeout: Optional[float] = 2.0) -> Response:
+        # The timeout is cut to the time left of the current Deadline
+        timeout = command_timeout(timeout)
+        outcome = ERROR
+        try:
+            await self._submit(response)
+            try:
+                line = await asyncio.wait_for(response.future, timeout)
+            except asyncio.TimeoutError:
+                line = None
+
+            if line is None:
+                outcome = TIMEOUT
+                raise timeout_error()
+            if not response.ok:
+                raise Exception(line)
+            outcome = OK
+            return response
+        finally:
+            self.metrics.record_command(self._host, response.cmd, time.perf_counter() - response.sent, outcome)
 
     async def async_execute_command(self, cmd, timeout=2.0):
-        self._response = Response()
-        await self.async_execute_command_internal(cmd, timeout)
+        await self._execute(Response(cmd), timeout)
+
+    async def async_set_regs(self, regs, window: int = 16, timeout: float = 10.0) -> list:
+        # Pipelined SET: keep up to `window` commands in flight. Commands of
+        # other tasks may go out in between, each result finds its command.
+        timeout = command_timeout(timeout)
+        regs = iter(regs)
+        pending = deque()
+        failures = []
+        host = self._host
+        record = self.metrics.record
+        target = self.metrics.target
+
+        async def run():
+            exhausted = False
+            while 1:
+                while not exhausted and len(pending) < window:
+                    entry = next(regs, None)
+                    if entry is None:
+                        exhausted = True
+                        break
+                    reg, value = entry
+                    response = Response(f'SET {reg} {value}')
+                    pending.append((reg, value, response))
+                    await self._submit(response)
+
+                if not pending:
+                    return
+
+                reg, value, response = pending[0]
+                line = await response.future
+                pending.popleft()
+                outcome = OK
+                if not response.ok:
+                    failures.append((reg, value, line))
+                    outcome = ERROR if line else TIMEOUT
+                record(host, 'SET', target(reg), time.perf_counter() - response.sent, outcome)
 
-    async def async_get_reg(self, reg: str, responseCount=1, timeout: float = 2.0):
-        self._response = Response()
-        self._response.register = reg
+        try:
+            await asyncio.wait_for(run(), timeout)
+        except asyncio.TimeoutError:
+            now = time.perf_counter()
+            for reg, value, response in pending:
+                record(host, 'SET', target(reg), now - response.sent, TIMEOUT)
+            failures.extend((reg, value, None) for reg, value, _ in pending)
+            failures.extend((reg, value, None) for reg, value in regs)
+        finally:
+            # Results still to come are dropped by the reader
+            for _, _, response in pending:
+                response.future.cancel()
+
+        return failures
 
-        cmd = f'GET {reg}'
-        await self.async_execute_command_internal(cmd)
+    async def async_get_reg(self, reg: str, responseCount=1, timeout: float = 2.0):
+        response = await self._execute(Response(f'GET {reg}', reg), timeout)
 
-        count = len(self._response.updates)
+        # Subscription updates of the register may arrive with the GET
+        # values. The GET value comes right before the result, so the last
+        # value of a register wins.
+        values = dict(response.updates)
+        count = len(values)
         if responseCount > 0 and count != responseCount:
             raise Exception(f'Invalid number of updates: {count}')
 
         if responseCount == 1:
-            update = self._response.updates[0]
-
-            if update[0] != reg:
+            if reg not in values:
                 raise Exception(f'Invalid Register')
 
-            return update[1]
+            return values[reg]
         return None
 
-    async def async_set_reg(self, reg: str, value, timeout=2.0):
-        self._response = Response()
-        self._response.register = reg
+    async def async_get_regs(self, pattern: str, timeout: float = 2.0, typed: bool = False):
+        # Raw values by register, or decoded on access with typed=True
+        response = await self._execute(Response(f'GET {pattern}', pattern), timeout)
 
-        cmd = f'SET {reg} {value}'
-        await self.async_execute_command_internal(cmd)
+        values = dict(response.updates)
+        return RegisterValues(values) if typed else values
+
+    async def async_set_reg(self, reg: str, value, timeout=2.0):
+        await self._execute(Response(f'SET {reg} {value}'), timeout)
 
     async def unchecked_get_reg(self, reg: str, timeout: float = 2.0):
+        # Result line of the GET, None without an answer
+        response = Response(f'GET {reg}', reg)
         try:
-            await self.async_get_reg(reg, timeout)
+            await self._execute(response, timeout)
         except:
             pass
 
-        return self._response.result_str
+        return response.result_str
 
     async def unchecked_set_reg(self, reg: str, value, timeout=2.0):
+        response = Response(f'SET {reg} {value}')
         try:
-            await self.async_set_reg(reg, value, timeout)
+            await self._execute(response, timeout)
         except:
             pass
 
-        return self._response.result_str
-
-    def call_jrpc(self, name, args):
-        response = requests.post(f"http://{self._host}/jrpc", json=request(name, args))
+        return response.result_str
 
-        parsed = parse(response.json())
-        if isinstance(parsed, Ok):
-            return(parsed.result)
-        else:
-            raise Exception(parsed.message)
+    async def call_jrpc(self, name, args, timeout: Optional[float] = None):
+        timeout = command_timeout(timeout)
+        start = time.perf_counter()
+        outcome = ERROR
+        try:
+            result = await self._jrpc.call(self._host, name, args, timeout)
+            outcome = OK
+            return result
+        except TimeoutError as e:
+            outcome = TIMEOUT
+            raise timeout_error(str(e)) from None
+        finally:
+            self.metrics.record(self._host, 'JRPC', name, time.perf_counter() - start, outcome)
 
     async def set_value(self, name: str, value):
-        value = await self.async_set_reg(name, value)
+        await self.set_values([(name, value)])
+
+    async def set_values(self, regs, window: int = 16, timeout: float = 10.0, retries: int = SET_RETRIES):
+        # Registers whose last write got no answer are written again, up to
+        # `retries` times, with their final value. SETs are absolute, so this
+        # converges to the same state as a clean run. Writes the amp rejected
+        # ('#...') are reported without retry.
+        regs = list(regs)
+        final = dict(regs)
+        failures = await self.async_set_regs(regs, window, timeout)
+
+        rejected = []
+        for attempt in range(retries + 1):
+            # Failed writes that a later write of the register superseded
+            # (limiter ATTACK 0) are dropped
+            failures = [f for f in failures if final[f[0]] == f[1]]
+            rejected += [f for f in failures if f[2] is not None]
+            failures = [f for f in failures if f[2] is None]
+            if not failures or attempt == retries:
+                break
+
+            backoff = RETRY_BACKOFF * 2 ** attempt
+            deadline = current_deadline()
+            remaining = deadline.remaining() if deadline else None
+            if remaining is not None and remaining <= backoff:
+                break
+            await asyncio.sleep(backoff)
+            retry = dict((reg, value) for reg, value, _ in failures)
+            failures = await self.async_set_regs(list(retry.items()), window, timeout)
+
+        failures = rejected + failures
+        if failures:
+            raise WriteError(failures)
 
     async def set_str(self, name: str, value: str):
-        await self.set_value(name, f'"{value}"')
+        await self.set_value(name, _str_value(value))
 
     async def set_int(self, name: str, value: int):
-        await self.set_value(name, f'{value}')
+        await self.set_value(name, _int_value(value))
 
     async def set_bool(self, name: str, value: bool):
-        await self.set_value(name, f'{1 if value else 0}')
+        await self.set_value(name, _bool_value(value))
 
     async def set_float(self, name: str, value: float):
-        await self.set_value(name, f'{value}')
+        await self.set_value(name, _float_value(value))
 
-    async def set_speaker_equalizer(self, ch: int, index: int, eq: Equalizer):
+    @staticmethod
+    def speaker_equalizer_regs(ch: int, index: int, eq: Equalizer) -> list:
         base = f'OUT-{ch}.SPEAKER_EQ-{index}'
 
-        await self.set_bool(f'{base}.BYPASS', eq.bypass)
-        await self.set_str(f'{base}.TYPE', str(eq.type))
-        await self.set_float(f'{base}.GAIN', eq.gain)
-        await self.set_float(f'{base}.FREQ', eq.freq)
-        await self.set_float(f'{base}.Q', eq.q)
+        return [
+            (f'{base}.BYPASS', _bool_value(eq.bypass)),
+            (f'{base}.TYPE', _str_value(str(eq.type))),
+            (f'{base}.GAIN', _float_value(eq.gain)),
+            (f'{base}.FREQ', _float_value(eq.freq)),
+            (f'{base}.Q', _float_value(eq.q)),
+        ]
 
-    async def set_crossover(self, ch: int, xr: Crossover):
+    @staticmethod
+    def crossover_regs(ch: int, xr: Crossover) -> list:
         base = f'OUT-{ch}.XR'
 
-        await self.set_bool(f'{base}.BYPASS', xr.bypass)
-        await self.set_float(f'{base}.GAIN', xr.gain)
-        await self.set_str(f'{base}.LOWPASS_TYPE', str(xr.lowpass_type))
-        await self.set_float(f'{base}.LOWPASS_FREQUENCY', xr.lowpass_freq)
-        await self.set_str(f'{base}.HIGHPASS_TYPE', str(xr.highpass_type))
-        await self.set_float(f'{base}.HIGHPASS_FREQUENCY', xr.highpass_freq)
-
-    async def set_speaker_delay(self, ch: int, delay: Delay):
+        return [
+            (f'{base}.BYPASS', _bool_value(xr.bypass)),
+            (f'{base}.GAIN', _float_value(xr.gain)),
+            (f'{base}.LOWPASS_TYPE', _str_value(str(xr.lowpass_type))),
+            (f'{base}.LOWPASS_FREQUENCY', _float_value(xr.lowpass_freq)),
+            (f'{base}.HIGHPASS_TYPE', _str_value(str(xr.highpass_type))),
+            (f'{base}.HIGHPASS_FREQUENCY', _float_value(xr.highpass_freq)),
+        ]
+
+    @staticmethod
+    def speaker_delay_regs(ch: int, delay: Delay) -> list:
         base = f'OUT-{ch}.SPEAKER_DELAY'
 
-        await self.set_bool(f'{base}.BYPASS', delay.bypass)
-        await self.set_float(f'{base}.TIME', delay.time / 48000)
+        return [
+            (f'{base}.BYPASS', _bool_value(delay.bypass)),
+            (f'{base}.TIME', _float_value(delay.time / 48000)),
+        ]
 
-    async def set_clip_limiter(self, ch: int, lim: ClipLimiter):
+    @staticmethod
+    def clip_limiter_regs(ch: int, lim: ClipLimiter) -> list:
         base = f'OUT-{ch}.CLIP_LIMITER'
 
-        await self.set_bool(f'{base}.BYPASS', lim.bypass)
-        await self.set_str(f'{base}.MODE', str(lim.mode))
+        return [
+            (f'{base}.BYPASS', _bool_value(lim.bypass)),
+            (f'{base}.MODE', _str_value(str(lim.mode))),
+        ]
 
-    async def set_peak_limiter(self, ch: int, lim: PeakLimiter):
+    @staticmethod
+    def peak_limiter_regs(ch: int, lim: PeakLimiter) -> list:
         base = f'OUT-{ch}.PEAK_LIMITER'
 
         assert(lim.release >= lim.attack)
 
-        await self.set_bool(f'{base}.BYPASS', lim.bypass)
-        await self.set_bool(f'{base}.AUTO', lim.auto)
-        await self.set_float(f'{base}.THRESHOLD', lim.threshold)
-        await self.set_float(f'{base}.ATTACK', 0)
-        await self.set_float(f'{base}.RELEASE', lim.release)
-        await self.set_float(f'{base}.ATTACK', lim.attack)
-        await self.set_float(f'{base}.HOLD', lim.hold)
-        await self.set_float(f'{base}.KNEE', lim.knee)
-
-    async def set_rms_limiter(self, ch: int, lim: RmsLimiter):
+        return [
+            (f'{base}.BYPASS', _bool_value(lim.bypass)),
+            (f'{base}.AUTO', _bool_value(lim.auto)),
+            (f'{base}.THRESHOLD', _float_value(lim.threshold)),
+            (f'{base}.ATTACK', _float_value(0)),
+            (f'{base}.RELEASE', _float_value(lim.release)),
+            (f'{base}.ATTACK', _float_value(lim.attack)),
+            (f'{base}.HOLD', _float_value(lim.hold)),
+            (f'{base}.KNEE', _float_value(lim.knee)),
+        ]
+
+    @staticmethod
+    def rms_limiter_regs(ch: int, lim: RmsLimiter) -> list:
         base = f'OUT-{ch}.RMS_LIMITER'
 
         assert(lim.release >= lim.attack)
 
-        await self.set_bool(f'{base}.BYPASS', lim.bypass)
-        await self.set_float(f'{base}.THRESHOLD', lim.threshold)
-        await self.set_float(f'{base}.ATTACK', 0)
-        await self.set_float(f'{base}.RELEASE', lim.release)
-        await self.set_float(f'{base}.ATTACK', lim.attack)
-        await self.set_float(f'{base}.HOLD', lim.hold)
-        await self.set_float(f'{base}.KNEE', lim.knee)
+        return [
+            (f'{base}.BYPASS', _bool_value(lim.bypass)),
+            (f'{base}.THRESHOLD', _float_value(lim.threshold)),
+            (f'{base}.ATTACK', _float_value(0)),
+            (f'{base}.RELEASE', _float_value(lim.release)),
+            (f'{base}.ATTACK', _float_value(lim.attack)),
+            (f'{base}.HOLD', _float_value(lim.hold)),
+            (f'{base}.KNEE', _float_value(lim.knee)),
+        ]
+
+    @staticmethod
+    def output_mode_regs(ch: int, mode: OutputMode) -> list:
+        assert(mode in OutputMode)
+        return [(f'OUT-{ch}.OUTPUT_MODE', _str_value(str(mode)))]
+
+    @staticmethod
+    def output_highpass_regs(ch: int, freq: Optional[float]) -> list:
+        return [(f'OUT-{ch}.OUTPUT_HIGHPASS', _float_value(0 if not freq else freq))]
+
+    @staticmethod
+    def output_polarity_regs(ch: int, polarity: int) -> list:
+        assert(polarity in [-1, 1])
+        return [(f'OUT-{ch}.POLARITY', _int_value(polarity))]
+
+    @classmethod
+    def preset_regs(cls, ch: int, sp: SpeakerPreset) -> list:
+        # Raises ValidationError before anything is written
+        validate_preset(sp, ch)
+
+        regs = []
+        regs += cls.output_mode_regs(ch, sp.output_mode)
+        regs += cls.output_highpass_regs(ch, sp.output_highpass)
+        regs += cls.output_polarity_regs(ch, sp.polarity)
+        for idx, eq in enumerate(sp.equalizer):
+            regs += cls.speaker_equalizer_regs(ch, idx + 1, eq)
+        regs += cls.crossover_regs(ch, sp.crossover)
+        regs += cls.clip_limiter_regs(ch, sp.clip_limiter)
+        regs += cls.peak_limiter_regs(ch, sp.peak_limiter)
+        regs += cls.rms_limiter_regs(ch, sp.rms_limiter)
+        return regs
+
+    async def set_speaker_equalizer(self, ch: int, index: int, eq: Equalizer):
+        await self.set_values(self.speaker_equalizer_regs(ch, index, eq))
+
+    async def set_crossover(self, ch: int, xr: Crossover):
+        await self.set_values(self.crossover_regs(ch, xr))
+
+    async def set_speaker_delay(self, ch: int, delay: Delay):
+        await self.set_values(self.speaker_delay_regs(ch, delay))
+
+    async def set_clip_limiter(self, ch: int, lim: ClipLimiter):
+        await self.set_values(self.clip_limiter_regs(ch, lim))
+
+    async def set_peak_limiter(self, ch: int, lim: PeakLimiter):
+        await self.set_values(self.peak_limiter_regs(ch, lim))
+
+    async def set_rms_limiter(self, ch: int, lim: RmsLimiter):
+        await self.set_values(self.rms_limiter_regs(ch, lim))
 
     async def set_output_mode(self, ch: int, mode: OutputMode):
-        assert(mode in OutputMode)
-        await self.set_str(f'OUT-{ch}.OUTPUT_MODE', str(mode))
+        await self.set_values(self.output_mode_regs(ch, mode))
 
     async def set_output_highpass(self, ch: int, freq: Optional[float]):
-        await self.set_float(f'OUT-{ch}.OUTPUT_HIGHPASS', 0 if not freq else freq)
+        await self.set_values(self.output_highpass_regs(ch, freq))
 
     async def set_output_polarity(self, ch: int, polarity: int):
-        assert(polarity in [-1, 1])
-        await self.set_int(f'OUT-{ch}.POLARITY', polarity)
-
-    async def set_fir(self, ch: int, fir: Fir):
-        await self.set_bool(f'OUT-{ch}.FIR.BYPASS', fir.bypass or len(fir.taps) == 0)
-        if len(fir.taps) > 0:
-            args = {
-                'channel': ch,
-                'taps': fir.taps
-            }
+        await self.set_values(self.output_polarity_regs(ch, polarity))
+
+    @staticmethod
+    def fir_regs(ch: int, fir: Fir) -> list:
+        return [(f'OUT-{ch}.FIR.BYPASS', _bool_value(fir.bypass or len(fir.taps) == 0))]
+
+    async def upload_fir(self, ch: int, fir: Fir, skip_unchanged: bool = False):
+        # skip_unchanged: not uploaded when the taps match the ones this
+        # connection last uploaded to the channel. Only safe while nothing
+        # else changes the amp's FIR. Returns whether the taps were uploaded.
+        packed = pack_taps(fir.taps)
+        digest = hashlib.sha256(packed).hexdigest()
+        key = (self._host, ch)
+        if skip_unchanged and self._fir_digest.get(key) == digest:
+            return False
+
+        self._fir_digest.pop(key, None)
+        if len(packed) > 0:
+            if self._fir_binary:
+                args = {
+                    'channel': ch,
+                    'taps_f32': base64.b64encode(packed).decode('ascii')
+                }
+            else:
+                args = {
+                    'channel': ch,
+                    'taps': _taps_list(fir.taps)
+                }
 
-            self.call_jrpc('apply_fir', args)
+            await self.call_jrpc('apply_fir', args)
         else:
             args = {
                 'channel': ch
             }
 
-            self.call_jrpc('clear_fir', args)
+            await self.call_jrpc('clear_fir', args)
+
+        self._fir_digest[key] = digest
+        return True
+
+    async def set_fir(self, ch: int, fir: Fir, skip_unchanged: bool = False):
+        await self.set_values(self.fir_regs(ch, fir))
+        await self.upload_fir(ch, fir, skip_unchanged)
 
     async def clear_preset(self, channel: int):
         args = { 
             "channel": channel,
         }
 
-        return self.call_jrpc('clear_preset', args)
+        self._fir_digest.pop((self._host, channel), None)
+        return await self.call_jrpc('clear_preset', args)
 
     async def decode_preset(self, infile: str):
         with open(infile, 'rb') as f:
@@ -254,33 +700,63 @@ class Connection:
             'preset': base64.b64encode(preset).decode('ascii')
         }
         
-        return self.call_jrpc('decode_preset', args)
-
-    async def set_preset(self, ch: int, sp: SpeakerPreset):
-        await self.clear_preset(ch)
-
-        await self.set_output_mode(ch, sp.output_mode)
-        await self.set_output_highpass(ch, sp.output_highpass)
-        await self.set_output_polarity(ch, sp.polarity)
-        for idx, eq in enumerate(sp.equalizer):
-            await self.set_speaker_equalizer(ch, idx + 1, eq)
-        await self.set_crossover(ch, sp.crossover)
-        await self.set_clip_limiter(ch, sp.clip_limiter)
-        await self.set_peak_limiter(ch, sp.peak_limiter)
-        await self.set_rms_limiter(ch, sp.rms_limiter)
-        await self.set_fir(ch, sp.fir)
-
-    async def protect_preset(self, ch: int, infile: str, outfile: str, store_flags=[ExportPresetParams], protect_flags=[ExportPresetParams]):
+        return await self.call_jrpc('decode_preset', args)
+
+    async def set_preset(self, ch: int, sp: SpeakerPreset, window: int = 16, timeout: float = 10.0,
+                         deadline: Optional[float] = None):
+        # deadline: seconds for the whole preset, no command waits longer
+        # than the time left. When it runs out the SETs still open fail with
+        # WriteError, later commands with DeadlineExceeded.
+        with Deadline(deadline):
+            await self.clear_preset(ch)
+
+            await self.set_values(self.preset_regs(ch, sp), window, timeout)
+            await self.set_fir(ch, sp.fir)
+
+    async def set_preset_delta(self, ch: int, sp: SpeakerPreset, window: int = 16, timeout: float = 10.0,
+                               deadline: Optional[float] = None) -> list:
+        # Read the channel once and only write what differs from `sp`. Falls
+        # back to a full set_preset when the channel state is not readable
+        # (e.g. a protected preset is loaded). Returns the registers written.
+        with Deadline(deadline):
+            return await self._set_preset_delta(ch, sp, window, timeout)
+
+    async def _set_preset_delta(self, ch: int, sp: SpeakerPreset, window: int, timeout: float) -> list:
+        # set_preset leaves the speaker delay as clear_preset resets it, so
+        # its cleared values are part of the target state
+        regs = self.preset_regs(ch, sp) + self.speaker_delay_regs(ch, Delay()) + self.fir_regs(ch, sp.fir)
+        current = await self.async_get_regs(f'OUT-{ch}.*', timeout)
+
+        target = dict(regs)
+        if any(reg not in current for reg in target):
+            await self.set_preset(ch, sp, window, timeout)
+            return [reg for reg, _ in regs]
+
+        changed = set(reg for reg, value in target.items() if not _same_value(current[reg], value))
+
+        # Keep repeated writes (limiter ATTACK) so the ordering rules still hold
+        regs = [(reg, value) for reg, value in regs if reg in changed]
+        await self.set_values(regs, window, timeout)
+
+        if await self.upload_fir(ch, sp.fir, skip_unchanged=True):
+            regs.append((f'OUT-{ch}.FIR', None))
+
+        return [reg for reg, _ in regs]
+
+    async def apply_preset(self, ch: int, infile: str):
         with open(infile, 'rb') as f:
             preset = f.read()
 
         args = {
-            "channel": 1,
+            "channel": ch,
             'preset': base64.b64encode(preset).decode('ascii')
         }
 
-        self.call_jrpc('apply_preset', args)
+        self._fir_digest.pop((self._host, ch), None)
+        return await self.call_jrpc('apply_preset', args)
 
+    async def protect_preset(self, ch: int, infile: str, outfile: str, store_flags=[ExportPresetParams], protect_flags=[ExportPresetParams],
+                             deadline: Optional[float] = None):
         name = Path(infile).stem
 
         args = {
@@ -291,7 +767,9 @@ class Connection:
             'protect': protect_flags
         }
 
-        j = self.call_jrpc('create_preset', args)
+        with Deadline(deadline):
+            await self.apply_preset(ch, infile)
+            j = await self.call_jrpc('create_preset', args)
 
         filename = j.get('filename')
         data = base64.b64decode(j.get('data'))
@@ -309,7 +787,7 @@ class Connection:
             'protect': protect_flags
         }
 
-        j = self.call_jrpc('create_preset', args)
+        j = await self.call_jrpc('create_preset', args)
 
         filename = j.get('filename')
         data = base64.b64decode(j.get('data'))
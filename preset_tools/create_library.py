@@ -1,24 +1,68 @@
 # SPDX-License-Identifier: MIT
 
-from connection import Connection, ExportPresetParams
+from connection import Connection
+from decode_cache import DecodeCache
 from speaker_library import SpeakerLibrary
 from preset import *
 import asyncio
 import os
+import sys
 import glob
 from natsort import natsorted
 
-TARGET = '192.168.64.100'
+# Amps used to decode presets the offline reader cannot handle, e.g.
+# ['192.168.64.100', '192.168.64.101']. Not needed for regular .zcp files.
+TARGETS = []
+
+# Reuse ids and decoded metadata of the previous build of the library,
+# only new and changed files are decoded
+INCREMENTAL = True
+
+# Decoded preset metadata is cached here between builds. The key includes
+# CACHE_VERSION (offline decoder) and the firmware and API version of the
+# amps in TARGETS, found with discovery/registry.py within DISCOVER_TIME.
+CACHE_DIR = '.decode_cache'
+CACHE_VERSION = '1'
+DISCOVER_TIME = 5.0
+DISCOVERY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'discovery')
+
+
+async def amp_versions(hosts) -> str:
+    # 'firmware/api' of the amps, '' if one of them is not found
+    sys.path.insert(0, DISCOVERY_DIR)
+    from registry import Discovery
+
+    loop = asyncio.get_event_loop()
+    end = loop.time() + DISCOVER_TIME
+    async with Discovery() as registry:
+        while 1:
+            devices = [registry.by_host(host) for host in hosts]
+            if all(devices):
+                return ','.join(sorted(set(f'{d.firmware_version}/{d.api_version}' for d in devices)))
+            if loop.time() >= end:
+                return ''
+            await asyncio.sleep(0.1)
+
 
 async def async_main():
-    print('Connecting to Amp...')
-    c = Connection()
-    await c.async_connect(TARGET)
+    connections = []
+    for target in TARGETS:
+        print(f'Connecting to Amp {target}...')
+        c = Connection()
+        await c.async_connect(target)
+        connections.append(c)
 
     name = 'Pascal Library'
     version = '1'
     outfile = f'out/speaker_lib_R{version}.zcl'
     outfile = os.path.abspath(outfile)
+    cache_version = CACHE_VERSION
+    if TARGETS:
+        versions = await amp_versions(TARGETS)
+        cache_version = f'{CACHE_VERSION}-{versions}' if versions else None
+        if not versions:
+            print('Firmware version of the amps unknown, decoding without cache')
+    cache = DecodeCache(os.path.abspath(CACHE_DIR), cache_version) if cache_version else None
 
     os.chdir('./lib')
 
@@ -26,20 +70,30 @@ async def async_main():
     files = natsorted(files)
 
     print('Create Speaker Library...')
-    spl = SpeakerLibrary(c, name, version)
+    spl = SpeakerLibrary(None, name, version, cache=cache)
+    if INCREMENTAL and os.path.exists(outfile):
+        print('Loading previous Library...')
+        spl.load_previous(outfile)
 
+    presets = []
     for file in files:
-        print(f'Adding file {file}')
         (dir, name) = os.path.split(file)
         name = os.path.basename(name)
 
-        await spl.add_preset(dir, name, file)
+        presets.append((dir, name, file))
+
+    print(f'Adding {len(presets)} files...')
+    await spl.add_presets(presets, connections=connections)
+
+    if cache:
+        print(f'Decode cache: {cache.stats()}')
+    print(', '.join(f'{v} {k}' for k, v in spl.changes.items()))
 
     print('Write Library...')
-    with open(outfile, 'wb') as f:
-        f.write(spl.to_preset_file())
+    spl.write_preset_file(outfile, manifest=INCREMENTAL)
 
-    await c.async_disconnect()
+    for c in connections:
+        await c.async_disconnect()
 
 
 asyncio.run(async_main())
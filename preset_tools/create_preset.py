@@ -2,6 +2,7 @@
 
 from connection import Connection, ExportPresetParams
 from preset import *
+from zcp_writer import write_preset
 import asyncio
 import random
 
@@ -50,15 +51,6 @@ async def async_main():
     sp.fir.bypass = False
     sp.fir.taps = [random.random() for i in range(512)]
 
-    print('Connecting to Amp...')
-    c = Connection()
-    await c.async_connect(TARGET)
-
-    print('Setting Preset...')
-    await c.set_preset(1, sp)
-
-    print('Generating Speaker Preset...')
-
     channel = 1
     preset_name = 'preset20'
     vendor_lock = False
@@ -80,6 +72,22 @@ async def async_main():
         # ExportPresetParams.Fir,
         # ExportPresetParams.Polarity
     ]
+    if not vendor_lock and not protect_flags and set(store_flags) == set(ExportPresetParams):
+        # Unprotected presets are encoded locally, no amplifier needed
+        filename = f'{preset_name}.zcp'
+        write_preset(filename, sp, preset_name)
+        print(f'Preset written to "{filename}"')
+        return
+
+    print('Connecting to Amp...')
+    c = Connection()
+    await c.async_connect(TARGET)
+
+    print('Setting Preset...')
+    await c.set_preset(1, sp)
+
+    print('Generating Speaker Preset...')
+
     (filename, data) = await c.create_preset(channel, preset_name, vendor_lock, store_flags, protect_flags)
 
     with open(filename, 'wb') as f:
@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: MIT
+
+# Deadlines for whole operations. Inside `with Deadline(30):` no amp command
+# waits longer than the time left, whatever its own timeout, so an operation
+# of many commands ends within 30 s even if the amp stalls. The deadline also
+# applies in tasks started inside the block. A nested deadline can only
+# shorten the enclosing one.
+#
+#   with Deadline(30):
+#       await c.set_preset(1, sp)
+
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: Optional[float]) -> None:
+        # None only keeps the enclosing deadline
+        self.expires = None if seconds is None else time.monotonic() + seconds
+        self._token = None
+
+    def remaining(self) -> Optional[float]:
+        return None if self.expires is None else self.expires - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def timeout(self, timeout: Optional[float] = None) -> Optional[float]:
+        # The smaller of `timeout` and the time left. Raises DeadlineExceeded
+        # once the deadline has passed.
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceeded('Deadline exceeded')
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def __enter__(self) -> 'Deadline':
+        outer = _current.get()
+        if outer is not None and outer.expires is not None:
+            if self.expires is None or outer.expires < self.expires:
+                self.expires = outer.expires
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        _current.reset(self._token)
+        self._token = None
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar('deadline', default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+def command_timeout(timeout: Optional[float]) -> Optional[float]:
+    # Timeout of a single command under the current deadline, if any
+    deadline = _current.get()
+    return timeout if deadline is None else deadline.timeout(timeout)
+
+
+def timeout_error(message: str = '') -> TimeoutError:
+    # Error for a command that timed out: DeadlineExceeded if the current
+    # deadline is the reason
+    deadline = _current.get()
+    if deadline is not None and deadline.expired:
+        return DeadlineExceeded(message or 'Deadline exceeded')
+    return TimeoutError(message)
@@ -0,0 +1,98 @@
+# SPDX-License-Identifier: MIT
+
+import hashlib
+import json
+import os
+import threading
+from typing import Optional
+
+
+class DecodeCache:
+    # On-disk cache of decoded preset metadata (name, id, vendorId), keyed by
+    # the SHA-256 of the preset bytes and `version` (decoder, firmware or API
+    # version). Least recently used entries are evicted above `max_bytes`.
+
+    def __init__(self, path: str, version: str = '', max_bytes: int = 64 * 1024 * 1024) -> None:
+        self._path = path
+        self._version = version.encode('utf8')
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._size = sum(os.path.getsize(f) for f in self._files())
+
+    def _files(self):
+        for entry in os.scandir(self._path):
+            if entry.is_dir():
+                for f in os.scandir(entry.path):
+                    if f.name.endswith('.json'):
+                        yield f.path
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self._path, key[:2], f'{key}.json')
+
+    def key(self, data: bytes) -> str:
+        return hashlib.sha256(self._version + b'\0' + data).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._file(key)
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: dict):
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        data = json.dumps(value).encode('utf8')
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._size += len(data) - replaced
+            evict = self._size > self._max_bytes
+        if evict:
+            self.evict()
+
+    def evict(self):
+        # Drop the oldest entries until the cache is at 90% of max_bytes
+        with self._lock:
+            files = []
+            for path in self._files():
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+
+            size = sum(s for _, s, _ in files)
+            for _, s, path in sorted(files):
+                if size <= self._max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                    size -= s
+                except OSError:
+                    pass
+            self._size = size
+
+    def stats(self) -> str:
+        return f'{self.hits} hits, {self.misses} misses, {self._size} bytes'
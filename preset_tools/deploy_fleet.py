@@ -0,0 +1,41 @@
+# SPDX-License-Identifier: MIT
+
+from fleet import deploy
+import asyncio
+import json
+import time
+
+FLEET_FILE = 'fleet.json'
+CONCURRENCY = 32
+TIMEOUT = 60.0
+# 'websocket' or 'tcp' (port 7621, less overhead per command)
+TRANSPORT = 'tcp'
+
+
+def progress(host: str, msg: str):
+    print(f'  {host}: {msg}')
+
+
+async def async_main():
+    # { "<host>": { "<channel>": "<path to .zcp>", ... }, ... }
+    with open(FLEET_FILE) as f:
+        fleet = json.load(f)
+
+    print(f'Deploying to {len(fleet)} amps...')
+    start = time.monotonic()
+    failed = []
+
+    async for result in deploy(fleet, CONCURRENCY, TIMEOUT, progress=progress, transport=TRANSPORT):
+        print(result)
+        if not result.ok:
+            failed.append(result.host)
+
+    elapsed = time.monotonic() - start
+    print(f'{len(fleet) - len(failed)}/{len(fleet)} amps deployed in {elapsed:.1f}s')
+    if failed:
+        print(f'Failed: {", ".join(failed)}')
+    else:
+        print(f'SUCCESS!\n')
+
+
+asyncio.run(async_main())
@@ -0,0 +1,101 @@
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import time
+from typing import Callable, Dict, Optional, Union
+
+from connection import Connection
+from deadline import Deadline, DeadlineExceeded
+from jrpc import JrpcClient
+from preset import SpeakerPreset
+
+
+class DeviceResult:
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.ok: bool = False
+        self.error: Optional[str] = None
+        self.channels: list = []
+        self.elapsed: float = 0
+
+    def __str__(self):
+        if self.ok:
+            return f'{self.host}: OK, channels {self.channels} in {self.elapsed:.2f}s'
+        return f'{self.host}: FAILED after {self.elapsed:.2f}s: {self.error}'
+
+
+async def _deploy_channels(c: Connection, host: str, channels: dict, result: DeviceResult, delta: bool, progress):
+    await c.async_connect(host)
+    progress(host, 'connected')
+
+    for ch, preset in channels.items():
+        ch = int(ch)
+        if isinstance(preset, SpeakerPreset):
+            if delta:
+                await c.set_preset_delta(ch, preset)
+            else:
+                await c.set_preset(ch, preset)
+        else:
+            await c.apply_preset(ch, str(preset))
+
+        result.channels.append(ch)
+        progress(host, f'channel {ch} done')
+
+
+async def deploy_device(host: str, channels: Dict[int, Union[SpeakerPreset, str]], timeout: float = 60.0,
+                        delta: bool = False, progress: Optional[Callable] = None,
+                        jrpc: Optional[JrpcClient] = None, transport='websocket') -> DeviceResult:
+    progress = progress or (lambda host, msg: None)
+    result = DeviceResult(host)
+    start = time.monotonic()
+
+    # transport: a TRANSPORTS name or a function host -> Transport, e.g.
+    # to give each amp its own TCP port
+    if callable(transport):
+        transport = transport(host)
+    c = Connection(jrpc, transport=transport)
+    try:
+        # The deadline shortens the timeouts of the single commands, so a
+        # stalled amp fails with a clean error before wait_for cancels
+        with Deadline(timeout):
+            await asyncio.wait_for(_deploy_channels(c, host, channels, result, delta, progress), timeout)
+        result.ok = True
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        result.error = f'timeout after {timeout}s'
+    except Exception as e:
+        result.error = str(e) or type(e).__name__
+    finally:
+        try:
+            await asyncio.wait_for(c.async_disconnect(), 2.0)
+        except Exception:
+            pass
+
+    result.elapsed = time.monotonic() - start
+    return result
+
+
+async def deploy(fleet: Dict[str, Dict[int, Union[SpeakerPreset, str]]], concurrency: int = 32, timeout: float = 60.0,
+                 delta: bool = False, progress: Optional[Callable] = None, transport='websocket'):
+    # fleet: host -> {channel: SpeakerPreset or path to a .zcp file}
+    # Yields a DeviceResult per host as soon as that host is finished, so
+    # a dead amp only costs its own timeout.
+    sem = asyncio.Semaphore(concurrency)
+    jrpc = JrpcClient()
+
+    async def run(host, channels):
+        async with sem:
+            if progress:
+                progress(host, 'started')
+            return await deploy_device(host, channels, timeout, delta, progress, jrpc, transport)
+
+    tasks = [asyncio.ensure_future(run(host, channels)) for host, channels in fleet.items()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Stopped early: let the cancelled deploys disconnect before the
+        # shared client closes
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await jrpc.close()
@@ -0,0 +1,174 @@
+# SPDX-License-Identifier: MIT
+
+# Many emulated amplifiers in one asyncio process, to try the deployment,
+# discovery and firmware tools at fleet scale. Every device is an EmulatedAmp
+# (amp_emulator.py) with its own registers and ports, announced over mDNS as
+# _pasconnect._tcp with the TXT records discovery reads.
+#
+#   async with VirtualFleet(200, update_rate=10) as fleet:
+#       async for result in deploy({host: {1: sp} for host in fleet.hosts}):
+#           ...
+#
+# Hosts are 'ip:http port'. Connect over websocket, or over TCP with
+# device.amp.tcp_transport() (fleet.tcp_transport for fleet.deploy). With `update_rate` every device changes its
+# meter registers that often per second, the changes are pushed to the
+# connections that SUBSCRIBE to them.
+
+import asyncio
+import random
+import socket
+from typing import Dict, List, Optional
+
+from amp_emulator import CHANNELS, LOCALHOST, EmulatedAmp, EmulatorConfig
+from transport import TcpTransport
+
+SERVICE_TYPE = '_pasconnect._tcp.local.'
+MODEL = 'SIM-4'
+VENDOR = 'Simulated'
+DEVICE_CLASS = 'amplifier'
+FIRMWARE_VERSION = '1.0.0'
+API_VERSION = '1'
+
+# Interval of the meter updates
+TICK = 0.05
+# Amps started at the same time
+START_BATCH = 64
+
+
+class VirtualDevice:
+    def __init__(self, index: int, amp: EmulatedAmp, model: str = MODEL,
+                 firmware_version: str = FIRMWARE_VERSION) -> None:
+        self.index = index
+        self.amp = amp
+        self.name = f'Sim Amp {index:04d}.{SERVICE_TYPE}'
+        self.serial = f'SIM{index:06d}'
+        self.model = model
+        self.vendor = VENDOR
+        self.device_class = DEVICE_CLASS
+        self.firmware_version = firmware_version
+        self.api_version = API_VERSION
+
+    @property
+    def host(self) -> str:
+        return self.amp.host
+
+    @property
+    def properties(self) -> Dict[str, str]:
+        # TXT records, as read by discovery.registry.Device
+        return {
+            'serial': self.serial,
+            'model': self.model,
+            'vendor': self.vendor,
+            'device_class': self.device_class,
+            'firmware_version': self.firmware_version,
+            'api_version': self.api_version,
+        }
+
+    def service_info(self):
+        from zeroconf import ServiceInfo
+
+        return ServiceInfo(SERVICE_TYPE, self.name, addresses=[socket.inet_aton(self.amp.ip)],
+                           port=self.amp.http_port, properties=self.properties,
+                           server=f'sim-amp-{self.index:04d}.local.')
+
+    def meter_regs(self) -> List[str]:
+        return [f'OUT-{ch}.METER.{meter}' for ch in range(1, self.amp.channels + 1)
+                for meter in ('LEVEL', 'GAIN_REDUCTION')] + ['DEVICE.TEMPERATURE']
+
+
+class VirtualFleet:
+    def __init__(self, count: int, config: Optional[EmulatorConfig] = None, channels: int = CHANNELS,
+                 model: str = MODEL, firmware_version: str = FIRMWARE_VERSION, update_rate: float = 0.0,
+                 advertise: bool = True, ip: str = LOCALHOST) -> None:
+        # config is shared by all devices. advertise needs zeroconf.
+        self.update_rate = update_rate
+        self.devices = [VirtualDevice(i + 1, EmulatedAmp(config, channels, ip), model, firmware_version)
+                        for i in range(count)]
+        self.updates = 0
+        self._advertise = advertise
+        self._zeroconf = None
+        self._updater = None
+        self._by_host: Dict[str, VirtualDevice] = {}
+
+    @property
+    def hosts(self) -> List[str]:
+        return [device.host for device in self.devices]
+
+    def by_host(self, host: str) -> Optional[VirtualDevice]:
+        return self._by_host.get(host)
+
+    def tcp_transport(self, host: str) -> TcpTransport:
+        # Transport factory for fleet.deploy(transport=fleet.tcp_transport)
+        return self._by_host[host].amp.tcp_transport()
+
+    def stats(self) -> dict:
+        # Sum of the EmulatedAmp counters of all devices
+        total = {}
+        for device in self.devices:
+            for key, value in device.amp.stats.items():
+                total[key] = total.get(key, 0) + value
+        total['updates'] = self.updates
+        return total
+
+    async def start(self) -> None:
+        for i in range(0, len(self.devices), START_BATCH):
+            await asyncio.gather(*[device.amp.start() for device in self.devices[i:i + START_BATCH]])
+
+        for device in self.devices:
+            for reg in device.meter_regs():
+                device.amp.registers[reg] = '0'
+            self._by_host[device.host] = device
+
+        if self._advertise:
+            from zeroconf.asyncio import AsyncZeroconf
+
+            self._zeroconf = AsyncZeroconf(interfaces=[self.devices[0].amp.ip if self.devices else LOCALHOST])
+            tasks = await asyncio.gather(*[self._zeroconf.async_register_service(device.service_info())
+                                           for device in self.devices])
+            await asyncio.gather(*tasks)
+
+        if self.update_rate > 0:
+            self._updater = asyncio.ensure_future(self._update_loop())
+
+    async def stop(self) -> None:
+        if self._updater:
+            self._updater.cancel()
+            self._updater = None
+        if self._zeroconf:
+            await self._zeroconf.async_unregister_all_services()
+            await self._zeroconf.async_close()
+            self._zeroconf = None
+        await asyncio.gather(*[device.amp.stop() for device in self.devices])
+
+    async def __aenter__(self) -> 'VirtualFleet':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    async def _update_loop(self) -> None:
+        # One task for the whole fleet. Every tick each device gets its share
+        # of updates; a fractional share is carried to the next tick.
+        rnd = random.Random()
+        loop = asyncio.get_event_loop()
+        meters = [device.meter_regs() for device in self.devices]
+        credit = 0.0
+        last = loop.time()
+        while 1:
+            await asyncio.sleep(TICK)
+            now = loop.time()
+            credit += self.update_rate * (now - last)
+            last = now
+
+            count = int(credit)
+            credit -= count
+            for device, regs in zip(self.devices, meters):
+                for _ in range(count):
+                    reg = rnd.choice(regs)
+                    if reg == 'DEVICE.TEMPERATURE':
+                        value = f'{rnd.uniform(35, 60):.1f}'
+                    else:
+                        value = f'{rnd.uniform(-60, 0):.1f}'
+                    device.amp.set_register(reg, value)
+            self.updates += count * len(self.devices)
@@ -0,0 +1,51 @@
+# SPDX-License-Identifier: MIT
+
+import asyncio
+from typing import Optional
+
+import aiohttp
+from jsonrpcclient import Ok, parse, request
+
+
+class JrpcClient:
+    # Async JSON-RPC client over a keep-alive connection pool. One client can
+    # be shared by many Connection objects: aiohttp pools per host, so calls
+    # to different amps run in parallel and calls to the same amp reuse up to
+    # `limit_per_host` open connections.
+
+    def __init__(self, timeout: float = 10.0, limit_per_host: int = 4, keepalive: float = 30.0) -> None:
+        self._timeout = timeout
+        self._limit_per_host = limit_per_host
+        self._keepalive = keepalive
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self._limit_per_host,
+                                             keepalive_timeout=self._keepalive)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self._timeout))
+        return self._session
+
+    async def call(self, host: str, name: str, args, timeout: Optional[float] = None):
+        session = self._get_session()
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+
+        try:
+            async with session.post(f'http://{host}/jrpc', json=request(name, args), **kwargs) as response:
+                j = await response.json(content_type=None)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'{name} on {host} timed out')
+
+        parsed = parse(j)
+        if isinstance(parsed, Ok):
+            return parsed.result
+        else:
+            raise Exception(parsed.message)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,205 @@
+# SPDX-License-Identifier: MIT
+
+# Traffic statistics of Connection: count, errors, timeouts and a latency
+# histogram per host, command (GET, SET, SUBSCRIBE, ..., JRPC) and target
+# (register prefix or JSON-RPC method), plus the text protocol bytes sent and
+# received per host. Recording is a dict lookup and a few additions, cheap
+# enough to stay on. All connections share METRICS unless given their own.
+#
+#   METRICS.summary(host='192.168.64.100', command='SET')
+#   print(METRICS.to_prometheus())
+#   print(METRICS.to_json())
+
+import bisect
+import json
+from typing import Dict, List, Optional, Tuple
+
+# Upper bounds of the latency buckets in seconds, the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Register prefix used as target: 'OUT-1.SPEAKER_EQ-3.GAIN' -> 'OUT-1.SPEAKER_EQ-3'
+PREFIX_DEPTH = 2
+
+OK = 'ok'
+ERROR = 'error'
+TIMEOUT = 'timeout'
+
+
+class CommandStats:
+    __slots__ = ('count', 'errors', 'timeouts', 'sum', 'buckets')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.sum = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds: float, outcome: str = OK) -> None:
+        self.count += 1
+        self.sum += seconds
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        if outcome == ERROR:
+            self.errors += 1
+        elif outcome == TIMEOUT:
+            self.timeouts += 1
+
+    def merge(self, other: 'CommandStats') -> None:
+        self.count += other.count
+        self.errors += other.errors
+        self.timeouts += other.timeouts
+        self.sum += other.sum
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-quantile, inf if beyond
+        # the last bound
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.buckets):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'sum': self.sum,
+            'mean': self.mean,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': list(self.buckets),
+        }
+
+
+class Metrics:
+    def __init__(self, prefix_depth: int = PREFIX_DEPTH) -> None:
+        self.prefix_depth = prefix_depth
+        # (host, command, target) -> CommandStats
+        self.commands: Dict[Tuple[str, str, str], CommandStats] = {}
+        # host -> [bytes sent, bytes received]
+        self.traffic: Dict[str, List[int]] = {}
+
+    def reset(self) -> None:
+        self.commands.clear()
+        self.traffic.clear()
+
+    # --- recording ---
+
+    def record(self, host: str, command: str, target: str, seconds: float, outcome: str = OK) -> None:
+        key = (host, command, target)
+        stats = self.commands.get(key)
+        if stats is None:
+            stats = self.commands[key] = CommandStats()
+        stats.observe(seconds, outcome)
+
+    def record_command(self, host: str, cmd: str, seconds: float, outcome: str = OK) -> None:
+        # cmd: text protocol command, e.g. 'SET OUT-1.POLARITY 1'
+        parts = cmd.split(' ', 2)
+        target = self.target(parts[1]) if len(parts) > 1 else ''
+        self.record(host, parts[0], target, seconds, outcome)
+
+    def target(self, reg: str) -> str:
+        parts = reg.split('.', self.prefix_depth)
+        return '.'.join(parts[:self.prefix_depth])
+
+    def sent(self, host: str, n: int) -> None:
+        traffic = self.traffic.get(host)
+        if traffic is None:
+            traffic = self.traffic[host] = [0, 0]
+        traffic[0] += n
+
+    def received(self, host: str, n: int) -> None:
+        traffic = self.traffic.get(host)
+        if traffic is None:
+            traffic = self.traffic[host] = [0, 0]
+        traffic[1] += n
+
+    # --- queries ---
+
+    def summary(self, host: Optional[str] = None, command: Optional[str] = None,
+                target: Optional[str] = None) -> CommandStats:
+        # Statistics of all commands matching the given labels
+        total = CommandStats()
+        for (h, c, t), stats in self.commands.items():
+            if (host is None or h == host) and (command is None or c == command) and (target is None or t == target):
+                total.merge(stats)
+        return total
+
+    def group_by(self, label: str) -> Dict[str, CommandStats]:
+        # label: 'host', 'command' or 'target'
+        index = ('host', 'command', 'target').index(label)
+        groups = {}
+        for key, stats in self.commands.items():
+            group = groups.get(key[index])
+            if group is None:
+                group = groups[key[index]] = CommandStats()
+            group.merge(stats)
+        return groups
+
+    def to_dict(self) -> dict:
+        return {
+            'buckets': list(BUCKETS),
+            'commands': [dict(host=h, command=c, target=t, **stats.to_dict())
+                         for (h, c, t), stats in sorted(self.commands.items())],
+            'traffic': {host: {'sent': sent, 'received': received}
+                        for host, (sent, received) in sorted(self.traffic.items())},
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, namespace: str = 'amp') -> str:
+        # Prometheus text exposition format
+        lines = []
+
+        def metric(name, kind, help):
+            lines.append(f'# HELP {namespace}_{name} {help}')
+            lines.append(f'# TYPE {namespace}_{name} {kind}')
+
+        items = sorted(self.commands.items())
+        labels = {key: f'host="{_escape(key[0])}",command="{_escape(key[1])}",target="{_escape(key[2])}"'
+                  for key, _ in items}
+
+        for name, attr, help in (('commands_total', 'count', 'Commands sent'),
+                                 ('command_errors_total', 'errors', 'Commands answered with an error'),
+                                 ('command_timeouts_total', 'timeouts', 'Commands without an answer in time')):
+            metric(name, 'counter', help)
+            for key, stats in items:
+                lines.append(f'{namespace}_{name}{{{labels[key]}}} {getattr(stats, attr)}')
+
+        metric('command_seconds', 'histogram', 'Command latency')
+        for key, stats in items:
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float('inf'),), stats.buckets):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{namespace}_command_seconds_bucket{{{labels[key]},le="{le}"}} {cumulative}')
+            lines.append(f'{namespace}_command_seconds_sum{{{labels[key]}}} {stats.sum}')
+            lines.append(f'{namespace}_command_seconds_count{{{labels[key]}}} {stats.count}')
+
+        for name, index, help in (('bytes_sent_total', 0, 'Text protocol bytes sent'),
+                                  ('bytes_received_total', 1, 'Text protocol bytes received')):
+            metric(name, 'counter', help)
+            for host, traffic in sorted(self.traffic.items()):
+                lines.append(f'{namespace}_{name}{{host="{_escape(host)}"}} {traffic[index]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Shared by all connections that are not given their own Metrics
+METRICS = Metrics()
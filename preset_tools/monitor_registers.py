@@ -0,0 +1,25 @@
+# SPDX-License-Identifier: MIT
+
+from connection import Connection
+import asyncio
+
+TARGET = '192.168.64.100'
+PATTERN = 'OUT-1.*'
+
+
+async def async_main():
+    print('Connecting to Amp...')
+    c = Connection()
+    await c.async_connect(TARGET)
+
+    await c.async_subscribe(PATTERN)
+    print(f'{len(c.registers)} registers, waiting for changes...')
+
+    try:
+        async for reg, value in c.changes(PATTERN):
+            print(f'{reg} = {value}')
+    finally:
+        await c.async_disconnect()
+
+
+asyncio.run(async_main())
@@ -1,5 +1,7 @@
 # SPDX-License-Identifier: MIT
 
+import sys
+from array import array
 from enum import Enum, auto
 from typing import List, Optional
 
@@ -66,7 +68,43 @@ class OutputMode(str, Enum):
         return self.value
 
 
+class Range:
+    # Inclusive limits of a numeric parameter. The setters below and the bulk
+    # checks in validation.py use the same instances.
+    __slots__ = ('low', 'high')
+
+    def __init__(self, low: float, high: float) -> None:
+        self.low = low
+        self.high = high
+
+    def __contains__(self, value) -> bool:
+        return self.low <= value <= self.high
+
+    def check(self, name: str, value):
+        if value not in self:
+            raise ValueError(f'{name} {value} out of range [{self.low}, {self.high}]')
+        return value
+
+    def __repr__(self) -> str:
+        return f'Range({self.low}, {self.high})'
+
+
+GAIN_RANGE = Range(-15, 15)
+FREQ_RANGE = Range(20, 20000)
+Q_RANGE = Range(0.4, 30)
+DELAY_RANGE = Range(0, 0.01)
+POLARITIES = (-1, 1)
+
+
+def check_enum(name: str, value, enum: type):
+    if not isinstance(value, enum):
+        raise ValueError(f'{name} {value!r} is not a {enum.__name__}')
+    return value
+
+
 class Equalizer:
+    __slots__ = ('_bypass', '_type', '_gain', '_freq', '_q')
+
     def __init__(self) -> None:
         self._bypass = False
         self._type = EqualizerType.PARAMETRIC
@@ -88,8 +126,7 @@ class Equalizer:
 
     @type.setter
     def type(self, value: EqualizerType):
-        assert(value in EqualizerType)
-        self._type = value
+        self._type = check_enum('type', value, EqualizerType)
 
     @property
     def gain(self) -> float:
@@ -97,8 +134,7 @@ class Equalizer:
 
     @gain.setter
     def gain(self, value: float):
-        assert(-15 < value < 15)
-        self._gain = value
+        self._gain = GAIN_RANGE.check('gain', value)
 
     @property
     def freq(self) -> float:
@@ -106,8 +142,7 @@ class Equalizer:
 
     @freq.setter
     def freq(self, value: float):
-        assert(20 < value < 20000)
-        self._freq = value
+        self._freq = FREQ_RANGE.check('freq', value)
 
     @property
     def q(self) -> float:
@@ -115,11 +150,12 @@ class Equalizer:
 
     @q.setter
     def q(self, value: float):
-        assert(0.4 < value < 30)
-        self._q = value
+        self._q = Q_RANGE.check('q', value)
 
 
 class Crossover:
+    __slots__ = ('_bypass', '_gain', '_lowpass_type', '_lowpass_freq', '_highpass_type', '_highpass_freq')
+
     def __init__(self) -> None:
         self._bypass = True
         self._gain = 0
@@ -142,8 +178,7 @@ class Crossover:
 
     @gain.setter
     def gain(self, value: float):
-        assert(-15 < value < 15)
-        self._gain = value
+        self._gain = GAIN_RANGE.check('gain', value)
 
     @property
     def lowpass_type(self) -> CrossoverType:
@@ -151,8 +186,7 @@ class Crossover:
 
     @lowpass_type.setter
     def lowpass_type(self, value: CrossoverType):
-        assert(value in CrossoverType)
-        self._lowpass_type = value
+        self._lowpass_type = check_enum('lowpass_type', value, CrossoverType)
 
     @property
     def lowpass_freq(self) -> float:
@@ -160,8 +194,7 @@ class Crossover:
 
     @lowpass_freq.setter
     def lowpass_freq(self, value: float):
-        assert(20 < value < 20000)
-        self._lowpass_freq = value
+        self._lowpass_freq = FREQ_RANGE.check('lowpass_freq', value)
 
     @property
     def highpass_type(self) -> CrossoverType:
@@ -169,8 +202,7 @@ class Crossover:
 
     @highpass_type.setter
     def highpass_type(self, value: CrossoverType):
-        assert(value in CrossoverType)
-        self._highpass_type = value
+        self._highpass_type = check_enum('highpass_type', value, CrossoverType)
 
     @property
     def highpass_freq(self) -> float:
@@ -178,11 +210,12 @@ class Crossover:
 
     @highpass_freq.setter
     def highpass_freq(self, value: float):
-        assert(20 < value < 20000)
-        self._highpass_freq = value
+        self._highpass_freq = FREQ_RANGE.check('highpass_freq', value)
 
 
 class Delay:
+    __slots__ = ('_bypass', '_time')
+
     def __init__(self) -> None:
         self._bypass = True
         self._time = 0
@@ -201,11 +234,12 @@ class Delay:
 
     @time.setter
     def time(self, value: float):
-        assert(0 < value < 0.01)
-        self._time = value
+        self._time = DELAY_RANGE.check('time', value)
 
 
 class ClipLimiter:
+    __slots__ = ('_bypass', '_mode')
+
     def __init__(self) -> None:
         self._bypass = True
         self._mode = ClipLimiterMode.NORMAL
@@ -224,11 +258,12 @@ class ClipLimiter:
 
     @mode.setter
     def mode(self, value: ClipLimiterMode):
-        assert(value in ClipLimiterMode)
-        self._mode = value
+        self._mode = check_enum('mode', value, ClipLimiterMode)
 
 
 class PeakLimiter:
+    __slots__ = ('_bypass', '_auto', '_threshold', '_attack', '_release', '_hold', '_knee')
+
     def __init__(self) -> None:
         self._bypass = True
         self._auto = True
@@ -296,6 +331,8 @@ class PeakLimiter:
 
 
 class RmsLimiter:
+    __slots__ = ('_bypass', '_threshold', '_attack', '_release', '_hold', '_knee')
+
     def __init__(self) -> None:
         self._bypass = True
         self._threshold = 0
@@ -354,6 +391,8 @@ class RmsLimiter:
 
 
 class Fir:
+    __slots__ = ('_bypass', '_taps')
+
     def __init__(self) -> None:
         self._bypass = True
         self._taps = []
@@ -376,6 +415,9 @@ class Fir:
 
 
 class SpeakerPreset:
+    __slots__ = ('_output_mode', '_polarity', '_output_highpass', '_eq', '_xr', '_delay', '_fir',
+                 '_clip_limiter', '_peak_limiter', '_rms_limiter')
+
     def __init__(self) -> None:
         self._output_mode = OutputMode.OUTPUT_MODE_8R
         self._polarity = 1
@@ -403,7 +445,8 @@ class SpeakerPreset:
 
     @polarity.setter
     def polarity(self, value: int):
-        assert(value in [-1, 1])
+        if value not in POLARITIES:
+            raise ValueError(f'polarity {value} is not -1 or 1')
         self._polarity = value
 
     @property
@@ -412,7 +455,8 @@ class SpeakerPreset:
 
     @output_highpass.setter
     def output_highpass(self, value: Optional[float]):
-        assert(value is None or value in [20, 20000])
+        if value is not None:
+            FREQ_RANGE.check('output_highpass', value)
         self._output_highpass = value
 
     @property
@@ -431,6 +475,14 @@ class SpeakerPreset:
     def crossover(self, value: Crossover):
         self._xr = value
 
+    @property
+    def delay(self) -> Delay:
+        return self._delay
+
+    @delay.setter
+    def delay(self, value: Delay):
+        self._delay = value
+
     @property
     def clip_limiter(self) -> ClipLimiter:
         return self._clip_limiter
@@ -462,3 +514,22 @@ class SpeakerPreset:
     @fir.setter
     def fir(self, value: Fir):
         self._fir = value
+
+
+def pack_taps(taps) -> bytes:
+    # FIR taps as packed little-endian float32. float32 buffers (NumPy
+    # arrays, array('f'), ZcpPreset.fir_taps) are copied as is.
+    try:
+        mv = memoryview(taps)
+    except TypeError:
+        mv = None
+
+    if mv is not None and mv.format.lstrip('@=<') == 'f' and sys.byteorder == 'little':
+        return mv.tobytes()
+    if hasattr(taps, 'astype'):
+        return taps.astype('<f4').tobytes()
+
+    a = array('f', taps)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tobytes()
@@ -0,0 +1,213 @@
+# SPDX-License-Identifier: MIT
+
+# Columnar storage for many speaker presets. Every preset is one record of a
+# NumPy structured array, so thousands of presets take a single allocation
+# and can be generated or checked with array operations. SpeakerPreset
+# objects are only created when a preset is accessed.
+#
+#   pa = PresetArray.empty(1000)
+#   pa['eq']['gain'][:, 0] = np.linspace(-6, 6, 1000)
+#   pa['xr']['highpass_freq'] = 80
+#   sp = pa[10]             # SpeakerPreset
+#   part = pa[100:200]      # PresetArray, a view on the same memory
+#
+# Enums are stored zero based in the order of preset.py, output_highpass
+# None as NaN. FIR taps have no fixed size, the Fir objects (or None) are
+# kept in an object array beside the records and sliced along with them.
+
+from enum import Enum
+from typing import Iterable, Iterator, List, Union
+
+import numpy as np
+
+from preset import *
+
+EQ_BANDS = 15
+
+_OUTPUT_MODES = list(OutputMode)
+_EQUALIZER_TYPES = list(EqualizerType)
+_CROSSOVER_TYPES = list(CrossoverType)
+_CLIP_LIMITER_MODES = list(ClipLimiterMode)
+
+EQUALIZER_DTYPE = np.dtype([
+    ('bypass', '?'),
+    ('type', 'u1'),
+    ('gain', 'f8'),
+    ('freq', 'f8'),
+    ('q', 'f8'),
+])
+
+CROSSOVER_DTYPE = np.dtype([
+    ('bypass', '?'),
+    ('gain', 'f8'),
+    ('lowpass_type', 'u1'),
+    ('lowpass_freq', 'f8'),
+    ('highpass_type', 'u1'),
+    ('highpass_freq', 'f8'),
+])
+
+DELAY_DTYPE = np.dtype([
+    ('bypass', '?'),
+    ('time', 'f8'),
+])
+
+CLIP_LIMITER_DTYPE = np.dtype([
+    ('bypass', '?'),
+    ('mode', 'u1'),
+])
+
+PEAK_LIMITER_DTYPE = np.dtype([
+    ('bypass', '?'),
+    ('auto', '?'),
+    ('threshold', 'f8'),
+    ('attack', 'f8'),
+    ('release', 'f8'),
+    ('hold', 'f8'),
+    ('knee', 'f8'),
+])
+
+RMS_LIMITER_DTYPE = np.dtype([
+    ('bypass', '?'),
+    ('threshold', 'f8'),
+    ('attack', 'f8'),
+    ('release', 'f8'),
+    ('hold', 'f8'),
+    ('knee', 'f8'),
+])
+
+PRESET_DTYPE = np.dtype([
+    ('output_mode', 'u1'),
+    ('polarity', 'i1'),
+    ('output_highpass', 'f8'),
+    ('eq', EQUALIZER_DTYPE, (EQ_BANDS,)),
+    ('xr', CROSSOVER_DTYPE),
+    ('delay', DELAY_DTYPE),
+    ('clip_limiter', CLIP_LIMITER_DTYPE),
+    ('peak_limiter', PEAK_LIMITER_DTYPE),
+    ('rms_limiter', RMS_LIMITER_DTYPE),
+])
+
+
+def _index(value: Enum) -> int:
+    return value.value - 1
+
+
+def _record(sp: SpeakerPreset) -> tuple:
+    # SpeakerPreset -> PRESET_DTYPE record
+    xr = sp.crossover
+    delay = sp.delay
+    clip = sp.clip_limiter
+    peak = sp.peak_limiter
+    rms = sp.rms_limiter
+    return (
+        _OUTPUT_MODES.index(sp.output_mode),
+        sp.polarity,
+        np.nan if sp.output_highpass is None else sp.output_highpass,
+        [(eq.bypass, _index(eq.type), eq.gain, eq.freq, eq.q) for eq in sp.equalizer],
+        (xr.bypass, xr.gain, _index(xr.lowpass_type), xr.lowpass_freq, _index(xr.highpass_type), xr.highpass_freq),
+        (delay.bypass, delay.time),
+        (clip.bypass, _index(clip.mode)),
+        (peak.bypass, peak.auto, peak.threshold, peak.attack, peak.release, peak.hold, peak.knee),
+        (rms.bypass, rms.threshold, rms.attack, rms.release, rms.hold, rms.knee),
+    )
+
+
+_DEFAULT = np.array(_record(SpeakerPreset()), dtype=PRESET_DTYPE)
+
+
+class PresetArray:
+    def __init__(self, data: np.ndarray, fir=None) -> None:
+        if data.dtype != PRESET_DTYPE or data.ndim != 1:
+            raise ValueError('Expected a 1-d array of PRESET_DTYPE')
+        if fir is None:
+            fir = np.full(len(data), None, dtype=object)
+        elif not isinstance(fir, np.ndarray):
+            fir_list = fir
+            fir = np.empty(len(fir_list), dtype=object)
+            fir[:] = fir_list
+        if len(fir) != len(data):
+            raise ValueError('Length of fir does not match the presets')
+
+        self.data = data
+        self.fir = fir
+
+    @classmethod
+    def empty(cls, n: int) -> 'PresetArray':
+        # n presets with the SpeakerPreset defaults
+        return cls(np.full(n, _DEFAULT, dtype=PRESET_DTYPE))
+
+    @classmethod
+    def from_presets(cls, presets: Iterable[SpeakerPreset]) -> 'PresetArray':
+        presets = list(presets)
+        data = np.array([_record(sp) for sp in presets], dtype=PRESET_DTYPE)
+        return cls(data, [sp.fir for sp in presets])
+
+    @classmethod
+    def concatenate(cls, arrays: Iterable['PresetArray']) -> 'PresetArray':
+        arrays = list(arrays)
+        data = np.concatenate([a.data for a in arrays]) if arrays else np.empty(0, PRESET_DTYPE)
+        fir = np.concatenate([a.fir for a in arrays]) if arrays else None
+        return cls(data, fir)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, key) -> Union[SpeakerPreset, 'PresetArray', np.ndarray]:
+        # int: SpeakerPreset, str: column (view), slice: PresetArray (view),
+        # index array or mask: PresetArray (copy)
+        if isinstance(key, str):
+            return self.data[key]
+        if isinstance(key, (int, np.integer)):
+            return self.preset(key)
+        return PresetArray(self.data[key], self.fir[key])
+
+    def __setitem__(self, index: int, sp: SpeakerPreset) -> None:
+        self.data[index] = _record(sp)
+        self.fir[index] = sp.fir
+
+    def __iter__(self) -> Iterator[SpeakerPreset]:
+        for i in range(len(self.data)):
+            yield self.preset(i)
+
+    def preset(self, index: int) -> SpeakerPreset:
+        # The fields are filled in directly, without the setters: no checks
+        # per field keeps this fast, ranges are checked for the whole array
+        # by validation.validate.
+        r = self.data[index].item()
+        output_mode, polarity, highpass, bands, x, d, c, p, m = r
+        sp = SpeakerPreset()
+
+        sp._output_mode = _OUTPUT_MODES[output_mode]
+        sp._polarity = polarity
+        sp._output_highpass = None if highpass != highpass else highpass
+
+        for eq, band in zip(sp._eq, bands.tolist()):
+            eq._bypass, eq._type, eq._gain, eq._freq, eq._q = band
+            eq._type = _EQUALIZER_TYPES[eq._type]
+
+        xr = sp._xr
+        xr._bypass, xr._gain, xr._lowpass_type, xr._lowpass_freq, xr._highpass_type, xr._highpass_freq = x
+        xr._lowpass_type = _CROSSOVER_TYPES[xr._lowpass_type]
+        xr._highpass_type = _CROSSOVER_TYPES[xr._highpass_type]
+
+        sp._delay._bypass, sp._delay._time = d
+
+        clip = sp._clip_limiter
+        clip._bypass, clip._mode = c
+        clip._mode = _CLIP_LIMITER_MODES[clip._mode]
+
+        peak = sp._peak_limiter
+        peak._bypass, peak._auto, peak._threshold, peak._attack, peak._release, peak._hold, peak._knee = p
+
+        rms = sp._rms_limiter
+        rms._bypass, rms._threshold, rms._attack, rms._release, rms._hold, rms._knee = m
+
+        if self.fir[index] is not None:
+            sp._fir = self.fir[index]
+        return sp
+
+    def to_presets(self) -> List[SpeakerPreset]:
+        return list(self)
+
+    def copy(self) -> 'PresetArray':
+        return PresetArray(self.data.copy(), self.fir.copy())
@@ -0,0 +1,269 @@
+# SPDX-License-Identifier: MIT
+
+# Local storage of SpeakerPresets, no amplifier needed.
+#
+# JSON (.json): one preset or a list of presets, readable and editable.
+# Values are checked by the SpeakerPreset setters on load.
+#
+# Binary (.spb): any number of presets for batch tools. Little endian:
+#
+#   header   magic b'SPB\x01', u32 count, u32 record size, u32 reserved
+#   records  count x PRESET_DTYPE (see preset_array.py)
+#   fir      count x FIR_DTYPE
+#   taps     float32 FIR taps, referenced by offset from the start of file
+#
+# load_binary() maps the file and copies only the records. The FIR taps of a
+# preset are read from the mapping when they are first accessed.
+
+import json
+import mmap
+import struct
+from typing import List, Union
+
+import numpy as np
+
+from preset import *
+from preset_array import PRESET_DTYPE, PresetArray
+
+JSON_FORMAT = 'speaker-preset'
+JSON_VERSION = 1
+
+MAGIC = b'SPB\x01'
+_HEADER = struct.Struct('<4sIII')
+
+_RECORD_DTYPE = PRESET_DTYPE.newbyteorder('<')
+FIR_DTYPE = np.dtype([
+    ('present', 'u1'),
+    ('bypass', 'u1'),
+    ('reserved', '<u2'),
+    ('taps', '<u4'),
+    ('offset', '<u8'),
+])
+
+
+class PresetFileError(Exception):
+    pass
+
+
+class LazyFir(Fir):
+    # FIR block of a binary preset file, taps are decoded on first access
+    # as a read-only float32 array backed by the file mapping.
+    __slots__ = ('_buf', '_offset', '_count')
+
+    def __init__(self, buf, offset: int, count: int, bypass: bool) -> None:
+        super().__init__()
+        self._bypass = bypass
+        self._taps = None
+        self._buf = buf
+        self._offset = offset
+        self._count = count
+
+    @property
+    def taps(self):
+        if self._taps is None:
+            self._taps = np.frombuffer(self._buf, '<f4', self._count, self._offset)
+        return self._taps
+
+    @taps.setter
+    def taps(self, value):
+        self._taps = value
+
+    @property
+    def loaded(self) -> bool:
+        return self._taps is not None
+
+    def __reduce__(self):
+        # The mapping cannot be pickled, worker processes get a plain Fir
+        return (_fir, (self._bypass, np.array(self.taps)))
+
+
+def _fir(bypass: bool, taps) -> Fir:
+    fir = Fir()
+    fir.bypass = bypass
+    fir.taps = taps
+    return fir
+
+
+# --- JSON ---
+
+def preset_to_dict(sp: SpeakerPreset) -> dict:
+    xr = sp.crossover
+    peak = sp.peak_limiter
+    rms = sp.rms_limiter
+    return {
+        'format': JSON_FORMAT,
+        'version': JSON_VERSION,
+        'output_mode': sp.output_mode.value,
+        'polarity': sp.polarity,
+        'output_highpass': sp.output_highpass,
+        'equalizer': [{
+            'bypass': eq.bypass,
+            'type': eq.type.name,
+            'gain': eq.gain,
+            'freq': eq.freq,
+            'q': eq.q,
+        } for eq in sp.equalizer],
+        'crossover': {
+            'bypass': xr.bypass,
+            'gain': xr.gain,
+            'lowpass_type': xr.lowpass_type.name,
+            'lowpass_freq': xr.lowpass_freq,
+            'highpass_type': xr.highpass_type.name,
+            'highpass_freq': xr.highpass_freq,
+        },
+        'delay': {
+            'bypass': sp.delay.bypass,
+            'time': sp.delay.time,
+        },
+        'clip_limiter': {
+            'bypass': sp.clip_limiter.bypass,
+            'mode': sp.clip_limiter.mode.name,
+        },
+        'peak_limiter': {
+            'bypass': peak.bypass,
+            'auto': peak.auto,
+            'threshold': peak.threshold,
+            'attack': peak.attack,
+            'release': peak.release,
+            'hold': peak.hold,
+            'knee': peak.knee,
+        },
+        'rms_limiter': {
+            'bypass': rms.bypass,
+            'threshold': rms.threshold,
+            'attack': rms.attack,
+            'release': rms.release,
+            'hold': rms.hold,
+            'knee': rms.knee,
+        },
+        'fir': {
+            'bypass': sp.fir.bypass,
+            'taps': [float(tap) for tap in sp.fir.taps],
+        },
+    }
+
+
+def _set(obj, d: dict, keys) -> None:
+    for key in keys:
+        if key in d:
+            setattr(obj, key, d[key])
+
+
+def preset_from_dict(d: dict) -> SpeakerPreset:
+    # Missing keys keep the SpeakerPreset defaults
+    if d.get('format', JSON_FORMAT) != JSON_FORMAT or d.get('version', JSON_VERSION) > JSON_VERSION:
+        raise PresetFileError(f'Unsupported preset format: {d.get("format")} {d.get("version")}')
+
+    sp = SpeakerPreset()
+    try:
+        if 'output_mode' in d:
+            sp.output_mode = OutputMode(d['output_mode'])
+        _set(sp, d, ('polarity', 'output_highpass'))
+
+        bands = d.get('equalizer', [])
+        if len(bands) > len(sp.equalizer):
+            raise PresetFileError(f'Too many equalizer bands: {len(bands)}')
+        for eq, band in zip(sp.equalizer, bands):
+            if 'type' in band:
+                eq.type = EqualizerType[band['type']]
+            _set(eq, band, ('bypass', 'gain', 'freq', 'q'))
+
+        xr = d.get('crossover', {})
+        if 'lowpass_type' in xr:
+            sp.crossover.lowpass_type = CrossoverType[xr['lowpass_type']]
+        if 'highpass_type' in xr:
+            sp.crossover.highpass_type = CrossoverType[xr['highpass_type']]
+        _set(sp.crossover, xr, ('bypass', 'gain', 'lowpass_freq', 'highpass_freq'))
+
+        _set(sp.delay, d.get('delay', {}), ('bypass', 'time'))
+
+        clip = d.get('clip_limiter', {})
+        if 'mode' in clip:
+            sp.clip_limiter.mode = ClipLimiterMode[clip['mode']]
+        _set(sp.clip_limiter, clip, ('bypass',))
+
+        _set(sp.peak_limiter, d.get('peak_limiter', {}),
+             ('bypass', 'auto', 'threshold', 'attack', 'release', 'hold', 'knee'))
+        _set(sp.rms_limiter, d.get('rms_limiter', {}),
+             ('bypass', 'threshold', 'attack', 'release', 'hold', 'knee'))
+        _set(sp.fir, d.get('fir', {}), ('bypass', 'taps'))
+    except KeyError as e:
+        raise PresetFileError(f'Unknown value: {e}') from None
+
+    return sp
+
+
+def save_json(path: str, presets: Union[SpeakerPreset, List[SpeakerPreset]]) -> None:
+    if isinstance(presets, SpeakerPreset):
+        data = preset_to_dict(presets)
+    else:
+        data = [preset_to_dict(sp) for sp in presets]
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def load_json(path: str) -> Union[SpeakerPreset, List[SpeakerPreset]]:
+    # A single preset or a list, as saved
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return [preset_from_dict(d) for d in data]
+    return preset_from_dict(data)
+
+
+# --- binary ---
+
+def save_binary(path: str, presets: Union[SpeakerPreset, List[SpeakerPreset], PresetArray]) -> None:
+    if isinstance(presets, SpeakerPreset):
+        presets = [presets]
+    if not isinstance(presets, PresetArray):
+        presets = PresetArray.from_presets(presets)
+
+    count = len(presets)
+    records = presets.data.astype(_RECORD_DTYPE, copy=False)
+    fir = np.zeros(count, dtype=FIR_DTYPE)
+
+    offset = _HEADER.size + records.nbytes + fir.nbytes
+    blocks = []
+    for i, f in enumerate(presets.fir):
+        if f is None:
+            continue
+        taps = np.asarray(f.taps, dtype='<f4')
+        fir[i] = (1, f.bypass, 0, len(taps), offset)
+        blocks.append(taps)
+        offset += taps.nbytes
+
+    with open(path, 'wb') as out:
+        out.write(_HEADER.pack(MAGIC, count, _RECORD_DTYPE.itemsize, 0))
+        out.write(records.tobytes())
+        out.write(fir.tobytes())
+        for taps in blocks:
+            out.write(taps.tobytes())
+
+
+def load_binary(path: str) -> PresetArray:
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(buf) < _HEADER.size:
+        raise PresetFileError('File too small')
+    magic, count, record_size, _ = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise PresetFileError('Not a binary preset file')
+    if record_size != _RECORD_DTYPE.itemsize:
+        raise PresetFileError(f'Unsupported record size: {record_size}')
+
+    fir_start = _HEADER.size + count * record_size
+    if fir_start + count * FIR_DTYPE.itemsize > len(buf):
+        raise PresetFileError('File truncated')
+
+    records = np.frombuffer(buf, _RECORD_DTYPE, count, _HEADER.size).astype(PRESET_DTYPE)
+    table = np.frombuffer(buf, FIR_DTYPE, count, fir_start)
+    if np.any(table['offset'] + 4 * table['taps'].astype('u8') > len(buf)):
+        raise PresetFileError('FIR taps out of range')
+
+    fir = np.full(count, None, dtype=object)
+    for i in np.flatnonzero(table['present']):
+        entry = table[i]
+        fir[i] = LazyFir(buf, int(entry['offset']), int(entry['taps']), bool(entry['bypass']))
+    return PresetArray(records, fir)
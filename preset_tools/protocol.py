@@ -0,0 +1,84 @@
+# SPDX-License-Identifier: MIT
+
+# Parsing of the amplifier text protocol:
+#   +REG value    register value (GET/SUBSCRIBE)
+#   *command      command succeeded
+#   #...          command failed
+
+from collections.abc import Mapping
+from typing import Iterator, List, Tuple
+
+
+class LineBuffer:
+    # Reassembles lines split across websocket frames or TCP reads
+
+    def __init__(self) -> None:
+        self._partial = ''
+
+    def feed(self, data: str) -> List[str]:
+        if self._partial:
+            data = self._partial + data
+        if '\r' in data:
+            data = data.replace('\r', '')
+
+        lines = data.split('\n')
+        self._partial = lines.pop()
+        if '' in lines:
+            lines = [line for line in lines if line]
+        return lines
+
+    @property
+    def partial(self) -> str:
+        return self._partial
+
+
+def parse_update(line: str) -> Tuple[str, str]:
+    # '+REG value' -> ('REG', 'value')
+    space = line.find(' ', 1)
+    if space < 2:
+        raise ValueError(f'Invalid Response: {line}')
+    return (line[1:space], line[space + 1:])
+
+
+def parse_updates(lines) -> Iterator[Tuple[str, str]]:
+    for line in lines:
+        if line[0] == '+':
+            yield parse_update(line)
+
+
+def decode_value(raw: str):
+    # '"BES48"' -> 'BES48', '1' -> 1, '0.5' -> 0.5, anything else as is
+    if raw[:1] == '"' and raw[-1:] == '"' and len(raw) > 1:
+        return raw[1:-1]
+    try:
+        return int(raw)
+    except ValueError:
+        pass
+    try:
+        return float(raw)
+    except ValueError:
+        return raw
+
+
+class RegisterValues(Mapping):
+    # Read-only view on raw register values that decodes on first access
+
+    def __init__(self, raw: dict) -> None:
+        self._raw = raw
+        self._typed = {}
+
+    def __getitem__(self, reg: str):
+        try:
+            return self._typed[reg]
+        except KeyError:
+            value = self._typed[reg] = decode_value(self._raw[reg])
+            return value
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+    def raw(self, reg: str) -> str:
+        return self._raw[reg]
@@ -0,0 +1,349 @@
+# SPDX-License-Identifier: MIT
+
+# Offline frequency response of speaker presets at 48 kHz. EQ bands and
+# crossover filters are evaluated as biquads (RBJ Audio EQ Cookbook, first
+# order sections by the bilinear transform), every filter type is computed
+# for all presets using it at once.
+#
+#   freqs = frequencies()
+#   h = response(presets, freqs)      # (presets, freqs) complex
+#   db = magnitude_db(h)
+#
+# Included: EQ, crossover (with its gain), delay, polarity and FIR taps.
+# The output highpass is not part of the response, its filter type is not
+# documented.
+#
+# Assumptions where the type names leave room: LOW_SHELF/HIGH_SHELF and the
+# _12 shelves are second order with Q = 1/sqrt(2), the _Q shelves use the
+# band Q, BANDPASS has 0 dB peak gain. Bessel crossovers are normalized to
+# -3 dB at the crossover frequency.
+
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+from preset import *
+from preset_array import EQ_BANDS, PresetArray
+
+FS = 48000
+# Presets evaluated at a time
+CHUNK_SIZE = 512
+
+_EQUALIZER_TYPES = list(EqualizerType)
+_CROSSOVER_TYPES = list(CrossoverType)
+
+_BUTTERWORTH_Q = 1 / np.sqrt(2)
+
+
+def frequencies(points: int = 256, fmin: float = 20.0, fmax: float = 20000.0) -> np.ndarray:
+    # Log spaced grid in Hz
+    return np.geomspace(fmin, fmax, points)
+
+
+def magnitude_db(h: np.ndarray) -> np.ndarray:
+    return 20 * np.log10(np.maximum(np.abs(h), 1e-12))
+
+
+def phase_deg(h: np.ndarray) -> np.ndarray:
+    return np.degrees(np.angle(h))
+
+
+# --- biquad coefficients, all arrays of the same shape ---
+
+def _peaking(gain, freq, q, fs):
+    a = 10 ** (gain / 40)
+    w0 = 2 * np.pi * freq / fs
+    c = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    return (1 + alpha * a, -2 * c, 1 - alpha * a, 1 + alpha / a, -2 * c, 1 - alpha / a)
+
+
+def _lowpass2(freq, q, fs):
+    w0 = 2 * np.pi * freq / fs
+    c = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    return ((1 - c) / 2, 1 - c, (1 - c) / 2, 1 + alpha, -2 * c, 1 - alpha)
+
+
+def _highpass2(freq, q, fs):
+    w0 = 2 * np.pi * freq / fs
+    c = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    return ((1 + c) / 2, -(1 + c), (1 + c) / 2, 1 + alpha, -2 * c, 1 - alpha)
+
+
+def _bandpass(freq, q, fs):
+    w0 = 2 * np.pi * freq / fs
+    c = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    return (alpha, np.zeros_like(alpha), -alpha, 1 + alpha, -2 * c, 1 - alpha)
+
+
+def _notch(freq, q, fs):
+    w0 = 2 * np.pi * freq / fs
+    c = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    return (np.ones_like(c), -2 * c, np.ones_like(c), 1 + alpha, -2 * c, 1 - alpha)
+
+
+def _allpass2(freq, q, fs):
+    w0 = 2 * np.pi * freq / fs
+    c = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    return (1 - alpha, -2 * c, 1 + alpha, 1 + alpha, -2 * c, 1 - alpha)
+
+
+def _low_shelf2(gain, freq, q, fs):
+    a = 10 ** (gain / 40)
+    w0 = 2 * np.pi * freq / fs
+    c = np.cos(w0)
+    s = 2 * np.sqrt(a) * np.sin(w0) / (2 * q)
+    return (a * ((a + 1) - (a - 1) * c + s),
+            2 * a * ((a - 1) - (a + 1) * c),
+            a * ((a + 1) - (a - 1) * c - s),
+            (a + 1) + (a - 1) * c + s,
+            -2 * ((a - 1) + (a + 1) * c),
+            (a + 1) + (a - 1) * c - s)
+
+
+def _high_shelf2(gain, freq, q, fs):
+    a = 10 ** (gain / 40)
+    w0 = 2 * np.pi * freq / fs
+    c = np.cos(w0)
+    s = 2 * np.sqrt(a) * np.sin(w0) / (2 * q)
+    return (a * ((a + 1) + (a - 1) * c + s),
+            -2 * a * ((a - 1) + (a + 1) * c),
+            a * ((a + 1) + (a - 1) * c - s),
+            (a + 1) - (a - 1) * c + s,
+            2 * ((a - 1) - (a + 1) * c),
+            (a + 1) - (a - 1) * c - s)
+
+
+def _first_order(b0, b1, a0, a1):
+    zero = np.zeros_like(b0)
+    return (b0, b1, zero, a0, a1, zero)
+
+
+def _lowpass1(freq, fs):
+    k = np.tan(np.pi * freq / fs)
+    return _first_order(k, k, k + 1, k - 1)
+
+
+def _highpass1(freq, fs):
+    k = np.tan(np.pi * freq / fs)
+    return _first_order(np.ones_like(k), -np.ones_like(k), k + 1, k - 1)
+
+
+def _allpass1(freq, fs):
+    k = np.tan(np.pi * freq / fs)
+    return _first_order(k - 1, k + 1, k + 1, k - 1)
+
+
+def _low_shelf1(gain, freq, fs):
+    g = 10 ** (gain / 20)
+    k = np.tan(np.pi * freq / fs)
+    return _first_order(g * k + 1, g * k - 1, k + 1, k - 1)
+
+
+def _high_shelf1(gain, freq, fs):
+    g = 10 ** (gain / 20)
+    k = np.tan(np.pi * freq / fs)
+    return _first_order(g + k, k - g, k + 1, k - 1)
+
+
+_EQUALIZERS = {
+    EqualizerType.PARAMETRIC: lambda g, f, q, fs: _peaking(g, f, q, fs),
+    EqualizerType.LOW_PASS_12: lambda g, f, q, fs: _lowpass2(f, q, fs),
+    EqualizerType.HIGH_PASS_12: lambda g, f, q, fs: _highpass2(f, q, fs),
+    EqualizerType.LOW_SHELF_Q: lambda g, f, q, fs: _low_shelf2(g, f, q, fs),
+    EqualizerType.HIGH_SHELF_Q: lambda g, f, q, fs: _high_shelf2(g, f, q, fs),
+    EqualizerType.BANDPASS: lambda g, f, q, fs: _bandpass(f, q, fs),
+    EqualizerType.NOTCH: lambda g, f, q, fs: _notch(f, q, fs),
+    EqualizerType.ALLPASS_2: lambda g, f, q, fs: _allpass2(f, q, fs),
+    EqualizerType.LOW_SHELF: lambda g, f, q, fs: _low_shelf2(g, f, _BUTTERWORTH_Q, fs),
+    EqualizerType.LOW_SHELF_6: lambda g, f, q, fs: _low_shelf1(g, f, fs),
+    EqualizerType.LOW_SHELF_12: lambda g, f, q, fs: _low_shelf2(g, f, _BUTTERWORTH_Q, fs),
+    EqualizerType.HIGH_SHELF: lambda g, f, q, fs: _high_shelf2(g, f, _BUTTERWORTH_Q, fs),
+    EqualizerType.HIGH_SHELF_6: lambda g, f, q, fs: _high_shelf1(g, f, fs),
+    EqualizerType.HIGH_SHELF_12: lambda g, f, q, fs: _high_shelf2(g, f, _BUTTERWORTH_Q, fs),
+    EqualizerType.ALLPASS_1: lambda g, f, q, fs: _allpass1(f, fs),
+    EqualizerType.LOW_PASS_6: lambda g, f, q, fs: _lowpass1(f, fs),
+    EqualizerType.HIGH_PASS_6: lambda g, f, q, fs: _highpass1(f, fs),
+}
+
+
+_IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+
+class _Cascade:
+    # Numerator and denominator polynomials of a filter cascade, multiplied
+    # up per section and divided once at the end.
+
+    def __init__(self, n: int, freqs: np.ndarray, fs: float) -> None:
+        self.z1 = np.exp(-1j * 2 * np.pi * freqs / fs)
+        self.z2 = self.z1 * self.z1
+        self.num = np.ones((n, len(freqs)), dtype=complex)
+        self.den = np.ones((n, len(freqs)), dtype=complex)
+
+    def add(self, coeffs: np.ndarray) -> None:
+        # coeffs: (6, n) with b0, b1, b2, a0, a1, a2
+        b0, b1, b2, a0, a1, a2 = coeffs[:, :, None]
+        self.num *= b0 + b1 * self.z1 + b2 * self.z2
+        self.den *= a0 + a1 * self.z1 + a2 * self.z2
+
+    def response(self) -> np.ndarray:
+        return self.num / self.den
+
+
+def _identity(n: int) -> np.ndarray:
+    return np.repeat(np.array(_IDENTITY)[:, None], n, axis=1)
+
+
+# --- crossover sections ---
+
+def _butterworth(order: int):
+    # (Q, frequency scale) per second order section, Q None for first order
+    sections = [(1 / (2 * np.sin((2 * k - 1) * np.pi / (2 * order))), 1.0) for k in range(1, order // 2 + 1)]
+    if order % 2:
+        sections.append((None, 1.0))
+    return sections
+
+
+# Bessel, -3 dB at the crossover frequency
+_BESSEL = {
+    2: [(0.5773, 1.2736)],
+    4: [(0.5219, 1.4192), (0.8055, 1.5912)],
+    8: [(0.5060, 1.7837), (0.5600, 1.8376), (0.7109, 1.9591), (1.2257, 2.1953)],
+}
+
+_CROSSOVERS = {
+    CrossoverType.OFF: [],
+    CrossoverType.BUT6: _butterworth(1),
+    CrossoverType.BUT12: _butterworth(2),
+    CrossoverType.BUT18: _butterworth(3),
+    CrossoverType.BUT24: _butterworth(4),
+    CrossoverType.BUT36: _butterworth(6),
+    CrossoverType.BUT48: _butterworth(8),
+    CrossoverType.BES12: _BESSEL[2],
+    CrossoverType.BES24: _BESSEL[4],
+    CrossoverType.BES48: _BESSEL[8],
+    # Linkwitz-Riley: Butterworth of half the order, twice
+    CrossoverType.LR12: _butterworth(1) * 2,
+    CrossoverType.LR24: _butterworth(2) * 2,
+    CrossoverType.LR36: _butterworth(3) * 2,
+    CrossoverType.LR48: _butterworth(4) * 2,
+}
+
+
+_CROSSOVER_SECTIONS = max(len(sections) for sections in _CROSSOVERS.values())
+
+
+def _add_crossover(cascade: _Cascade, active: np.ndarray, types: np.ndarray, freq: np.ndarray,
+                   fs: float, highpass: bool) -> None:
+    # Filters with less sections are padded with pass-through sections
+    slots = [_identity(len(types)) for _ in range(_CROSSOVER_SECTIONS)]
+    for index in np.unique(types[active]):
+        rows = np.flatnonzero(active & (types == index))
+        f = freq[rows]
+        for slot, (q, scale) in enumerate(_CROSSOVERS[_CROSSOVER_TYPES[index]]):
+            fc = f / scale if highpass else f * scale
+            if q is None:
+                coeffs = _highpass1(fc, fs) if highpass else _lowpass1(fc, fs)
+            else:
+                coeffs = _highpass2(fc, q, fs) if highpass else _lowpass2(fc, q, fs)
+            slots[slot][:, rows] = coeffs
+    for coeffs in slots:
+        cascade.add(coeffs)
+
+
+def _add_equalizer(cascade: _Cascade, data: np.ndarray, fs: float) -> None:
+    eq = data['eq']
+    for band in range(EQ_BANDS):
+        b = eq[:, band]
+        active = ~b['bypass']
+        coeffs = _identity(len(data))
+        for index in np.unique(b['type'][active]):
+            rows = np.flatnonzero(active & (b['type'] == index))
+            coeffs[:, rows] = _EQUALIZERS[_EQUALIZER_TYPES[index]](b['gain'][rows], b['freq'][rows],
+                                                                   b['q'][rows], fs)
+        cascade.add(coeffs)
+
+
+def _add_crossovers(cascade: _Cascade, data: np.ndarray, fs: float) -> np.ndarray:
+    # Returns the crossover gain factor per preset
+    xr = data['xr']
+    active = ~xr['bypass']
+    _add_crossover(cascade, active, xr['lowpass_type'], xr['lowpass_freq'], fs, False)
+    _add_crossover(cascade, active, xr['highpass_type'], xr['highpass_freq'], fs, True)
+    return np.where(active, 10 ** (xr['gain'] / 20), 1.0)
+
+
+# --- public ---
+
+def equalizer_response(data: np.ndarray, freqs: np.ndarray, fs: float = FS) -> np.ndarray:
+    # data: PRESET_DTYPE records -> (presets, freqs)
+    cascade = _Cascade(len(data), freqs, fs)
+    _add_equalizer(cascade, data, fs)
+    return cascade.response()
+
+
+def crossover_response(data: np.ndarray, freqs: np.ndarray, fs: float = FS) -> np.ndarray:
+    cascade = _Cascade(len(data), freqs, fs)
+    gain = _add_crossovers(cascade, data, fs)
+    return gain[:, None] * cascade.response()
+
+
+def delay_response(data: np.ndarray, freqs: np.ndarray) -> np.ndarray:
+    delay = data['delay']
+    time = np.where(delay['bypass'], 0.0, delay['time'])
+    return np.exp(-1j * 2 * np.pi * time[:, None] * freqs[None, :])
+
+
+def fir_response(fir: np.ndarray, freqs: np.ndarray, fs: float = FS) -> np.ndarray:
+    # fir: Fir objects or None per preset. Shared Fir objects are evaluated
+    # once, filters with the same number of taps with one matrix product.
+    h = np.ones((len(fir), len(freqs)), dtype=complex)
+    unique = {}
+    for i, f in enumerate(fir):
+        if f is not None and not f.bypass and len(f.taps):
+            unique.setdefault(id(f), (f, []))[1].append(i)
+
+    by_length = {}
+    for f, rows in unique.values():
+        by_length.setdefault(len(f.taps), []).append((f, rows))
+
+    w = 2 * np.pi * freqs / fs
+    for length, filters in by_length.items():
+        taps = np.array([np.asarray(f.taps, dtype=float) for f, _ in filters])
+        responses = taps @ np.exp(-1j * np.outer(np.arange(length), w))
+        for (_, rows), r in zip(filters, responses):
+            h[rows] = r
+    return h
+
+
+def response(presets: Union[PresetArray, Iterable[SpeakerPreset]], freqs: Optional[np.ndarray] = None,
+             fs: float = FS, fir: bool = True) -> np.ndarray:
+    # Combined complex response, shape (presets, freqs)
+    if not isinstance(presets, PresetArray):
+        presets = PresetArray.from_presets(presets)
+    if freqs is None:
+        freqs = frequencies()
+    freqs = np.asarray(freqs, dtype=float)
+
+    h = np.empty((len(presets), len(freqs)), dtype=complex)
+    # Blocks of presets keep the intermediate arrays in cache
+    for start in range(0, len(presets), CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, len(presets))
+        data = presets.data[start:end]
+
+        cascade = _Cascade(len(data), freqs, fs)
+        _add_equalizer(cascade, data, fs)
+        gain = _add_crossovers(cascade, data, fs)
+
+        block = cascade.response()
+        block *= (gain * data['polarity'])[:, None]
+        block *= delay_response(data, freqs)
+        if fir:
+            block *= fir_response(presets.fir[start:end], freqs, fs)
+        h[start:end] = block
+    return h
@@ -0,0 +1,69 @@
+# SPDX-License-Identifier: MIT
+
+# Deploys a preset to a fleet of emulated amps and watches their register
+# updates, all in this process. While it runs, discover_devices.py and the
+# firmware tools see the simulated amps on the local network.
+
+from connection import Connection
+from fleet import deploy
+from fleet_sim import VirtualFleet
+from amp_emulator import EmulatorConfig
+from zcp import ZcpPreset
+import asyncio
+import time
+
+DEVICES = 200
+# Meter updates per second and device
+UPDATE_RATE = 10
+CONFIG = EmulatorConfig(latency=0.002, jitter=0.001, process_time=0.0001, jrpc_time=0.005)
+PRESET_FILE = 'in/preset.zcp'
+CONCURRENCY = 32
+TIMEOUT = 60.0
+# Connections subscribed to meter updates, and for how long
+MONITORS = 20
+MONITOR_TIME = 5.0
+
+
+async def monitor(host: str, duration: float) -> int:
+    c = Connection()
+    await c.async_connect(host)
+    count = 0
+
+    def changed(reg, value):
+        nonlocal count
+        count += 1
+
+    c.add_listener('OUT-*', changed)
+    await c.async_subscribe('OUT-*.METER.*')
+    await asyncio.sleep(duration)
+    await c.async_disconnect()
+    return count
+
+
+async def async_main():
+    sp = ZcpPreset.from_file(PRESET_FILE).to_speaker_preset()
+
+    print(f'Starting {DEVICES} emulated amps...')
+    start = time.monotonic()
+    async with VirtualFleet(DEVICES, CONFIG, update_rate=UPDATE_RATE) as fleet:
+        print(f'Started in {time.monotonic() - start:.1f}s, ports {fleet.hosts[0]} ... {fleet.hosts[-1]}')
+
+        print(f'Deploying to {DEVICES} amps, {CONCURRENCY} in parallel...')
+        start = time.monotonic()
+        failed = []
+        async for result in deploy({host: {1: sp} for host in fleet.hosts}, CONCURRENCY, TIMEOUT):
+            if not result.ok:
+                failed.append(result)
+                print(result)
+        elapsed = time.monotonic() - start
+        print(f'{DEVICES - len(failed)}/{DEVICES} amps deployed in {elapsed:.1f}s')
+
+        print(f'Monitoring {MONITORS} amps for {MONITOR_TIME}s...')
+        counts = await asyncio.gather(*[monitor(host, MONITOR_TIME) for host in fleet.hosts[:MONITORS]])
+        print(f'{sum(counts) / MONITOR_TIME:.0f} updates/s received, '
+              f'{sum(counts) / MONITOR_TIME / max(len(counts), 1):.1f} per amp')
+
+        print(', '.join(f'{value} {key}' for key, value in fleet.stats().items()))
+
+
+asyncio.run(async_main())
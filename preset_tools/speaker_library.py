@@ -1,13 +1,125 @@
+import asyncio
 import json
 import gzip
 import base64
+import hashlib
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from uuid import uuid1 as uid
 
 from connection import Connection
+from deadline import Deadline
+from decode_cache import DecodeCache
+from zcp import ZcpError, ZcpPreset
+
+
+class PresetBlob:
+    # Preset file that is only read and base64 encoded when the library is
+    # written, so the library never holds the preset data in memory.
+    CHUNK_SIZE = 3 * 64 * 1024  # multiple of 3: chunks encode without padding
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def to_base64(self) -> str:
+        with open(self.path, 'rb') as f:
+            return base64.b64encode(f.read()).decode('ascii')
+
+    def write_base64(self, out):
+        with open(self.path, 'rb') as f:
+            while 1:
+                chunk = f.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(base64.b64encode(chunk))
+
+
+def _json_default(obj):
+    if isinstance(obj, PresetBlob):
+        return obj.to_base64()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _write_json(out, obj):
+    # Same output as json.dumps(obj), written piece by piece
+    if isinstance(obj, dict):
+        out.write(b'{')
+        for i, (key, value) in enumerate(obj.items()):
+            if i:
+                out.write(b', ')
+            out.write(json.dumps(key).encode('utf8') + b': ')
+            _write_json(out, value)
+        out.write(b'}')
+    elif isinstance(obj, list):
+        out.write(b'[')
+        for i, value in enumerate(obj):
+            if i:
+                out.write(b', ')
+            _write_json(out, value)
+        out.write(b']')
+    elif isinstance(obj, PresetBlob):
+        out.write(b'"')
+        obj.write_base64(out)
+        out.write(b'"')
+    else:
+        out.write(json.dumps(obj).encode('utf8'))
+
+
+def _decode(buf: bytes, cache: Optional[DecodeCache], offline: bool = True):
+    # Returns (metadata or None, cache key or None)
+    key = None
+    if cache:
+        key = cache.key(buf)
+        preset_data = cache.get(key)
+        if preset_data is not None:
+            return (preset_data, key)
+
+    if not offline:
+        return (None, key)
+
+    try:
+        preset_data = ZcpPreset(buf).to_dict()
+    except (ZcpError, struct.error, UnicodeDecodeError):
+        return (None, key)
+
+    if cache:
+        cache.put(key, preset_data)
+    return (preset_data, key)
+
+
+def _read_preset(path: str, cache: Optional[DecodeCache], previous: Optional[dict], by_hash: dict,
+                 offline: bool = True):
+    # Returns (metadata or None, cache key, file info, previous entry or None).
+    # A file is unchanged when its mtime and size match the previous build,
+    # or else when its content hash does.
+    st = os.stat(path)
+    info = {'mtime': st.st_mtime, 'size': st.st_size}
+
+    if previous and previous['mtime'] == st.st_mtime and previous['size'] == st.st_size:
+        info['sha256'] = previous['sha256']
+        return (None, None, info, previous['entry'])
+
+    with open(path, 'rb') as f:
+        buf = f.read()
+    info['sha256'] = hashlib.sha256(buf).hexdigest()
+
+    entry = previous['entry'] if previous and previous['sha256'] == info['sha256'] else by_hash.get(info['sha256'])
+    if entry:
+        return (None, None, info, entry)
+
+    preset_data, key = _decode(buf, cache, offline)
+    return (preset_data, key, info, None)
+
 
 class SpeakerLibrary:
-    def __init__(self, c: Connection, name: str, version: str, vendor_id: int = 0):
+    # `c` is only used to decode presets the offline reader cannot handle,
+    # `cache` keeps decoded metadata across builds.
+    def __init__(self, c: Optional[Connection], name: str, version: str, vendor_id: int = 0,
+                 cache: Optional[DecodeCache] = None):
         self._c = c
+        self._cache = cache
         
         self._d = {}
         
@@ -16,52 +128,175 @@ class SpeakerLibrary:
         self._d['version'] = version
         self._d['vendorId'] = vendor_id
         self._d['children'] = []
+        self._folders = {}
+
+        # Incremental builds: ids and file state of the previous build
+        self._folder_ids = {}
+        self._previous = {}
+        self._previous_by_hash = {}
+        self._files = {}
+        self._entry_ids = set()
+        self.changes = {'unchanged': 0, 'changed': 0, 'added': 0, 'removed': 0}
+
+    def load_previous(self, libfile: str):
+        # Reuse the library/folder/preset ids and the decoded metadata of a
+        # previous build. The manifest written next to it maps files to
+        # entries; without one, entries are matched by content.
+        manifest = f'{libfile}.manifest'
+        if os.path.exists(manifest):
+            with open(manifest, 'r') as f:
+                m = json.load(f)
+            self._d['id'] = m['id']
+            self._folder_ids = m['folders']
+            self._previous = m['files']
+            return
+
+        with gzip.open(libfile, 'rb') as f:
+            d = json.load(f)
+        self._d['id'] = d['id']
+        for folder in d['children']:
+            self._folder_ids[folder['name']] = folder['id']
+            for entry in folder['children']:
+                sha = hashlib.sha256(base64.b64decode(entry.pop('preset'))).hexdigest()
+                entry['folder'] = folder['name']
+                self._previous_by_hash[sha] = entry
 
     def _get_preset_folder(self, name: str) -> list:
-        folder = next((x for x in self._d['children'] if x['name'] == name), None)
+        folder = self._folders.get(name)
 
         if not folder:
             d = {}
             d['name'] = name
-            d['id'] = str(uid())
+            d['id'] = self._folder_ids.get(name) or str(uid())
             d['children'] = []
             #d['parent_id'] = None
 
             self._d['children'].append(d)
+            self._folders[name] = d
 
             folder = d
 
         return folder
 
-    async def add_preset(self, folder: str, name: str, path: str):
+    def _add_entry(self, folder: str, preset_data: dict, path: str, entry_id: Optional[str] = None):
         d = {}
 
-        with open(path, 'rb') as f:
-            buf = f.read()
-
-        preset_data = await self._c.decode_preset(path)
-
-        d['id'] = str(uid())
+        d['id'] = entry_id or str(uid())
         d['name'] = preset_data['name']
         d['presetId'] = preset_data['id']
         d['vendorId'] = preset_data['vendorId']
-        d['preset'] = base64.b64encode(buf).decode('ascii')
+        d['preset'] = PresetBlob(path)
 
         vendor_id = preset_data['vendorId']
 
         if vendor_id != 0:
             if self._d['vendorId'] != 0 and vendor_id != self._d['vendorId']:
-                raise 'Invalid Vendor ID'
+                raise Exception('Invalid Vendor ID')
             else:
                 self._d['vendorId'] = vendor_id
 
         preset_dict = self._get_preset_folder(folder)
         preset_dict['children'].append(d)
+        return d
+
+    async def add_preset(self, folder: str, name: str, path: str):
+        await self.add_presets([(folder, name, path)], workers=1)
+
+    async def add_presets(self, presets, workers: int = 8, connections: Optional[List[Connection]] = None,
+                          concurrency: int = 4, deadline: Optional[float] = None, offline: bool = True):
+        # presets: (folder, name, path) tuples, added in the given order.
+        # Files are read and decoded in a pool of `workers` threads. Files the
+        # offline reader rejects are decoded by the amps in `connections`
+        # (default: the library's connection), `concurrency` requests per amp.
+        # After load_previous() only new and changed files are decoded.
+        # `deadline` bounds the amp decoding, counted from this call.
+        # offline=False decodes every new or changed file on the amps.
+        limit = Deadline(deadline)
+        presets = list(presets)
+        loop = asyncio.get_event_loop()
+
+        def previous_entry(folder, path):
+            entry = self._previous.get(path)
+            return entry if entry and entry['folder'] == folder else None
+
+        def same_folder(folder):
+            return {sha: e for sha, e in self._previous_by_hash.items() if e['folder'] == folder}
+
+        by_folder = {}
+        with ThreadPoolExecutor(workers) as pool:
+            jobs = []
+            for folder, _, path in presets:
+                if folder not in by_folder:
+                    by_folder[folder] = same_folder(folder)
+                jobs.append(loop.run_in_executor(pool, _read_preset, path, self._cache,
+                                                 previous_entry(folder, path), by_folder[folder], offline))
+            results = await asyncio.gather(*jobs)
+
+        decoded = [preset_data for preset_data, _, _, _ in results]
+        missing = [i for i, r in enumerate(results) if r[0] is None and r[3] is None]
+        if missing:
+            connections = connections or ([self._c] if self._c else [])
+            if not connections:
+                raise ZcpError(f'Cannot decode {presets[missing[0]][2]}')
+
+            queue = asyncio.Queue()
+            for i in missing:
+                queue.put_nowait(i)
+
+            async def worker(c: Connection):
+                while not queue.empty():
+                    i = queue.get_nowait()
+                    decoded[i] = await c.decode_preset(presets[i][2])
+                    key = results[i][1]
+                    if key:
+                        self._cache.put(key, decoded[i])
+
+            with limit:
+                await asyncio.gather(*[worker(c) for c in connections for _ in range(concurrency)])
+
+        for (folder, name, path), preset_data, (_, _, info, entry) in zip(presets, decoded, results):
+            previous = previous_entry(folder, path)
+            if entry:
+                self.changes['unchanged'] += 1
+                preset_data = {'name': entry['name'], 'id': entry['presetId'], 'vendorId': entry['vendorId']}
+            else:
+                self.changes['changed' if previous else 'added'] += 1
+                entry = previous['entry'] if previous else None
+
+            # Identical files matched by content share one previous entry
+            entry_id = entry['id'] if entry and entry['id'] not in self._entry_ids else None
+            d = self._add_entry(folder, preset_data, path, entry_id)
+            self._entry_ids.add(d['id'])
+            self._files[path] = dict(info, folder=folder, entry={k: d[k] for k in ('id', 'name', 'presetId', 'vendorId')})
+
+        if self._previous:
+            self.changes['removed'] = len(set(self._previous) - set(self._files))
+        elif self._previous_by_hash:
+            previous_ids = set(e['id'] for e in self._previous_by_hash.values())
+            self.changes['removed'] = len(previous_ids - self._entry_ids)
 
     def to_json(self):
-        return json.dumps(self._d)
+        return json.dumps(self._d, default=_json_default)
 
     def to_preset_file(self):
         j = self.to_json().encode('utf8')
 
         return gzip.compress(j)
+
+    def write_preset_file(self, outfile: str, manifest: bool = False):
+        # Streams the library through gzip into `outfile`, memory use does
+        # not grow with the number or size of the presets. The output only
+        # changes when the library does (no gzip timestamp). `manifest`
+        # writes the file state load_previous() needs for the next build.
+        with open(outfile, 'wb') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as gz:
+                _write_json(gz, self._d)
+
+        if manifest:
+            m = {
+                'id': self._d['id'],
+                'folders': {folder['name']: folder['id'] for folder in self._d['children']},
+                'files': self._files,
+            }
+            with open(f'{outfile}.manifest', 'w') as f:
+                json.dump(m, f, indent=1)
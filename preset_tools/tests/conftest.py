@@ -0,0 +1,7 @@
+# SPDX-License-Identifier: MIT
+
+# The tools are flat modules run from preset_tools/, make them importable
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
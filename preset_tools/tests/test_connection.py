@@ -0,0 +1,268 @@
+# SPDX-License-Identifier: MIT
+
+# Connection against the local amplifier stand-in: results reach the
+# command they answer, also when the amp drops answers or fails commands and
+# when several tasks share the connection.
+
+import asyncio
+import time
+
+import pytest
+
+from amp_emulator import EmulatedAmp, EmulatorConfig
+from connection import RETRY_BACKOFF, Connection, WriteError
+from metrics import Metrics
+from preset import Fir, SpeakerPreset
+from transport import TCP_PORT
+
+
+def run(test, config=None):
+    async def main():
+        async with EmulatedAmp(config) as amp:
+            c = Connection()
+            await c.async_connect(amp.host)
+            try:
+                await test(amp, c)
+            finally:
+                await c.async_disconnect()
+    asyncio.run(main())
+
+
+async def dropped_set(amp, c, reg='OUT-1.POLARITY'):
+    # A SET the amp executes but never answers, still waiting for its result
+    amp.config.drop_rate = 1
+    task = asyncio.ensure_future(c.async_set_reg(reg, 1, timeout=10.0))
+    while not amp.stats['dropped']:
+        await asyncio.sleep(0.001)
+    amp.config.drop_rate = 0
+    return task
+
+
+def test_get_after_dropped_command():
+    async def test(amp, c):
+        task = await dropped_set(amp, c)
+        amp.registers['OUT-1.XR.LOWPASS_TYPE'] = '"BES48"'
+        assert await c.async_get_reg('OUT-1.XR.LOWPASS_TYPE') == '"BES48"'
+
+        # The GET answer shows the SET got none, it fails without its timeout
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            await task
+        assert time.monotonic() - start < 1.0
+    run(test)
+
+
+def test_error_after_dropped_command():
+    async def test(amp, c):
+        task = await dropped_set(amp, c)
+        with pytest.raises(Exception, match='#Unknown register OUT-1.NOPE'):
+            await c.async_set_reg('OUT-1.NOPE', 1, timeout=5.0)
+        with pytest.raises(TimeoutError):
+            await task
+    run(test)
+
+
+def test_late_result_of_timed_out_command():
+    async def test(amp, c):
+        amp.registers['OUT-1.POLARITY'] = '1'
+        amp.registers['OUT-2.POLARITY'] = '-1'
+        with pytest.raises(TimeoutError):
+            await c.async_get_reg('OUT-1.POLARITY', timeout=0.01)
+        assert await c.async_get_reg('OUT-2.POLARITY') == '-1'
+        assert not c._pending
+    run(test, EmulatorConfig(latency=0.05))
+
+
+def test_set_regs_failures():
+    async def test(amp, c):
+        regs = [('OUT-1.POLARITY', '-1'), ('OUT-1.NOPE', '1'), ('OUT-1.OUTPUT_HIGHPASS', '50.0')]
+        failures = await c.async_set_regs(regs)
+        assert failures == [('OUT-1.NOPE', '1', '#Unknown register OUT-1.NOPE')]
+        assert amp.registers['OUT-1.POLARITY'] == '-1'
+        assert amp.registers['OUT-1.OUTPUT_HIGHPASS'] == '50.0'
+    run(test)
+
+
+def test_set_regs_with_dropped_answers():
+    async def test(amp, c):
+        regs = [(f'OUT-1.SPEAKER_EQ-{i}.GAIN', '1.0') for i in range(1, 16)]
+        failures = await c.async_set_regs(regs, timeout=5.0)
+        dropped = amp.stats['dropped']
+        assert dropped
+        # Only the last answer can go missing unnoticed until the timeout
+        assert dropped - 1 <= len(failures) <= dropped
+        assert all(line is None for _, _, line in failures)
+        # Dropped commands are still executed
+        assert all(amp.registers[reg] == '1.0' for reg, _ in regs)
+    run(test, EmulatorConfig(drop_rate=0.2, seed=3))
+
+
+def test_concurrent_commands():
+    async def test(amp, c):
+        sp = SpeakerPreset()
+        sp.polarity = -1
+        await c.async_subscribe('OUT-4.*')
+        updates = []
+        c.add_listener('OUT-4.METER.*', lambda reg, value: updates.append(reg))
+
+        async def push():
+            for i in range(50):
+                amp.set_register('OUT-4.METER.LEVEL', str(-i))
+                await asyncio.sleep(0.001)
+
+        async def get(n):
+            for _ in range(n):
+                assert len(await c.async_get_regs('OUT-2.*')) == len(dict(amp._channel_regs(2, sp)))
+
+        await asyncio.gather(c.set_preset(1, sp), c.set_preset(2, sp), get(10), get(10), push(),
+                             *[c.async_set_reg(f'OUT-3.SPEAKER_EQ-{i}.GAIN', i) for i in range(1, 16)])
+
+        assert amp.registers['OUT-1.POLARITY'] == '-1'
+        assert amp.registers['OUT-2.POLARITY'] == '-1'
+        assert all(amp.registers[f'OUT-3.SPEAKER_EQ-{i}.GAIN'] == str(i) for i in range(1, 16))
+        # Answered after the last update
+        await c.async_set_reg('OUT-4.OUTPUT_HIGHPASS', 50)
+        assert len(updates) == 50
+        assert not c._pending
+    run(test, EmulatorConfig(latency=0.002, jitter=0.002))
+
+
+def test_disconnect_fails_open_commands():
+    async def test(amp, c):
+        task = asyncio.ensure_future(c.async_get_reg('OUT-1.POLARITY'))
+        await asyncio.sleep(0.01)
+        await c.async_disconnect()
+        with pytest.raises(ConnectionError):
+            await task
+    run(test, EmulatorConfig(latency=0.5))
+
+
+def test_set_fir_after_reconnect_to_other_amp():
+    async def main():
+        fir = Fir()
+        fir.taps = [0.5, 0.25, 0.125]
+        async with EmulatedAmp() as amp1, EmulatedAmp() as amp2:
+            c = Connection()
+            for amp in (amp1, amp2):
+                await c.async_connect(amp.host)
+                await c.set_fir(1, fir)
+                await c.async_disconnect()
+                assert amp.fir[1] == fir.taps
+    asyncio.run(main())
+
+
+def test_set_fir_uploads_unless_skip_unchanged():
+    async def test(amp, c):
+        fir = Fir()
+        fir.taps = [0.5, 0.25]
+        await c.set_fir(1, fir)
+        amp.fir.pop(1)
+        await c.set_fir(1, fir, skip_unchanged=True)
+        assert 1 not in amp.fir
+        await c.set_fir(1, fir)
+        assert amp.fir[1] == fir.taps
+    run(test)
+
+
+def test_changes_end_with_full_queue():
+    async def test(amp, c):
+        await c.async_subscribe('OUT-1.*')
+
+        async def consume():
+            changes = []
+            async for change in c.changes('OUT-1.*', maxsize=1):
+                changes.append(change)
+                await asyncio.sleep(1.0)
+            return changes
+
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        for value in ('-1', '1', '-1'):
+            amp.set_register('OUT-1.POLARITY', value)
+        await c.async_set_reg('OUT-1.OUTPUT_HIGHPASS', 50)
+        await c.async_disconnect()
+        assert len(await asyncio.wait_for(task, 2.0)) == 1
+    run(test)
+
+
+def test_set_values_rejected_without_retry():
+    async def test(amp, c):
+        commands = amp.stats['commands']
+        start = time.monotonic()
+        with pytest.raises(WriteError) as e:
+            await c.set_values([('OUT-1.POLARITY', '-1'), ('OUT-1.NOPE', '1')])
+        assert time.monotonic() - start < RETRY_BACKOFF
+        assert amp.stats['commands'] - commands == 2
+        assert e.value.failures == [('OUT-1.NOPE', '1', '#Unknown register OUT-1.NOPE')]
+    run(test)
+
+
+def test_set_values_retries_unanswered():
+    async def test(amp, c):
+        regs = [(f'OUT-1.SPEAKER_EQ-{i}.GAIN', '2.0') for i in range(1, 16)]
+        amp.config.drop_rate = 0.3
+        await c.set_values(regs, timeout=0.5, retries=5)
+        assert amp.stats['dropped']
+    run(test, EmulatorConfig(seed=1))
+
+
+def test_set_preset_delta_matches_set_preset():
+    async def test(amp, c):
+        sp = SpeakerPreset()
+        await c.set_preset(1, sp)
+        full = dict(amp.registers)
+
+        await c.async_set_reg('OUT-1.SPEAKER_DELAY.TIME', 0.005)
+        assert await c.set_preset_delta(1, sp) == ['OUT-1.SPEAKER_DELAY.TIME']
+        assert amp.registers == full
+        assert await c.set_preset_delta(1, sp) == []
+    run(test)
+
+
+def test_get_subscribed_register_during_updates():
+    async def test(amp, c):
+        amp.registers['OUT-1.POLARITY'] = '1'
+        await c.async_subscribe('OUT-1.*')
+
+        async def push():
+            for value in ('-1', '1', '-1', '1'):
+                amp.set_register('OUT-1.POLARITY', value)
+                await asyncio.sleep(0.02)
+
+        for _ in range(3):
+            value, _ = await asyncio.gather(c.async_get_reg('OUT-1.POLARITY'), push())
+            assert value in ('-1', '1')
+        assert c.registers['OUT-1.POLARITY'] == amp.registers['OUT-1.POLARITY']
+    run(test, EmulatorConfig(process_time=0.05))
+
+
+def test_tcp_with_http_port_in_host():
+    async def main():
+        amp = EmulatedAmp()
+        await amp.start(tcp_port=TCP_PORT)
+        try:
+            # amp.host carries the HTTP port, TCP uses TCP_PORT
+            c = Connection(transport='tcp')
+            await c.async_connect(amp.host)
+            await c.set_preset(1, SpeakerPreset())
+            await c.async_disconnect()
+        finally:
+            await amp.stop()
+    asyncio.run(main())
+
+
+def test_traffic_counts_bytes():
+    async def main():
+        async with EmulatedAmp() as amp:
+            c = Connection(metrics=Metrics())
+            await c.async_connect(amp.host)
+            try:
+                before = list(c.metrics.traffic.get(c._host, [0, 0]))
+                with pytest.raises(Exception):
+                    await c.async_get_reg('OUT-1.PEGEL°')
+                sent, received = c.metrics.traffic[c._host]
+                assert sent - before[0] == len('GET OUT-1.PEGEL°\n'.encode())
+                assert received - before[1] == len('#Unknown register OUT-1.PEGEL°\n'.encode())
+            finally:
+                await c.async_disconnect()
+    asyncio.run(main())
@@ -0,0 +1,35 @@
+# SPDX-License-Identifier: MIT
+
+# Fleet deployment against simulated amps
+
+import asyncio
+
+from fleet import deploy
+from fleet_sim import VirtualFleet
+from preset import SpeakerPreset
+
+
+def test_deploy_over_tcp():
+    async def main():
+        sp = SpeakerPreset()
+        sp.polarity = -1
+        async with VirtualFleet(3, advertise=False) as fleet:
+            results = [result async for result in deploy({host: {1: sp} for host in fleet.hosts},
+                                                         transport=fleet.tcp_transport)]
+            assert all(result.ok for result in results)
+            assert all(device.amp.registers['OUT-1.POLARITY'] == '-1' for device in fleet.devices)
+    asyncio.run(main())
+
+
+def test_deploy_stopped_early():
+    async def main():
+        async with VirtualFleet(20, advertise=False) as fleet:
+            deployment = deploy({host: {1: SpeakerPreset()} for host in fleet.hosts}, concurrency=8)
+            async for result in deployment:
+                break
+            await deployment.aclose()
+            # The cancelled deploys are finished, not left behind
+            running = [task for task in asyncio.all_tasks()
+                       if 'deploy.<locals>.run' in task.get_coro().__qualname__]
+            assert not running
+    asyncio.run(main())
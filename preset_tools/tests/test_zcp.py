@@ -0,0 +1,36 @@
+# SPDX-License-Identifier: MIT
+
+# Offline .zcp codec against the presets exported by the amplifier
+
+import pytest
+
+from zcp import ZcpPreset
+from zcp_writer import encode_preset
+
+# Name, id and vendor id of every preset, for lib/ as listed in the library the
+# amplifier built from it (out/speaker_lib_R1.zcl)
+PRESETS = {
+    'in/preset.zcp': {'name': 'preset', 'id': '9cface41-93ec-4d32-98bd-a0e73a4285f7', 'vendorId': 0},
+    'out/preset.zcp': {'name': 'preset', 'id': '14eb6ca0-1da0-41c5-a420-8f875b341dcf', 'vendorId': 1},
+    'lib/Folder_A/preset1.zcp': {'name': 'preset1', 'id': '17d92dce-2709-49f5-939f-ab756e7088e5', 'vendorId': 0},
+    'lib/Folder_A/preset2.zcp': {'name': 'preset2', 'id': '27821b6e-05e2-4705-8e6f-307ed7f3528d', 'vendorId': 0},
+    'lib/Folder_B/preset10.zcp': {'name': 'preset10', 'id': 'a08f82d0-7a7e-4903-8117-c5a8cf89c588', 'vendorId': 0},
+    'lib/Folder_B/preset20.zcp': {'name': 'preset20', 'id': '8204440e-4633-48fe-a3ed-f444a9999408', 'vendorId': 0},
+}
+
+
+@pytest.mark.parametrize('path', sorted(PRESETS))
+def test_to_dict(path):
+    assert ZcpPreset.from_file(path).to_dict() == PRESETS[path]
+
+
+# Unprotected presets, the writer reproduces them
+UNPROTECTED = [path for path, d in sorted(PRESETS.items()) if d['vendorId'] == 0]
+
+
+@pytest.mark.parametrize('path', UNPROTECTED)
+def test_encode_reproduces_preset(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    z = ZcpPreset(data)
+    assert encode_preset(z.to_speaker_preset(), z.name, z.id) == data
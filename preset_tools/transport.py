@@ -0,0 +1,114 @@
+# SPDX-License-Identifier: MIT
+
+# Byte pipes for the amplifier text protocol. A transport only moves text,
+# splitting it into lines is left to protocol.LineBuffer since neither
+# websocket messages nor TCP reads are guaranteed to end on a line.
+
+import asyncio
+import codecs
+from typing import Optional
+
+import websockets
+
+TCP_PORT = 7621
+READ_SIZE = 64 * 1024
+
+
+class Transport:
+    async def connect(self, host: str) -> None:
+        raise NotImplementedError
+
+    async def send(self, data: str) -> None:
+        raise NotImplementedError
+
+    async def recv(self) -> str:
+        # Raises ConnectionError once the peer closed the connection
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        raise NotImplementedError
+
+
+class WebsocketTransport(Transport):
+    def __init__(self) -> None:
+        self._websocket = None
+
+    async def connect(self, host: str) -> None:
+        self._websocket = await websockets.connect(f'ws://{host}/ws')
+
+    async def send(self, data: str) -> None:
+        await self._websocket.send(data)
+
+    async def recv(self) -> str:
+        data = await self._websocket.recv()
+        return data if isinstance(data, str) else str(data, 'utf8')
+
+    async def close(self) -> None:
+        if self._websocket:
+            await self._websocket.close()
+            self._websocket = None
+
+
+class TcpTransport(Transport):
+    # Plain TCP, without websocket framing and masking, on TCP_PORT unless
+    # `port` is given. A port in the host ('192.168.64.100:8080') is the HTTP
+    # port Connection uses for JSON-RPC, so it is ignored here.
+
+    def __init__(self, port: Optional[int] = None) -> None:
+        self._port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._decoder = None
+
+    async def connect(self, host: str) -> None:
+        port = self._port or TCP_PORT
+        host = _strip_port(host)
+
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        # A TCP read may end inside a multi-byte character
+        self._decoder = codecs.getincrementaldecoder('utf8')()
+
+    async def send(self, data: str) -> None:
+        self._writer.write(data.encode())
+        await self._writer.drain()
+
+    async def recv(self) -> str:
+        data = await self._reader.read(READ_SIZE)
+        if not data:
+            raise ConnectionError('Connection closed by peer')
+        return self._decoder.decode(data)
+
+    async def close(self) -> None:
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+            self._writer = None
+            self._reader = None
+
+
+def _strip_port(host: str) -> str:
+    # '192.168.64.100:80' -> '192.168.64.100', '[fe80::1]:80' -> 'fe80::1'
+    if host.startswith('['):
+        return host[1:host.index(']')]
+    if host.count(':') == 1:
+        return host.split(':')[0]
+    return host
+
+
+TRANSPORTS = {
+    'websocket': WebsocketTransport,
+    'tcp': TcpTransport,
+}
+
+
+def make_transport(transport) -> Transport:
+    # Accepts a Transport instance or one of the TRANSPORTS names
+    if isinstance(transport, Transport):
+        return transport
+    try:
+        return TRANSPORTS[transport]()
+    except KeyError:
+        raise ValueError(f'Unknown transport: {transport}') from None
@@ -0,0 +1,168 @@
+# SPDX-License-Identifier: MIT
+
+# Checks many presets at once against the ranges of preset.py. Every rule
+# is one array comparison over all presets, and the report lists every
+# violation instead of stopping at the first one.
+#
+#   report = validate(presets, channels)
+#   if not report:
+#       print(report)
+
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+
+from preset import *
+from preset_array import PresetArray
+
+_OUTPUT_MODE_COUNT = len(OutputMode)
+_EQUALIZER_TYPE_COUNT = len(EqualizerType)
+_CROSSOVER_TYPE_COUNT = len(CrossoverType)
+_CLIP_LIMITER_MODE_COUNT = len(ClipLimiterMode)
+
+# (field, column path, range). Enum columns hold zero based indexes.
+_RANGE_RULES = [
+    ('output_highpass', ('output_highpass',), FREQ_RANGE),
+    ('eq.gain', ('eq', 'gain'), GAIN_RANGE),
+    ('eq.freq', ('eq', 'freq'), FREQ_RANGE),
+    ('eq.q', ('eq', 'q'), Q_RANGE),
+    ('crossover.gain', ('xr', 'gain'), GAIN_RANGE),
+    ('crossover.lowpass_freq', ('xr', 'lowpass_freq'), FREQ_RANGE),
+    ('crossover.highpass_freq', ('xr', 'highpass_freq'), FREQ_RANGE),
+    ('delay.time', ('delay', 'time'), DELAY_RANGE),
+]
+
+_ENUM_RULES = [
+    ('output_mode', ('output_mode',), _OUTPUT_MODE_COUNT),
+    ('eq.type', ('eq', 'type'), _EQUALIZER_TYPE_COUNT),
+    ('crossover.lowpass_type', ('xr', 'lowpass_type'), _CROSSOVER_TYPE_COUNT),
+    ('crossover.highpass_type', ('xr', 'highpass_type'), _CROSSOVER_TYPE_COUNT),
+    ('clip_limiter.mode', ('clip_limiter', 'mode'), _CLIP_LIMITER_MODE_COUNT),
+]
+
+# Limiters are written ATTACK 0, RELEASE, ATTACK, so release >= attack
+_ORDER_RULES = [
+    ('peak_limiter.release', 'peak_limiter'),
+    ('rms_limiter.release', 'rms_limiter'),
+]
+
+
+class Violation(NamedTuple):
+    preset: int
+    channel: Optional[int]
+    field: str
+    band: Optional[int]
+    value: float
+    rule: str
+
+    def __str__(self) -> str:
+        where = f'preset {self.preset}' if self.channel is None else f'preset {self.preset} (channel {self.channel})'
+        field = self.field if self.band is None else self.field.replace('eq.', f'eq[{self.band}].')
+        return f'{where}: {field} = {self.value} {self.rule}'
+
+
+class ValidationReport:
+    def __init__(self, count: int, violations: List[Violation]) -> None:
+        self.count = count
+        self.violations = sorted(violations, key=lambda v: (v.preset, v.field, -1 if v.band is None else v.band))
+
+    @property
+    def ok(self) -> bool:
+        return not self.violations
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+    def __len__(self) -> int:
+        return len(self.violations)
+
+    @property
+    def invalid_presets(self) -> List[int]:
+        return sorted(set(v.preset for v in self.violations))
+
+    def for_preset(self, index: int) -> List[Violation]:
+        return [v for v in self.violations if v.preset == index]
+
+    def to_dict(self) -> dict:
+        return {
+            'presets': self.count,
+            'invalid': len(self.invalid_presets),
+            'violations': [v._asdict() for v in self.violations],
+        }
+
+    def raise_for_violations(self) -> None:
+        if self.violations:
+            raise ValidationError(self)
+
+    def __str__(self) -> str:
+        lines = [f'{len(self.invalid_presets)}/{self.count} preset(s) invalid, {len(self.violations)} violation(s)']
+        lines += [f'  {v}' for v in self.violations]
+        return '\n'.join(lines)
+
+
+class ValidationError(ValueError):
+    def __init__(self, report: ValidationReport) -> None:
+        self.report = report
+        first = '; '.join(str(v) for v in report.violations[:3])
+        more = f' (+{len(report) - 3} more)' if len(report) > 3 else ''
+        super().__init__(f'Invalid preset: {first}{more}')
+
+
+def _column(data: np.ndarray, path: Sequence[str]) -> np.ndarray:
+    for name in path:
+        data = data[name]
+    return data
+
+
+def validate(presets: Union[PresetArray, Iterable[SpeakerPreset]],
+             channels: Optional[Sequence[int]] = None) -> ValidationReport:
+    # channels: optional channel number per preset, only used in the report
+    if not isinstance(presets, PresetArray):
+        presets = PresetArray.from_presets(presets)
+    data = presets.data
+    if channels is not None and len(channels) != len(data):
+        raise ValueError('Length of channels does not match the presets')
+
+    violations = []
+
+    def add(field, mask, values, rule):
+        # mask and values are (N,) or (N, EQ_BANDS)
+        for index in zip(*np.nonzero(mask)):
+            preset = int(index[0])
+            band = int(index[1]) + 1 if len(index) > 1 else None
+            channel = None if channels is None else channels[preset]
+            value = values[index].item()
+            violations.append(Violation(preset, channel, field, band, value, rule))
+
+    for field, path, limits in _RANGE_RULES:
+        values = _column(data, path)
+        mask = ~((values >= limits.low) & (values <= limits.high))
+        if field == 'output_highpass':
+            # NaN is None, i.e. no output highpass
+            mask &= ~np.isnan(values)
+        if mask.any():
+            add(field, mask, values, f'not in [{limits.low}, {limits.high}]')
+
+    for field, path, count in _ENUM_RULES:
+        values = _column(data, path)
+        mask = values >= count
+        if mask.any():
+            add(field, mask, values, f'not a valid index (< {count})')
+
+    polarity = data['polarity']
+    mask = ~np.isin(polarity, POLARITIES)
+    if mask.any():
+        add('polarity', mask, polarity, 'not -1 or 1')
+
+    for field, name in _ORDER_RULES:
+        lim = data[name]
+        mask = lim['release'] < lim['attack']
+        if mask.any():
+            add(field, mask, lim['release'], 'less than attack')
+
+    return ValidationReport(len(data), violations)
+
+
+def validate_preset(sp: SpeakerPreset, ch: Optional[int] = None) -> None:
+    # Raises ValidationError with every violation of a single preset
+    validate([sp], None if ch is None else [ch]).raise_for_violations()
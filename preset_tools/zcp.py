@@ -0,0 +1,359 @@
+# SPDX-License-Identifier: MIT
+
+# Offline reader for .zcp speaker presets.
+#
+# A .zcp file is a FlatBuffers buffer. The layout below was taken from
+# presets generated by the amplifier (see in/ and lib/):
+#
+#   Preset (root table)
+#     0  version            uint32
+#     1  id                 string
+#     2  vendor_id          uint32
+#     3  name               string
+#     4  output             Output       { 0 mode: ubyte, 1 highpass: float }
+#     5  output_protected   bool
+#     6  polarity           Polarity     { 0 polarity: int32 }
+#     7  polarity_protected bool
+#     8  delay              Delay        { 0 time: float, 1 bypass: bool }
+#     9  delay_protected    bool
+#     10 equalizer          EqualizerSet { 0 bands: [Equalizer] }
+#     11 eq_protected       bool
+#     12 crossover          Crossover
+#     13 xr_protected       bool
+#     14 peak_limiter       PeakLimiter
+#     15 rms_limiter        RmsLimiter
+#     16 clip_limiter       ClipLimiter  { 0 bypass: bool, 1 mode: ubyte }
+#     17 limiter_protected  bool
+#     18 fir                Fir          { 0 taps: [float], 1 bypass: bool }
+#     19 fir_protected      bool
+#
+#   Equalizer   { 0 type: ubyte, 1 gain, 2 freq, 3 q, 4 bypass: bool }
+#   Crossover   { 0 gain, 1 lowpass_type: ubyte, 2 lowpass_freq,
+#                 3 highpass_type: ubyte, 4 highpass_freq, 5 bypass: bool }
+#   PeakLimiter { 0 bypass: bool, 1 threshold, 2 attack, 3 release, 4 hold,
+#                 5 auto: bool, 6 knee }
+#   RmsLimiter  { 0 threshold, 1 attack, 2 release, 3 hold, 4 knee,
+#                 5 bypass: bool }
+#
+# Enums are stored zero based in the order of preset.py, the output mode
+# one based (0 is unused).
+
+import struct
+import sys
+from typing import List, Optional
+
+from preset import *
+
+
+PARAM_EQUALIZER = 'equalizer'
+PARAM_CROSSOVER = 'crossover'
+PARAM_DELAY = 'delay'
+PARAM_LIMITER = 'limiter'
+PARAM_OUTPUT_MODE = 'output_mode'
+PARAM_FIR = 'fir'
+PARAM_POLARITY = 'polarity'
+
+# Root table slot of the "protected" flag of every parameter block
+_PROTECTED_FIELDS = {
+    PARAM_OUTPUT_MODE: 5,
+    PARAM_POLARITY: 7,
+    PARAM_DELAY: 9,
+    PARAM_EQUALIZER: 11,
+    PARAM_CROSSOVER: 13,
+    PARAM_LIMITER: 17,
+    PARAM_FIR: 19,
+}
+
+_OUTPUT_MODES = [None] + list(OutputMode)
+_EQUALIZER_TYPES = list(EqualizerType)
+_CROSSOVER_TYPES = list(CrossoverType)
+_CLIP_LIMITER_MODES = list(ClipLimiterMode)
+
+_u8 = struct.Struct('<B')
+_u16 = struct.Struct('<H')
+_i32 = struct.Struct('<i')
+_u32 = struct.Struct('<I')
+_f32 = struct.Struct('<f')
+
+
+class ZcpError(Exception):
+    pass
+
+
+class _Table:
+    __slots__ = ('_buf', '_pos', '_vt', '_vsize')
+
+    def __init__(self, buf: memoryview, pos: int) -> None:
+        if pos < 0 or pos + 4 > len(buf):
+            raise ZcpError(f'Table offset out of range: {pos}')
+
+        self._buf = buf
+        self._pos = pos
+        self._vt = pos - _i32.unpack_from(buf, pos)[0]
+        if self._vt < 0 or self._vt + 4 > len(buf):
+            raise ZcpError(f'VTable offset out of range: {self._vt}')
+        self._vsize = _u16.unpack_from(buf, self._vt)[0]
+        if self._vsize < 4 or self._vsize % 2 or self._vt + self._vsize > len(buf):
+            raise ZcpError(f'Invalid VTable size: {self._vsize}')
+
+    def _field(self, index: int) -> int:
+        slot = 4 + 2 * index
+        if slot >= self._vsize:
+            return 0
+        offset = _u16.unpack_from(self._buf, self._vt + slot)[0]
+        return self._pos + offset if offset else 0
+
+    def _indirect(self, pos: int) -> int:
+        return pos + _u32.unpack_from(self._buf, pos)[0]
+
+    def has(self, index: int) -> bool:
+        return self._field(index) != 0
+
+    def scalar(self, index: int, fmt: struct.Struct, default=0):
+        pos = self._field(index)
+        return fmt.unpack_from(self._buf, pos)[0] if pos else default
+
+    def bool(self, index: int, default: bool = False) -> bool:
+        return bool(self.scalar(index, _u8, default))
+
+    def string(self, index: int) -> Optional[str]:
+        pos = self._field(index)
+        if not pos:
+            return None
+        pos = self._indirect(pos)
+        length = _u32.unpack_from(self._buf, pos)[0]
+        return str(self._buf[pos + 4:pos + 4 + length], 'utf8')
+
+    def table(self, index: int) -> Optional['_Table']:
+        pos = self._field(index)
+        return _Table(self._buf, self._indirect(pos)) if pos else None
+
+    def vector(self, index: int):
+        # Returns (position of the first element, element count)
+        pos = self._field(index)
+        if not pos:
+            return (0, 0)
+        pos = self._indirect(pos)
+        return (pos + 4, _u32.unpack_from(self._buf, pos)[0])
+
+    def tables(self, index: int) -> List['_Table']:
+        start, count = self.vector(index)
+        return [_Table(self._buf, self._indirect(start + 4 * i)) for i in range(count)]
+
+    def floats(self, index: int):
+        start, count = self.vector(index)
+        data = self._buf[start:start + 4 * count]
+        if len(data) != 4 * count:
+            raise ZcpError('Vector out of range')
+        if sys.byteorder == 'little':
+            return data.cast('f')
+        return list(struct.unpack(f'<{count}f', data))
+
+
+class ZcpPreset:
+    # Zero copy view on a .zcp buffer: fields are decoded on access, the FIR
+    # taps are returned as a float32 memoryview into the buffer.
+
+    def __init__(self, data) -> None:
+        self._buf = memoryview(data).cast('B')
+        if len(self._buf) < 8:
+            raise ZcpError('Buffer too small')
+        self._root = _Table(self._buf, _u32.unpack_from(self._buf, 0)[0])
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ZcpPreset':
+        with open(path, 'rb') as f:
+            return cls(f.read())
+
+    @property
+    def version(self) -> int:
+        return self._root.scalar(0, _u32)
+
+    @property
+    def id(self) -> Optional[str]:
+        return self._root.string(1)
+
+    @property
+    def vendor_id(self) -> int:
+        return self._root.scalar(2, _u32)
+
+    @property
+    def name(self) -> Optional[str]:
+        return self._root.string(3)
+
+    def is_protected(self, param: str) -> bool:
+        return self._root.bool(_PROTECTED_FIELDS[str(param)])
+
+    @property
+    def protected(self) -> List[str]:
+        return [param for param in _PROTECTED_FIELDS if self.is_protected(param)]
+
+    def _block(self, param: str, index: int) -> Optional[_Table]:
+        if self.is_protected(param):
+            return None
+        return self._root.table(index)
+
+    @property
+    def output_mode(self) -> Optional[OutputMode]:
+        t = self._block(PARAM_OUTPUT_MODE, 4)
+        if t is None:
+            return None
+        return _OUTPUT_MODES[t.scalar(0, _u8)]
+
+    @property
+    def output_highpass(self) -> Optional[float]:
+        t = self._block(PARAM_OUTPUT_MODE, 4)
+        if t is None:
+            return None
+        return t.scalar(1, _f32) or None
+
+    @property
+    def polarity(self) -> Optional[int]:
+        t = self._block(PARAM_POLARITY, 6)
+        if t is None:
+            return None
+        return t.scalar(0, _i32)
+
+    @property
+    def delay(self) -> Optional[Delay]:
+        t = self._block(PARAM_DELAY, 8)
+        if t is None:
+            return None
+
+        delay = Delay()
+        time = t.scalar(0, _f32)
+        if time:
+            delay.time = time
+        delay.bypass = t.bool(1)
+        return delay
+
+    @property
+    def equalizer(self) -> Optional[List[Equalizer]]:
+        t = self._block(PARAM_EQUALIZER, 10)
+        if t is None:
+            return None
+
+        bands = []
+        for band in t.tables(0):
+            eq = Equalizer()
+            eq.type = _EQUALIZER_TYPES[band.scalar(0, _u8)]
+            eq.gain = band.scalar(1, _f32)
+            eq.freq = band.scalar(2, _f32)
+            eq.q = band.scalar(3, _f32)
+            eq.bypass = band.bool(4)
+            bands.append(eq)
+        return bands
+
+    @property
+    def crossover(self) -> Optional[Crossover]:
+        t = self._block(PARAM_CROSSOVER, 12)
+        if t is None:
+            return None
+
+        xr = Crossover()
+        xr.gain = t.scalar(0, _f32)
+        xr.lowpass_type = _CROSSOVER_TYPES[t.scalar(1, _u8)]
+        xr.lowpass_freq = t.scalar(2, _f32)
+        xr.highpass_type = _CROSSOVER_TYPES[t.scalar(3, _u8)]
+        xr.highpass_freq = t.scalar(4, _f32)
+        xr.bypass = t.bool(5)
+        return xr
+
+    @property
+    def peak_limiter(self) -> Optional[PeakLimiter]:
+        t = self._block(PARAM_LIMITER, 14)
+        if t is None:
+            return None
+
+        lim = PeakLimiter()
+        lim.bypass = t.bool(0)
+        lim.threshold = t.scalar(1, _f32)
+        lim.attack = t.scalar(2, _f32)
+        lim.release = t.scalar(3, _f32)
+        lim.hold = t.scalar(4, _f32)
+        lim.auto = t.bool(5)
+        lim.knee = t.scalar(6, _f32)
+        return lim
+
+    @property
+    def rms_limiter(self) -> Optional[RmsLimiter]:
+        t = self._block(PARAM_LIMITER, 15)
+        if t is None:
+            return None
+
+        lim = RmsLimiter()
+        lim.threshold = t.scalar(0, _f32)
+        lim.attack = t.scalar(1, _f32)
+        lim.release = t.scalar(2, _f32)
+        lim.hold = t.scalar(3, _f32)
+        lim.knee = t.scalar(4, _f32)
+        lim.bypass = t.bool(5)
+        return lim
+
+    @property
+    def clip_limiter(self) -> Optional[ClipLimiter]:
+        t = self._block(PARAM_LIMITER, 16)
+        if t is None:
+            return None
+
+        lim = ClipLimiter()
+        lim.bypass = t.bool(0)
+        lim.mode = _CLIP_LIMITER_MODES[t.scalar(1, _u8)]
+        return lim
+
+    @property
+    def fir_taps(self):
+        t = self._block(PARAM_FIR, 18)
+        if t is None:
+            return None
+        return t.floats(0)
+
+    @property
+    def fir(self) -> Optional[Fir]:
+        t = self._block(PARAM_FIR, 18)
+        if t is None:
+            return None
+
+        fir = Fir()
+        fir.taps = list(t.floats(0))
+        fir.bypass = t.bool(1)
+        return fir
+
+    def to_dict(self) -> dict:
+        # Same keys as the decode_preset JSON-RPC result
+        if self.name is None or self.id is None:
+            raise ZcpError('Missing preset name or id')
+
+        return {
+            'name': self.name,
+            'id': self.id,
+            'vendorId': self.vendor_id,
+        }
+
+    def to_speaker_preset(self) -> SpeakerPreset:
+        # Protected blocks keep the SpeakerPreset defaults
+        sp = SpeakerPreset()
+
+        if self.output_mode is not None:
+            sp.output_mode = self.output_mode
+            sp.output_highpass = self.output_highpass
+        if self.polarity is not None:
+            sp.polarity = self.polarity
+        if self.delay is not None:
+            sp.delay = self.delay
+        if self.equalizer is not None:
+            sp.equalizer = self.equalizer
+        if self.crossover is not None:
+            sp.crossover = self.crossover
+        if self.peak_limiter is not None:
+            sp.peak_limiter = self.peak_limiter
+            sp.rms_limiter = self.rms_limiter
+            sp.clip_limiter = self.clip_limiter
+        if self.fir is not None:
+            sp.fir = self.fir
+
+        return sp
+
+
+def decode_preset(path: str) -> dict:
+    return ZcpPreset.from_file(path).to_dict()
@@ -0,0 +1,297 @@
+# SPDX-License-Identifier: MIT
+
+# Offline writer for .zcp speaker presets (layout in zcp.py).
+#
+# The buffer is built back to front the way the amplifier's FlatBuffers
+# builder does it, so the output is byte for byte the file create_preset
+# returns for the same preset, name and id:
+#
+#   - objects are written in the order the amplifier creates them: id, name,
+#     output, polarity, delay, equalizer bands, equalizer, crossover,
+#     limiters, FIR and the root table last
+#   - table fields are added largest first, fields of the same size in
+#     reverse slot order; fields equal to their default (0) are left out
+#   - identical vtables are shared
+#
+# Vendor locked presets carry the vendor id of the amplifier that exported
+# them, export those with the amplifier (Connection.create_preset /
+# protect_preset). `vendor_id` and `protect` are there for tests and the
+# amplifier stand-in.
+#
+#   data = encode_preset(sp, 'preset')
+#   write_presets(presets, [f'out/{i}.zcp' for i in range(len(presets))])
+
+import os
+import struct
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional, Sequence, Union
+
+from preset import *
+from preset_array import PresetArray, _index
+from zcp import _OUTPUT_MODES, _PROTECTED_FIELDS, _f32, _i32, _u8, _u16, _u32
+
+VERSION = 100
+
+# Presets per task of write_presets()
+CHUNK_SIZE = 64
+
+
+class _Builder:
+    # Minimal FlatBuffers builder. Offsets are counted from the end of the
+    # buffer, which is filled from the back.
+
+    def __init__(self, size: int = 4096) -> None:
+        self._buf = bytearray(size)
+        self._head = size
+        self._minalign = 1
+        self._vtables: List[int] = []
+        self._fields: List[tuple] = []
+        self._max_voffset = 0
+        self._start = 0
+
+    def size(self) -> int:
+        return len(self._buf) - self._head
+
+    def _reserve(self, n: int) -> None:
+        while self._head < n:
+            old = len(self._buf)
+            buf = bytearray(2 * old)
+            buf[old:] = self._buf
+            self._buf = buf
+            self._head += old
+
+    def _pad(self, n: int) -> None:
+        if n:
+            self._reserve(n)
+            self._head -= n
+            self._buf[self._head:self._head + n] = bytes(n)
+
+    def _prealign(self, length: int, alignment: int) -> None:
+        if alignment > self._minalign:
+            self._minalign = alignment
+        self._pad(-(len(self._buf) - self._head + length) % alignment)
+
+    def _push(self, fmt: struct.Struct, value) -> int:
+        self._prealign(0, fmt.size)
+        self._reserve(fmt.size)
+        self._head -= fmt.size
+        fmt.pack_into(self._buf, self._head, value)
+        return self.size()
+
+    def _push_bytes(self, data: bytes) -> None:
+        self._reserve(len(data))
+        self._head -= len(data)
+        self._buf[self._head:self._head + len(data)] = data
+
+    def _refer_to(self, off: int) -> int:
+        self._prealign(0, 4)
+        return self.size() - off + 4
+
+    def string(self, s: str) -> int:
+        data = s.encode('utf8')
+        self._prealign(len(data) + 1, 4)
+        self._pad(1)
+        self._push_bytes(data)
+        return self._push(_u32, len(data))
+
+    def floats(self, data: bytes) -> int:
+        # data: packed little endian float32
+        self._prealign(len(data), 4)
+        self._push_bytes(data)
+        return self._push(_u32, len(data) // 4)
+
+    def offsets(self, offs: Sequence[int]) -> int:
+        self._prealign(4 * len(offs), 4)
+        for off in reversed(offs):
+            self._push(_u32, self._refer_to(off))
+        return self._push(_u32, len(offs))
+
+    def start(self) -> None:
+        self._fields = []
+        self._max_voffset = 0
+        self._start = self.size()
+
+    def add(self, index: int, fmt: struct.Struct, value, default=0) -> None:
+        if value == default:
+            return
+        self._track(index, self._push(fmt, value))
+
+    def add_offset(self, index: int, off: Optional[int]) -> None:
+        if off:
+            self._track(index, self._push(_u32, self._refer_to(off)))
+
+    def _track(self, index: int, off: int) -> None:
+        voffset = 4 + 2 * index
+        self._fields.append((voffset, off))
+        self._max_voffset = max(self._max_voffset, voffset)
+
+    def end(self) -> int:
+        table = self._push(_i32, 0)
+        vsize = max(self._max_voffset + 2, 4)
+        self._pad(vsize)
+        vt = self._head
+        _u16.pack_into(self._buf, vt, vsize)
+        _u16.pack_into(self._buf, vt + 2, table - self._start)
+        for voffset, off in self._fields:
+            _u16.pack_into(self._buf, vt + voffset, table - off)
+
+        vtable = bytes(self._buf[vt:vt + vsize])
+        use = self.size()
+        for old in self._vtables:
+            pos = len(self._buf) - old
+            if self._buf[pos:pos + vsize] == vtable:
+                use = old
+                self._head += vsize
+                break
+        else:
+            self._vtables.append(use)
+
+        _i32.pack_into(self._buf, len(self._buf) - table, use - table)
+        return table
+
+    def finish(self, root: int) -> bytes:
+        self._prealign(4, self._minalign)
+        self._push(_u32, self._refer_to(root))
+        return bytes(self._buf[self._head:])
+
+
+def _table(b: _Builder, fields) -> int:
+    # fields: (slot, struct or None for offsets, value). Added largest first,
+    # same size in reverse slot order.
+    b.start()
+    size = lambda f: 4 if f[1] is None else f[1].size
+    for index, fmt, value in sorted(fields, key=lambda f: (-size(f), -f[0])):
+        if fmt is None:
+            b.add_offset(index, value)
+        else:
+            b.add(index, fmt, value)
+    return b.end()
+
+
+def encode_preset(sp: SpeakerPreset, name: str, preset_id: Optional[str] = None,
+                  vendor_id: int = 0, protect: Iterable[str] = ()) -> bytes:
+    # preset_id: UUID string, a new random one if None. protect: parameter
+    # blocks to flag as protected, see zcp.PARAM_*
+    if preset_id is None:
+        preset_id = str(uuid.uuid4())
+
+    taps = pack_taps(sp.fir.taps)
+    b = _Builder(len(taps) + 1024)
+
+    id_off = b.string(preset_id)
+    name_off = b.string(name)
+
+    output = _table(b, [
+        (0, _u8, _OUTPUT_MODES.index(sp.output_mode)),
+        (1, _f32, sp.output_highpass or 0),
+    ])
+    polarity = _table(b, [(0, _i32, sp.polarity)])
+    delay = _table(b, [
+        (0, _f32, sp.delay.time),
+        (1, _u8, sp.delay.bypass),
+    ])
+
+    bands = [_table(b, [
+        (0, _u8, _index(eq.type)),
+        (1, _f32, eq.gain),
+        (2, _f32, eq.freq),
+        (3, _f32, eq.q),
+        (4, _u8, eq.bypass),
+    ]) for eq in sp.equalizer]
+    equalizer = _table(b, [(0, None, b.offsets(bands))])
+
+    xr = sp.crossover
+    crossover = _table(b, [
+        (0, _f32, xr.gain),
+        (1, _u8, _index(xr.lowpass_type)),
+        (2, _f32, xr.lowpass_freq),
+        (3, _u8, _index(xr.highpass_type)),
+        (4, _f32, xr.highpass_freq),
+        (5, _u8, xr.bypass),
+    ])
+
+    peak = sp.peak_limiter
+    peak_limiter = _table(b, [
+        (0, _u8, peak.bypass),
+        (1, _f32, peak.threshold),
+        (2, _f32, peak.attack),
+        (3, _f32, peak.release),
+        (4, _f32, peak.hold),
+        (5, _u8, peak.auto),
+        (6, _f32, peak.knee),
+    ])
+
+    rms = sp.rms_limiter
+    rms_limiter = _table(b, [
+        (0, _f32, rms.threshold),
+        (1, _f32, rms.attack),
+        (2, _f32, rms.release),
+        (3, _f32, rms.hold),
+        (4, _f32, rms.knee),
+        (5, _u8, rms.bypass),
+    ])
+
+    clip_limiter = _table(b, [
+        (0, _u8, sp.clip_limiter.bypass),
+        (1, _u8, _index(sp.clip_limiter.mode)),
+    ])
+
+    fir = _table(b, [
+        (0, None, b.floats(taps)),
+        (1, _u8, sp.fir.bypass),
+    ])
+
+    root = _table(b, [
+        (0, _u32, VERSION),
+        (1, None, id_off),
+        (2, _u32, vendor_id),
+        (3, None, name_off),
+        (4, None, output),
+        (6, None, polarity),
+        (8, None, delay),
+        (10, None, equalizer),
+        (12, None, crossover),
+        (14, None, peak_limiter),
+        (15, None, rms_limiter),
+        (16, None, clip_limiter),
+        (18, None, fir),
+    ] + [(_PROTECTED_FIELDS[str(param)], _u8, True) for param in protect])
+    return b.finish(root)
+
+
+def write_preset(path: str, sp: SpeakerPreset, name: Optional[str] = None,
+                 preset_id: Optional[str] = None) -> None:
+    # name defaults to the file name without extension, like create_preset
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+    data = encode_preset(sp, name, preset_id)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _write_chunk(presets: PresetArray, paths: List[str], names: List[Optional[str]]) -> int:
+    for i, path in enumerate(paths):
+        write_preset(path, presets.preset(i), names[i])
+    return len(paths)
+
+
+def write_presets(presets: Union[PresetArray, Iterable[SpeakerPreset]], paths: Sequence[str],
+                  names: Optional[Sequence[str]] = None, workers: Optional[int] = None,
+                  chunk_size: int = CHUNK_SIZE) -> int:
+    # Writes presets[i] to paths[i] in `workers` processes (default: one per
+    # CPU), every file gets a new id. Returns the number of files written.
+    if not isinstance(presets, PresetArray):
+        presets = PresetArray.from_presets(presets)
+    if len(paths) != len(presets) or (names is not None and len(names) != len(presets)):
+        raise ValueError('Length of paths or names does not match the presets')
+    if names is None:
+        names = [None] * len(presets)
+
+    chunks = [(presets[i:i + chunk_size], list(paths[i:i + chunk_size]), list(names[i:i + chunk_size]))
+              for i in range(0, len(presets), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        return sum(_write_chunk(*chunk) for chunk in chunks)
+
+    with ProcessPoolExecutor(workers) as pool:
+        return sum(pool.map(_write_chunk, *zip(*chunks)))